@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from metrics import metrics
+from state import get_backend
+
+logger = logging.getLogger(__name__)
+
+
+class Admission:
+    """A player's place among the running adventures: a session slot until release(), and a
+    bootstrap slot until bootstrapped() (the bootstrap pipeline's calls are done) or release()"""
+
+    def __init__(self, control: "AdmissionControl", player):
+        self.control = control
+        self.player = player
+        self.bootstrapping = True
+        self.released = False
+
+    def bootstrapped(self):
+        if self.bootstrapping and not self.released:
+            self.bootstrapping = False
+            self.control.bootstrapping -= 1
+            self.control._admit_waiting()
+
+    def release(self):
+        if self.released:
+            return
+        self.bootstrapped()
+        self.released = True
+        self.control.active -= 1
+        self.control._admit_waiting()
+
+
+class _Waiter:
+    __slots__ = ("player", "resuming", "future", "enqueued_at")
+
+    def __init__(self, player, resuming: bool, future: asyncio.Future):
+        self.player = player
+        self.resuming = resuming
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionControl:
+    """Caps how many adventures run at once in this worker and how many may be bootstrapping
+    (the burst of calls the bootstrap pipeline starts at !start: theme header, first battle
+    and opening story) at the same time. Players beyond either cap wait in a FIFO queue and
+    are told their position; players who finished an adventure within resume_window seconds
+    (on any worker) are queued ahead of new ones. A cap of 0 means no limit."""
+
+    def __init__(self, max_sessions: int = 50, max_bootstraps: int = 4, update_interval: float = 15.0,
+                 resume_window: float = 600.0):
+        self.max_sessions = max_sessions
+        self.max_bootstraps = max_bootstraps
+        self.update_interval = update_interval  # at most one position update per player this often
+        self.resume_window = resume_window
+        self.active = 0
+        self.bootstrapping = 0
+        self.resuming = deque()
+        self.new = deque()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionControl":
+        """ADVENTURE_MAX_SESSIONS (50), ADVENTURE_MAX_BOOTSTRAPS (4) and ADVENTURE_RESUME_WINDOW (600s)"""
+        return cls(max_sessions=int(os.getenv("ADVENTURE_MAX_SESSIONS", "50")),
+                   max_bootstraps=int(os.getenv("ADVENTURE_MAX_BOOTSTRAPS", "4")),
+                   resume_window=float(os.getenv("ADVENTURE_RESUME_WINDOW", "600")))
+
+    def queue_length(self) -> int:
+        return len(self.resuming) + len(self.new)
+
+    def position(self, waiter: _Waiter) -> int:
+        """1-based place in line"""
+        if waiter.resuming:
+            return self.resuming.index(waiter) + 1
+        return len(self.resuming) + self.new.index(waiter) + 1
+
+    def has_room(self) -> bool:
+        return ((not self.max_sessions or self.active < self.max_sessions)
+                and (not self.max_bootstraps or self.bootstrapping < self.max_bootstraps))
+
+    def _grant(self, player) -> Admission:
+        self.active += 1
+        self.bootstrapping += 1
+        self._report()
+        return Admission(self, player)
+
+    def _admit_waiting(self):
+        while self.has_room() and self.queue_length():
+            waiter = (self.resuming or self.new).popleft()
+            if not waiter.future.done():
+                waiter.future.set_result(self._grant(waiter.player))
+        self._report()
+
+    def _report(self):
+        metrics.gauge("admission.active_sessions", self.active)
+        metrics.gauge("admission.bootstrapping", self.bootstrapping)
+        metrics.gauge("admission.queue_length", self.queue_length())
+
+    async def admit(self, player, resuming: bool = False,
+                    notify: Optional[Callable[[int], Awaitable]] = None) -> Admission:
+        """Wait for room to start player's adventure. notify(position) is awaited when the
+        player has to queue and then whenever their place changes (at most every
+        update_interval seconds). Cancelling the caller leaves the queue."""
+        kind = "resuming" if resuming else "new"
+        if self.has_room() and not self.queue_length():
+            metrics.observe("admission.wait", 0.0, kind=kind)
+            return self._grant(player)
+
+        waiter = _Waiter(player, resuming, asyncio.get_running_loop().create_future())
+        (self.resuming if resuming else self.new).append(waiter)
+        metrics.incr("admission.queued", kind=kind)
+        self._report()
+        logger.info("Player %s queued for an adventure at position %d", player, self.position(waiter),
+                    extra={"event": "admission.queued", "resuming": resuming})
+        try:
+            told = None
+            while not waiter.future.done():
+                position = self.position(waiter)
+                if notify is not None and position != told:
+                    told = position
+                    await notify(position)
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), self.update_interval)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                waiter.future.result().release()  # admitted just as the player gave up
+            else:
+                waiter.future.cancel()
+                (self.resuming if resuming else self.new).remove(waiter)
+                metrics.incr("admission.abandoned", kind=kind)
+                self._report()
+            raise
+        metrics.observe("admission.wait", time.monotonic() - waiter.enqueued_at, kind=kind)
+        return waiter.future.result()
+
+    @staticmethod
+    def _played_key(player) -> str:
+        return f"admission:played:{player}"
+
+    async def is_resuming(self, player) -> bool:
+        try:
+            return bool(await get_backend().get(self._played_key(player)))
+        except Exception as e:
+            logger.warning("Could not look up player %s's last adventure: %s", player, e)
+            return False
+
+    async def finished(self, player):
+        """Remember that player just played, so a new !start soon after counts as resuming"""
+        try:
+            await get_backend().set(self._played_key(player), True, ttl=self.resume_window)
+        except Exception as e:
+            logger.warning("Could not record player %s's adventure: %s", player, e)
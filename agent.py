@@ -1,51 +1,230 @@
 import os
-from mistralai import Mistral
-import discord
 import json
+import discord
 import random
 import time
 import asyncio
 from typing import Dict
-import re
+import logging
+
+from scheduler import LLMScheduler, DeadlineExceeded, INTERACTIVE, STORY, BACKGROUND, current_guild
+from budget import TokenBudget, BudgetExhausted, ECONOMY, LOCAL
+from metrics import metrics
+from tracing import span
+from recording import current_recorder
+from batching import MicroBatcher
+from similarity_cache import SimilarityCache
+from state import get_backend, DistributedTokenBucket
+from concurrency import retry_after
+from key_pool import KeyPool, failure_status
+from hedging import HedgePolicy
+from session_scope import current_deadline, remaining
+from schemas import parse, response_format, MONSTER, SHOP_ITEMS, ATTACK_SCORE, ATTACK_SCORES, CHARACTER, STORY_ARC, ENCOUNTER
+
+logger = logging.getLogger(__name__)
 
 MISTRAL_MODEL = "mistral-large-latest"
+SMALL_MODEL = "mistral-small-latest"  # Used instead of MISTRAL_MODEL when the token budget runs low
+ATTACK_SYSTEM_PROMPT = "You are a combat AI that rates attack effectiveness from 3 to 10 based on power, technique, and impact."
 SYSTEM_PROMPT = "You are a Dungeons and Dragons game teller. Be creative and have fun! Do not repeat stories. You should be amenable to user's prompts (the first line of every request). The story should try to adhere to the themes of the user stated theme, even if not necessairly a D&D theme. Be creative."
 
 
 class MistralAgent:
     def __init__(self):
-        MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
-
-        self.client = Mistral(api_key=MISTRAL_API_KEY)
-        print("Mistral client initialized")
-        
-        # Rate limiting parameters
-        self.last_request_time = 0
-        self.min_request_interval = 1.5  # Minimum 1 second between requests
-
-
-
-    async def rate_limit(self):
-        """Ensure we don't exceed rate limits by waiting if needed; Rate Limiting Parameters established on INIT"""
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
-        
-        if time_since_last_request < self.min_request_interval:
-            # Calculate how much longer we need to wait
-            wait_time = self.min_request_interval - time_since_last_request
-            print(f"Rate limiting: Waiting {wait_time:.2f} seconds before next API call")
-            await asyncio.sleep(wait_time)
-        
-        # Update the last request time
-        self.last_request_time = time.time()
+        # One client per API key / server (MISTRAL_API_KEY, or a pool from MISTRAL_API_KEYS or
+        # MISTRAL_ENDPOINTS; MISTRAL_SERVER_URL points them elsewhere, e.g. at mistral_standin.py),
+        # each with its own learned concurrency limit and health
+        self.keys = KeyPool.from_env()
+        logger.info("Mistral client initialized")
+
+        # Rate limiting: rather than spacing requests by a fixed guess, the scheduler lets up to
+        # a learned number of requests run at once per key (AIMD on 429s, capped by rate-limit
+        # headers); it also orders them by priority class and shares capacity fairly between
+        # guilds. MISTRAL_MIN_INTERVAL adds a fixed spacing on top (the old behaviour used 1.5s).
+        self.min_request_interval = float(os.getenv("MISTRAL_MIN_INTERVAL", "0"))
+        self.scheduler = LLMScheduler(min_interval=self.min_request_interval, concurrency=self.keys)
+        # A throttled request (or, with several keys, a failed one) is queued again this many
+        # times before the error reaches the caller
+        self.throttle_retries = 3
+        # Optionally race slow interactive requests against a duplicate (HEDGE_REQUESTS=1)
+        self.hedging = HedgePolicy.from_env()
+        self.state = get_backend()
+        if self.state.shared:
+            # Several workers share one Mistral quota: every request also needs a token from a
+            # bucket they all draw from (MISTRAL_RPS requests per second in total)
+            rate = float(os.getenv("MISTRAL_RPS", "0.67"))
+            self.scheduler.rate_limiter = DistributedTokenBucket(self.state, "ratelimit:mistral", rate,
+                                                                 capacity=float(os.getenv("MISTRAL_BURST", "1")))
+
+        # How long a request may wait in the queue before it is dropped, per priority class
+        self.queue_timeouts = {INTERACTIVE: 20.0, STORY: 60.0, BACKGROUND: 120.0}
+
+        # Token accounting; as budgets fill up, calls degrade to cheaper paths
+        self.budget = TokenBudget.from_env()
+
+        # Attacks from all running battles are scored together: descriptions arriving within
+        # max_wait seconds of each other share one request instead of one request each
+        self.attack_batcher = MicroBatcher(self._score_attack_batch, max_batch=16, max_wait=0.1,
+                                           fallback=self._score_attack, name="attack_scoring")
+
+        # Players repeat the same attacks and guilds start near-identical themes; close enough
+        # matches reuse an earlier result (thresholds are Jaccard similarity of normalized text)
+        self.attack_cache = SimilarityCache("attack_scores", threshold=float(os.getenv("ATTACK_CACHE_THRESHOLD", "0.75")),
+                                            ttl=6 * 3600)
+        self.theme_cache = SimilarityCache("theme_headers", threshold=float(os.getenv("THEME_CACHE_THRESHOLD", "0.85")),
+                                           ttl=24 * 3600)
+
+    @property
+    def client(self):
+        """The first key's client"""
+        return self.keys.endpoints[0].client
+
+    async def close(self):
+        """Stop the scheduler and close every endpoint's connections"""
+        await self.scheduler.close()
+        await self.keys.close()
+
+    def degradation_level(self, guild=None) -> int:
+        """Budget degradation level (budget.NORMAL ... budget.LOCAL) for a guild, defaulting to the current one"""
+        if guild is None:
+            guild = current_guild.get()
+        return self.budget.level(guild)
+
+    async def _complete(self, messages, priority: int = STORY, timeout: float = None, method: str = None,
+                        hedge: bool = None, **options):
+        """Send a chat completion once the scheduler grants this request a slot.
+        timeout bounds how long the request may wait in the queue; defaults per priority class.
+        Within a turn deadline (session_scope.turn_deadline) the request is also dropped or
+        cancelled once the deadline passes. method names the calling agent method in traces. With HEDGE_REQUESTS=1, hedge (by
+        default: interactive requests) lets a slow request be raced by a duplicate (see
+        hedging.HedgePolicy). Other options (e.g. response_format) are passed to the API."""
+        if timeout is None:
+            timeout = self.queue_timeouts[priority]
+        guild = current_guild.get()
+        level = self.degradation_level(guild)
+        if level >= LOCAL:
+            raise BudgetExhausted(f"Token budget used up for guild {guild}")
+        model = SMALL_MODEL if level >= ECONOMY else MISTRAL_MODEL
+
+        deadline = time.monotonic() + timeout
+        if current_deadline.get() is not None:
+            deadline = min(deadline, current_deadline.get())
+        if hedge is None:
+            hedge = priority == INTERACTIVE
+        if hedge and self.hedging is not None:
+            return await self._hedged(messages, priority, guild, deadline, model, method, options)
+        return await self._attempt(messages, priority, guild, deadline, model, method, options)
+
+    async def _attempt(self, messages, priority, guild, deadline, model, method, options):
+        """One request through the scheduler, queued again after a 429 (or, with several keys,
+        an error) up to throttle_retries times"""
+        start = time.monotonic()
+        for attempt in range(self.throttle_retries + 1):
+            with span("llm.queue", method=method):
+                lease = await self.scheduler.acquire(priority, guild=guild, deadline=deadline)
+            endpoint = getattr(lease, "endpoint", None)
+            try:
+                with span("llm.call", method=method, model=model, endpoint=endpoint and endpoint.name):
+                    response = await asyncio.wait_for(
+                        self._send(model, messages, method, client=endpoint and endpoint.client, **options),
+                        remaining())
+            except asyncio.TimeoutError:
+                # The turn's deadline passed mid-request: nothing will use the answer
+                self.scheduler.release(lease, "cancelled")
+                metrics.incr("llm.deadline_cancelled", method=method)
+                raise DeadlineExceeded(f"[{method}] turn deadline passed during the request") from None
+            except Exception as e:
+                status = failure_status(e)
+                wait = retry_after(getattr(e, "headers", None)) if status == "throttled" else None
+                self.scheduler.release(lease, status, wait)
+                retryable = status == "throttled" or (status == "error" and len(self.keys) > 1)
+                if not retryable or attempt == self.throttle_retries:
+                    raise
+                logger.info("[%s] %s, queueing again (attempt %d)", method, status, attempt + 1,
+                            extra={"event": "llm.retry", "method": method})
+                continue
+            except asyncio.CancelledError:
+                self.scheduler.release(lease, "cancelled")
+                raise
+            self.scheduler.release(lease)
+            if endpoint is not None:
+                self.keys.record_usage(lease, response)
+            break
+        if self.hedging is not None:
+            self.hedging.observe(method, time.monotonic() - start)
+        self.budget.record_response(guild, model, response)
+        return response
+
+    async def _hedged(self, messages, priority, guild, deadline, model, method, options):
+        """Race the request against a duplicate sent once it is slower than usual; the first
+        success wins and the other is cancelled"""
+        self.hedging.request()
+        start = time.monotonic()
+        primary = asyncio.ensure_future(self._attempt(messages, priority, guild, deadline, model, method, options))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedging.delay(method))
+            if done or not self.hedging.allow(self.scheduler, method):
+                return await primary
+            metrics.incr("llm.hedges", method=method)
+            logger.debug("[%s] no response after %.2fs, hedging", method, time.monotonic() - start,
+                         extra={"event": "llm.hedge", "method": method})
+            hedge = asyncio.ensure_future(self._attempt(messages, priority, guild, deadline,
+                                                        self.hedging.model or model, method, options))
+            tasks.add(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    winner = primary if primary in winners else hedge
+                    metrics.incr("llm.hedge_wins", method=method, winner="primary" if winner is primary else "hedge")
+                    if winner is hedge and not primary.done():
+                        # The abandoned original still says something about this method's tail
+                        self.hedging.observe(method, time.monotonic() - start)
+                    return winner.result()
+            return primary.result()  # both failed: raise the original's error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _send(self, model, messages, method=None, client=None, **options):
+        """The actual API call, through client (by default the first key's); records the
+        response when the session is being recorded"""
+        recorder = current_recorder.get()
+        start = time.perf_counter()
+        try:
+            response = await (client or self.client).chat.complete_async(
+                model=model,
+                messages=messages,
+                **options
+            )
+        except Exception as e:
+            if recorder is not None:
+                recorder.record_llm(method, model, messages, None, time.perf_counter() - start, error=type(e).__name__)
+            raise
+        if recorder is not None:
+            recorder.record_llm(method, model, messages, response.choices[0].message.content,
+                                time.perf_counter() - start, getattr(response, "usage", None))
+        return response
+
+    async def _complete_json(self, messages, schema, priority: int, method: str):
+        """A completion in the API's JSON mode, read against schema (see schemas.parse): the
+        result's data always matches the schema, with invalid fields repaired"""
+        output_format = response_format(schema)
+        if output_format is None:
+            response = await self._complete(messages, priority=priority, method=method)
+        else:
+            response = await self._complete(messages, priority=priority, method=method, response_format=output_format)
+        content = response.choices[0].message.content
+        logger.debug("%s response: %s...", method, content[:100], extra={"event": "llm.response"})
+        with span("llm.parse", method=method):
+            return parse(content, schema, method)
 
     """
     This is the default method for the MistralAgent class. It sends a message to the Mistral API and returns the response.
     Not used for our project."""
     async def run(self, message: discord.Message):
-        # Apply rate limiting before making the API call
-        await self.rate_limit()
-        
         try:
             # The simplest form of an agent
             # Send the message's content to Mistral's API and return Mistral's response
@@ -54,22 +233,16 @@ class MistralAgent:
                 {"role": "user", "content": message.content},
             ]
 
-            response = await self.client.chat.complete_async(
-                model=MISTRAL_MODEL,
-                messages=messages,
-            )
+            response = await self._complete(messages, priority=INTERACTIVE, method="run")
 
             return response.choices[0].message.content
         except Exception as e:
-            print(f"Error in run method: {e}")
+            logger.error("Error in run method: %s", e)
             return "I'm sorry, I encountered an error processing your request. Please try again."
 
     async def generate_monster_template(self, existing_templates, story_info) -> Dict:
         """Generate a monster template using the Mistral API with rate limiting
         This function passes prior information of existing monster templates and prior story information to the API"""
-        # Apply rate limiting before making the API call
-        await self.rate_limit()
-        
         prompt = """Generate a fantasy monster with the following attributes. Be imaginative. Return only a JSON string object with no other text in the following format:
             {
                 "name": "unique monster name relevant to the story",
@@ -92,37 +265,15 @@ class MistralAgent:
                 {"role": "user", "content": prompt}
             ]
 
-            response = await self.client.chat.complete_async(
-                model=MISTRAL_MODEL,
-                messages=messages,
-            )
-            
-            # Access the content directly from the response object
-            content = response.choices[0].message.content
-            print(f"Monster template response: {content[:100]}...")  # Print first 100 chars to avoid flooding console
-
-            # Parse the JSON string contained in the response content
-            return json.loads(content)
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {e}")
-            print(f"Raw content: {content}")
-            # Fallback to a default monster if parsing fails
-            return {
-                "name": f"Mystery Creature {random.randint(1, 100)}",
-                "hp": random.randint(20, 100),
-                "attack": random.randint(5, 15),
-                "defense": random.randint(2, 8)
-            }
+            result = await self._complete_json(messages, MONSTER, BACKGROUND, "generate_monster_template")
+            return result.data
         except Exception as e:
-            print(f"Error generating monster: {e}")
+            logger.error("Error generating monster: %s", e)
             return None
         
     async def generate_village_items(self, existing_items=None, story_info=None) -> Dict:
         """Generate a village shop inventory using the Mistral API with rate limiting
         This function passes prior information of existing items and prior story information to the API"""
-        # Apply rate limiting before making the API call
-        await self.rate_limit()
-        
         prompt = """Generate 3-4 unique items available in a fantasy village shop. Be imaginative. Return only a JSON string object with no other text in the following format:
             {
                 "items": [
@@ -147,45 +298,71 @@ class MistralAgent:
                 {"role": "user", "content": prompt}
             ]
 
-            response = await self.client.chat.complete_async(
-                model=MISTRAL_MODEL,
-                messages=messages,
-            )
-            
-            # Access the content directly from the response object
-            content = response.choices[0].message.content
-            print(f"Village items response: {content[:100]}...")  # Print first 100 chars to avoid flooding console
-
-            # Parse the JSON string contained in the response content
-            return json.loads(content)
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {e}")
-            print(f"Raw content: {content}")
-            # Fallback to default items if parsing fails
-            return {
-                "items": [
-                    {
-                        "name": "Basic Health Potion",
-                        "price": random.randint(10, 25),
-                        "description": "A simple healing potion that restores some health",
-                        "type": "Potion"
-                    },
-                    {
-                        "name": "Iron Dagger",
-                        "price": random.randint(15, 30),
-                        "description": "A basic but reliable weapon",
-                        "type": "Weapon"
-                    }
-                ]
-            }
+            result = await self._complete_json(messages, SHOP_ITEMS, BACKGROUND, "generate_village_items")
+            return result.data
         except Exception as e:
-            print(f"Error generating village items: {e}")
+            logger.error("Error generating village items: %s", e)
             return None
     
-    async def estimate_attack_damage(self, attack: int, defense: int, user_attack: str) -> int:
-        """Estimate the damage done (3-10) based on user attack input using the Mistral API"""
-        await self.rate_limit()  # Ensure rate limiting is applied
+    async def estimate_attack_damage(self, attack: int, defense: int, user_attack: str, rng=random) -> int:
+        """Estimate the damage done (3-10) based on user attack input using the Mistral API.
+        rng (the session's, so a replay draws the same) varies scores that are not the model's."""
+        if self.degradation_level() >= LOCAL:
+            # Out of budget: score the attack locally instead
+            return int(attack - defense) * rng.randint(3, 10) / 4
+
+        try:
+            damage_score = self._cached(self.attack_cache, user_attack)
+            if damage_score is None:
+                damage_score, trusted = await self._batched_attack_score(user_attack)
+                if trusted:
+                    # Never a schema fallback: that would hand out a random score for hours
+                    self.attack_cache.put(user_attack, damage_score)
+            else:
+                # Same attack as before, but don't make every swing of it hit identically
+                damage_score = max(3, min(10, damage_score + rng.choice((-1, 0, 0, 1))))
+            score = int(attack - defense) * damage_score
+            return score / 4
+
+        except (DeadlineExceeded, asyncio.TimeoutError) as e:
+            # The request expired in the queue or the turn's deadline passed; don't keep the player waiting any longer
+            logger.warning("Attack scoring dropped: %s", e)
+            return rng.randint(3, 10)  # Fallback to a random score
 
+        except Exception as e:
+            logger.error("Error estimating attack damage: %s", e)
+            return -1  # Indicate an error occurred
+
+    def _cached(self, cache, key):
+        """cache's value for key, or None. Replays start with empty caches, so the lookup
+        is recorded for them to answer the same way (see replay.RecordedCache)."""
+        value = cache.get(key)
+        recorder = current_recorder.get()
+        if recorder is not None:
+            recorder.record_cache_lookup(cache.name, key, value)
+        return value
+
+    async def _batched_attack_score(self, user_attack: str):
+        """Score an attack through the batcher: (score, whether the model's answer was valid
+        as given). The batch runs outside this session's context, so the wait is bounded by
+        the turn's deadline here, and the score is recorded for this session as if it had been
+        a request of its own (replays score attacks one by one)."""
+        recorder = current_recorder.get()
+        start = time.perf_counter()
+        try:
+            damage_score, trusted = await asyncio.wait_for(self.attack_batcher.submit(user_attack), remaining())
+        except Exception as e:
+            if recorder is not None and not isinstance(e, asyncio.TimeoutError):
+                recorder.record_llm("estimate_attack_damage", MISTRAL_MODEL, self._attack_messages(user_attack), None,
+                                    time.perf_counter() - start, error=type(e).__name__)
+            raise
+        if recorder is not None:
+            recorder.record_llm("estimate_attack_damage", MISTRAL_MODEL, self._attack_messages(user_attack),
+                                json.dumps({"damage_score": damage_score}), time.perf_counter() - start)
+        return damage_score, trusted
+
+    @staticmethod
+    def _attack_messages(user_attack: str):
         prompt = f"""Rate the effectiveness of the following attack on a scale from 3 to 10 based on its power, technique, and potential damage. Respond with only a JSON object in this format:
         {{
             "damage_score": number between 3-10
@@ -193,90 +370,118 @@ class MistralAgent:
 
         Attack description: "{user_attack}" 
         """
+        return [
+            {"role": "system", "content": ATTACK_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+
+    async def _score_attack(self, user_attack: str):
+        """Score one attack description from 3 to 10: (score, whether it needed no repair)"""
+        messages = self._attack_messages(user_attack)
+        result = await self._complete_json(messages, ATTACK_SCORE, INTERACTIVE, "estimate_attack_damage")
+        logger.debug("Attack scored", extra={"event": "attack.response", "attack": user_attack, "response": result.data})
+        return result.data["damage_score"], result.parsed and not result.repaired
+
+    async def _score_attack_batch(self, attacks):
+        """Score several attack descriptions with one request, as _score_attack does each.
+        Raises ValueError when the response can't be matched back to the attacks, so the
+        batcher retries them singly."""
+        if len(attacks) == 1:
+            return [await self._score_attack(attacks[0])]
+        # One request serves battles in several guilds, so it is queued and accounted globally
+        current_guild.set(None)
+
+        listing = "\n".join(f"{i}. \"{attack}\"" for i, attack in enumerate(attacks, 1))
+        prompt = f"""Rate the effectiveness of each of the following {len(attacks)} attacks on a scale from 3 to 10 based on its power, technique, and potential damage. Rate every attack independently. Respond with only a JSON object in this format, with one score per attack in the order given:
+        {{
+            "scores": [number between 3-10, ...]
+        }}
 
-        try:
-            messages = [
-                {"role": "system", "content": "You are a combat AI that rates attack effectiveness from 3 to 10 based on power, technique, and impact."},
-                {"role": "user", "content": prompt}
-            ]
-
-            response = await self.client.chat.complete_async(
-                model=MISTRAL_MODEL,
-                messages=messages,
-            )
-
-            # Extract response content
-            content = response.choices[0].message.content.strip()
-
-            # 🛠 FIX 1: Remove Markdown formatting like ```json ```
-            if content.startswith("```json"):
-                content = content[7:-3].strip()  # Remove ```json and trailing ```
-            elif content.startswith("```"):
-                content = content[3:-3].strip()  # Remove ``` and trailing ```
-
-            # 🛠 FIX 2: Remove invalid backslashes before parsing
-            content = re.sub(r"\\_", "_", content)  # Fix incorrect `\_` escape sequences
-
-            print(f"User attack input: {user_attack}")
-            print(f"Attack damage response (cleaned): {content}")  # Debugging print
-
-            # 🛠 FIX 3: Handle empty response
-            if not content:
-                print("Warning: Empty API response!")
-                return random.randint(3, 10)  # Fallback to a random score
-
-            # Parse JSON response
-            damage_data = json.loads(content)
-
-            # Ensure damage is within 3-10 range
-            # score = max(3, min(10, damage_data.get("damage_score", 3)))  # Ensures minimum of 3
-            score = int(attack - defense) * max(3, min(10, damage_data.get("damage_score", 3)))
-            return score / 4
-
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {e}")
-            print(f"Raw content: {content}")  # Show actual response
-            return random.randint(3, 10)  # Fallback to a random score
+        Attack descriptions:
+{listing}
+        """
+        messages = [
+            {"role": "system", "content": ATTACK_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+
+        with span("attack.batch", size=len(attacks)):
+            result = await self._complete_json(messages, ATTACK_SCORES, INTERACTIVE, "estimate_attack_damage_batch")
+        scores = result.data["scores"]
+        if not result.parsed or len(scores) != len(attacks):
+            raise ValueError(f"Expected {len(attacks)} scores, got {len(scores)} ({result.outcome})")
+        return [(score, f"scores[{i}]" not in result.repaired) for i, score in enumerate(scores)]
 
-        except Exception as e:
-            print(f"Error estimating attack damage: {e}")
-            return -1  # Indicate an error occurred
-    
     "Generates a story segment using Mistral's API; called on entry to a battle. This function passes prior story information to the API, and the current Battle Class State to the API"
     async def generate_story(self, story_info, battle_info: dict):
-        # Apply rate limiting before making the API call
-        await self.rate_limit()
-        
         try:
+            # The monsters' stats, rather than Monster reprs the model can't read
+            monsters = [{"name": monster.name, "hp": monster.max_hp, "attack": monster.attack, "defense": monster.defense}
+                        for monster in battle_info["monsters"]]
             # Generate a story prompt using Mistral's API
-            content = "Previous Stories: " + str(story_info) + "\n" + "Battle Info: " + str(battle_info) + "\n" + "Generate a story prompt that makes sense for the given battle_information and previous stories. Keep your response concise and engaging. Less then 100 words. The story should begin where the last story left off, and connect them accordingly"
+            content = "Previous Stories: " + str(story_info) + "\n" + "Battle Info: " + str(dict(battle_info, monsters=monsters)) + "\n" + "Generate a story prompt that makes sense for the given battle_information and previous stories. Keep your response concise and engaging. Less then 100 words. The story should begin where the last story left off, and connect them accordingly"
 
             messages = [
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": content}
             ]
 
-            response = await self.client.chat.complete_async(
-                model=MISTRAL_MODEL,
-                messages=messages,
-            )
+            # On the combat turn's path, so worth hedging like the interactive calls
+            response = await self._complete(messages, priority=STORY, method="generate_story", hedge=True)
             
             story_info.append(response.choices[0].message.content)
             return response.choices[0].message.content
         except Exception as e:
-            print(f"Error generating story: {e}")
+            logger.error("Error generating story: %s", e)
             fallback_story = "As you continue your journey, you encounter new challenges..."
             story_info.append(fallback_story)
             return fallback_story
     
+    async def generate_encounter(self, story_info, existing_templates) -> Dict:
+        """Generate a whole battle in one request (see schemas.ENCOUNTER): its setting, the
+        narrative leading into it and the 1-3 monsters it introduces, so the story and the
+        stat blocks agree. Takes the place of generate_story and the monster template calls."""
+        prompt = """Generate the next battle of a fantasy adventure: where it takes place, a short narrative leading into the fight, and the 1 to 3 monsters the player faces there. The narrative must introduce exactly these monsters. Return only a JSON string object with no other text in the following format:
+            {
+                "setting": "where the battle takes place",
+                "narrative": "the story leading into the fight, less than 100 words, beginning where the last story left off",
+                "monsters": [
+                    {
+                        "name": "monster name relevant to the story",
+                        "hp": number between 20-150,
+                        "attack": number between 5-20,
+                        "defense": number between 2-12
+                    }
+                ]
+            }.
+
+            Only return a JSON string object. Should not contain any other text."""
+        prompt += "\n" + "Previous Stories: " + str(story_info) + "\n" + "Known Monsters: " + ", ".join(template["name"] for template in existing_templates)
+        prompt += "\n" + "Reuse a known monster when it fits the story, otherwise create new ones."
+
+        try:
+            messages = [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ]
+
+            result = await self._complete_json(messages, ENCOUNTER, STORY, "generate_encounter")
+            story_info.append(result.data["narrative"])
+            return result.data
+        except Exception as e:
+            logger.error("Error generating encounter: %s", e)
+            return None
+
     """
     Generates a theme header using Mistral's API; called on entry to a new story
     This function is needed to emphasize the theme element of the story, otherwise the AI tends to ignore it
     Passes in the prior story information to the API"""
     async def generate_theme_header(self, story_info):
-        # Apply rate limiting before making the API call
-        await self.rate_limit()
-        
+        cache_key = " ".join(str(info) for info in story_info)
+        cached = self._cached(self.theme_cache, cache_key)
+        if cached is not None:
+            story_info.append(cached)
+            return cached
         try:
             # Generate a theme header using Mistral's API
             content = "Previous Stories: " + str(story_info) + "\n" + "Generate a theme header that makes sense for the given story_information. Keep your response concise and engaging. Less then 100 words. The theme should be related to the story prompt."
@@ -286,15 +491,13 @@ class MistralAgent:
                 {"role": "user", "content": content}
             ]
 
-            response = await self.client.chat.complete_async(
-                model=MISTRAL_MODEL,
-                messages=messages,
-            )
+            response = await self._complete(messages, priority=BACKGROUND, method="generate_theme_header")
 
             story_info.append(response.choices[0].message.content)
+            self.theme_cache.put(cache_key, response.choices[0].message.content)
             return response.choices[0].message.content
         except Exception as e:
-            print(f"Error generating theme header: {e}")
+            logger.error("Error generating theme header: %s", e)
             fallback_header = "The Adventure Continues..."
             story_info.append(fallback_header)
             return fallback_header
@@ -303,9 +506,6 @@ class MistralAgent:
     # Generate a conclusion using Mistral's API
     # pass in relevant story information
     async def generate_end_message(self, story_info):
-        # Apply rate limiting before making the API call
-        await self.rate_limit()
-        
         try:
             # Generate a conclusion using Mistral's API
             content = "Previous Stories: " + str(story_info) + "\n" + "Generate a conclusion that makes sense for the given story_information. Keep your response concise and engaging. Less then 100 words. The conclusion should wrap up the story and leave room for future stories."
@@ -315,28 +515,75 @@ class MistralAgent:
                 {"role": "user", "content": content}
             ]
 
-            response = await self.client.chat.complete_async(
-                model=MISTRAL_MODEL,
-                messages=messages,
-            )
+            response = await self._complete(messages, priority=STORY, method="generate_end_message")
 
             story_info.append(response.choices[0].message.content)
             return response.choices[0].message.content
         except Exception as e:
-            print(f"Error generating end message: {e}")
+            logger.error("Error generating end message: %s", e)
             fallback_end = "Your adventure concludes for now, but new challenges await on the horizon..."
             story_info.append(fallback_end)
             return fallback_end
         
 
+    async def generate_story_arc(self, story_info) -> Dict:
+        """Outline a whole adventure in one request (see schemas.STORY_ARC): a title, the
+        antagonist, one beat per round and the ending. Rounds then narrate their beat from the
+        outline instead of sending the whole story so far (see story_arc)."""
+        prompt = """Outline a fantasy adventure for a player who will fight a battle in every part of it. Return only a JSON string object with no other text in the following format:
+            {
+                "title": "the adventure's title",
+                "antagonist": "who or what is behind the trouble",
+                "beats": [
+                    {
+                        "setting": "where this part of the adventure takes place",
+                        "milestone": "what happens there, in one sentence, leading up to a fight"
+                    }
+                ],
+                "ending": "how the adventure concludes, in less than 60 words, leaving room for future stories"
+            }.
+
+            Give 4 to 8 beats, each a step closer to the antagonist. Only return a JSON string object."""
+        prompt += "\n" + "Story Info: " + str(story_info)
+
+        try:
+            messages = [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ]
+
+            result = await self._complete_json(messages, STORY_ARC, STORY, "generate_story_arc")
+            return result.data
+        except Exception as e:
+            logger.error("Error generating story arc: %s", e)
+            return None
+
+    async def expand_story_beat(self, gist: str, previous: str, beat: Dict) -> str:
+        """Narrate one beat of an outline from generate_story_arc. The prompt holds the outline's
+        gist, the previous beat and this one, so it stays the same size however long the adventure runs."""
+        try:
+            content = gist + "\n"
+            if previous:
+                content += "Previously: " + previous + "\n"
+            content += "Now, at " + beat["setting"] + ": " + beat["milestone"] + "\n" + "Narrate this moment of the adventure as a story prompt. Keep your response concise and engaging. Less then 80 words. End just as a fight is about to begin."
+
+            messages = [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ]
+
+            # On the combat turn's path like generate_story
+            response = await self._complete(messages, priority=STORY, method="expand_story_beat", hedge=True)
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error("Error expanding story beat: %s", e)
+            return None
+
     async def generate_character(self, story_info=None, character_request=None):
         """
         Generates a character using Mistral's API.
-        This function passes story information to the API and returns a character in JSON string format.
+        This function passes story information to the API and returns the character data (see schemas.CHARACTER).
         """
-        # Apply rate limiting before making the API call
-        await self.rate_limit()
-        
         try:
             # Create a prompt that asks for a character generation
             content = """Generate a character for a fantasy RPG game.
@@ -395,14 +642,11 @@ class MistralAgent:
                 {"role": "user", "content": content}
             ]
 
-            response = await self.client.chat.complete_async(
-                model=MISTRAL_MODEL,
-                messages=messages,
-            )
-            # Return the raw JSON string
-            return response.choices[0].message.content
+            result = await self._complete_json(messages, CHARACTER, STORY, "generate_character")
+            # Return the validated character data
+            return result.data
         except Exception as e:
-            print(f"Error generating character: {e}")
-            # Fallback with minimal valid JSON
-            fallback_character = """{"name": "Fallback Character", "character_class": "Warrior", "level": 1, "stats": {"Strength": 12, "Dexterity": 10, "Constitution": 11, "Intelligence": 9, "Wisdom": 8, "Charisma": 10}, "inventory": ["Health Potion", "Shield"], "abilities": ["Slash", "Shield Block"], "background": "A novice warrior seeking adventure."}"""
+            logger.error("Error generating character: %s", e)
+            # Fallback with a minimal valid character
+            fallback_character = {"name": "Fallback Character", "character_class": "Warrior", "level": 1, "stats": {"Strength": 12, "Dexterity": 10, "Constitution": 11, "Intelligence": 9, "Wisdom": 8, "Charisma": 10}, "inventory": ["Health Potion", "Shield"], "abilities": ["Slash", "Shield Block"], "background": "A novice warrior seeking adventure."}
             return fallback_character
\ No newline at end of file
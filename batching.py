@@ -0,0 +1,90 @@
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Gathers items submitted by concurrent callers into one batch call
+
+    A batch is flushed when it reaches max_batch items or max_wait seconds after its first
+    item arrived, whichever comes first. handler receives the list of items and returns one
+    result per item. If it raises ValueError (e.g. an unparseable response) or returns the
+    wrong number of results, each item is retried through fallback on its own; any other
+    exception is passed to every caller in the batch.
+
+    A batch serves several callers, so it runs in a fresh context: none of the context
+    variables of whichever caller happened to flush it (its session's recorder, turn deadline
+    or guild) apply to the others. Callers bound their own wait and record their own result."""
+
+    def __init__(self, handler: Callable[[List], Awaitable[List]], max_batch: int = 16, max_wait: float = 0.1,
+                 fallback: Optional[Callable] = None, name: str = "batch"):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.fallback = fallback
+        self.name = name
+        self.pending = []  # (item, future, submitted at)
+        self._timer = None
+
+    async def submit(self, item):
+        """Add an item to the next batch and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future, time.monotonic()))
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.pending = self.pending, []
+        # Callers that gave up (cancelled) while waiting don't need scoring
+        batch = [entry for entry in batch if not entry[1].done()]
+        if batch:
+            contextvars.Context().run(asyncio.ensure_future, self._run(batch))
+
+    async def _run(self, batch):
+        now = time.monotonic()
+        metrics.observe("batch.size", len(batch), batch=self.name)
+        for _, _, submitted in batch:
+            metrics.observe("batch.added_latency", now - submitted, batch=self.name)
+
+        items = [item for item, _, _ in batch]
+        futures = [future for _, future, _ in batch]
+        try:
+            results = await self.handler(items)
+            if len(results) != len(items):
+                raise ValueError(f"Expected {len(items)} results, got {len(results)}")
+        except ValueError as e:
+            if self.fallback is None:
+                self._fail(futures, e)
+                return
+            logger.warning("[%s] batch of %d failed (%s), falling back to single calls", self.name, len(items), e)
+            metrics.incr("batch.fallbacks", batch=self.name)
+            results = await asyncio.gather(*(self.fallback(item) for item in items), return_exceptions=True)
+        except Exception as e:
+            self._fail(futures, e)
+            return
+
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def _fail(futures, error):
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
@@ -1,8 +1,13 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 import random
-import os
 import asyncio
-import time
+import logging
+
+from budget import CACHED, LOCAL
+from tracing import span
+from state import get_backend
+
+logger = logging.getLogger(__name__)
 
 class Monster:
     def __init__(self, name: str, hp: int, attack: int, defense: int):
@@ -15,19 +20,27 @@ class Monster:
     def is_alive(self) -> bool:
         return self.current_hp > 0
 
+    def to_dict(self) -> dict:
+        return {"name": self.name, "max_hp": self.max_hp, "current_hp": self.current_hp,
+                "attack": self.attack, "defense": self.defense}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Monster":
+        monster = cls(data["name"], data["max_hp"], data["attack"], data["defense"])
+        monster.current_hp = data["current_hp"]
+        return monster
+
 class Battle:
-    def __init__(self, agent=None):
-        # Load API configuration
-        self.api_key = os.getenv('MISTRAL_API_KEY')
-        if not self.api_key:
-            raise ValueError("MISTRAL_API_KEY not found in environment variables")
-            
-        self.api_url = "https://api.mistral.ai/v1/chat/completions"
+    # Keep at least this many monster templates around before building battles
+    MIN_TEMPLATES = 7
+    # Generated templates are also pooled in the shared state backend (newest POOL_SIZE kept),
+    # so sessions on any worker can reuse them once the token budget runs low
+    POOL_KEY = "bestiary:pool"
+    POOL_SIZE = 500
+
+    def __init__(self, agent=None, rng=None):
         self.agent = agent
-        
-        # Rate limiting parameters
-        self.last_request_time = 0
-        self.min_request_interval = 1.0  # Minimum 1 second between requests
+        self.rng = rng or random.Random()  # Per-session RNG so a recorded seed replays the same battles
         
         # Placeholder monsters that could be replaced with API calls
         self.monster_templates = [
@@ -50,63 +63,84 @@ class Battle:
             "You've stumbled upon a monster's lair during their feast..."
         ]
 
-    async def rate_limit(self):
-        """Ensure we don't exceed rate limits by waiting if needed"""
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
-        
-        if time_since_last_request < self.min_request_interval:
-            # Calculate how much longer we need to wait
-            wait_time = self.min_request_interval - time_since_last_request
-            print(f"Rate limiting: Waiting {wait_time:.2f} seconds before next API call")
-            await asyncio.sleep(wait_time)
-        
-        # Update the last request time
-        self.last_request_time = time.time()
-
     async def get_new_monster_template(self, story_info):
-        """Get a new monster template with rate limiting"""
-        # Apply rate limiting before making the API call
-        await self.rate_limit()
-        
+        """Get a new monster template; rate limiting is handled by the shared agent limiter"""
         if self.agent:
             try:
-                template = await self.agent.generate_monster_template(self.monster_templates, story_info)
+                with span("battle.new_template"):
+                    template = await self.agent.generate_monster_template(self.monster_templates, story_info)
                 if template:
-                    print(f"Generated new monster: {template['name']}")
+                    logger.debug("Generated new monster: %s", template['name'], extra={"event": "monster.generated"})
+                    await self.publish_template(template)
                     return template
             except Exception as e:
-                print(f"Error in monster generation: {e}")
+                logger.error("Error in monster generation: %s", e)
         
         # Fallback to a random existing template if API call fails
-        return random.choice(self.monster_templates)
+        return self.rng.choice(self.monster_templates)
+
+    def add_template(self, template) -> bool:
+        """Add a template to the bestiary unless it is a duplicate"""
+        if template and template not in self.monster_templates:
+            self.monster_templates.append(template)
+            return True
+        return False
+
+    async def publish_template(self, template):
+        try:
+            await get_backend().push(self.POOL_KEY, template, max_len=self.POOL_SIZE)
+        except Exception as e:
+            logger.warning("Could not pool monster template: %s", e)
+
+    async def fill_from_pool(self):
+        """Top the bestiary up with templates other sessions generated, instead of calling the API"""
+        try:
+            pooled = await get_backend().members(self.POOL_KEY)
+        except Exception as e:
+            logger.warning("Could not read the monster pool: %s", e)
+            return
+        self.rng.shuffle(pooled)
+        for template in pooled:
+            if len(self.monster_templates) >= self.MIN_TEMPLATES:
+                break
+            self.add_template(template)
+
+    def budget_level(self) -> int:
+        """Token budget degradation level; without an agent everything is local anyway"""
+        return self.agent.degradation_level() if self.agent else LOCAL
+
+    async def fill_bestiary(self, story_info, max_rounds: int = 3):
+        """Ensure we have at least MIN_TEMPLATES templates, generating the missing ones concurrently.
+        Once the token budget runs low the existing (hard-coded or pooled) templates are reused instead."""
+        if self.budget_level() >= CACHED:
+            await self.fill_from_pool()
+            return
+        rounds = 0
+        while self.agent and len(self.monster_templates) < self.MIN_TEMPLATES and rounds < max_rounds:
+            rounds += 1
+            missing = self.MIN_TEMPLATES - len(self.monster_templates)
+            logger.info("Currently have %d monster templates, generating %d more", len(self.monster_templates), missing)
+            templates = await asyncio.gather(*(self.get_new_monster_template(story_info) for _ in range(missing)))
+            for template in templates:
+                self.add_template(template)
+
+    async def add_new_template(self, story_info):
+        """Add one freshly generated template for variety"""
+        if self.budget_level() < CACHED:
+            self.add_template(await self.get_new_monster_template(story_info))
+
+    def compose_battle(self) -> Dict:
+        """Build a random battle scenario from the current bestiary"""
+        setting = self.rng.choice(self.settings)
+        storyline = self.rng.choice(self.storylines)
 
-    async def generate_battle(self, story_info) -> Dict:
-        """Generate a random battle scenario"""
-        setting = random.choice(self.settings)
-        storyline = random.choice(self.storylines)
-        
-        # First, ensure we have enough templates (at least 7)
-        if self.agent and len(self.monster_templates) < 7:
-            print(f"Currently have {len(self.monster_templates)} monster templates, generating more...")
-            while len(self.monster_templates) < 7:
-                template = await self.get_new_monster_template(story_info)
-                if template not in self.monster_templates:  # Avoid duplicates
-                    self.monster_templates.append(template)
-        
         # Generate 1-3 random monsters for the battle
-        num_monsters = random.randint(1, 3)
+        num_monsters = self.rng.randint(1, 3)
         monsters = []
-        
-        # Add a new template once per battle for variety
-        if self.agent:
-            new_template = await self.get_new_monster_template(story_info)
-            if new_template not in self.monster_templates:
-                self.monster_templates.append(new_template)
-        
+
         # Select random monsters from our templates
         for _ in range(num_monsters):
-            template = random.choice(self.monster_templates)
+            template = self.rng.choice(self.monster_templates)
             monster = Monster(
                 template["name"],
                 template["hp"],
@@ -114,15 +148,44 @@ class Battle:
                 template["defense"]
             )
             monsters.append(monster)
-            
+
         return {
             "setting": setting,
             "storyline": storyline,
             "monsters": monsters
         }
-        
+
+    async def generate_encounter(self, story_info) -> Optional[Dict]:
+        """A battle scenario from one generate_encounter call: its setting, its narrative (as the
+        storyline) and its monsters, whose templates also join the bestiary and the pool.
+        None if the encounter couldn't be generated."""
+        with span("battle.encounter"):
+            encounter = await self.agent.generate_encounter(story_info, self.monster_templates)
+        if not encounter:
+            return None
+        new = [template for template in encounter["monsters"] if self.add_template(template)]
+        await asyncio.gather(*(self.publish_template(template) for template in new))
+        return {
+            "setting": encounter["setting"],
+            "storyline": encounter["narrative"],
+            "monsters": [Monster(template["name"], template["hp"], template["attack"], template["defense"])
+                         for template in encounter["monsters"]]
+        }
+
+    async def generate_battle(self, story_info) -> Dict:
+        """Generate a battle scenario: a generated encounter while the token budget allows,
+        otherwise (or if it fails) a random one from the bestiary"""
+        if self.agent and self.budget_level() < CACHED:
+            battle = await self.generate_encounter(story_info)
+            if battle is not None:
+                return battle
+            logger.warning("No encounter generated, composing a battle from the bestiary")
+            return self.compose_battle()
+        await self.fill_bestiary(story_info)
+        return self.compose_battle()
+
     def calculate_damage(self, attack: int, defense: int) -> int:
         """Calculate damage dealt based on attack and defense stats"""
         base_damage = max(1, attack - defense)
-        variance = random.uniform(5, 12)
+        variance = self.rng.uniform(5, 12)
         return int(base_damage * variance)
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""Measure what hedging does to the tail latency of interactive LLM calls, against mistral_standin.py.
+
+Usage: python bench_hedge.py [--requests N] [--rate PER_SECOND] [--latency SECONDS] [--tail FRACTION]
+                             [--tail-latency SECONDS] [--small-speedup N] [--max-rate FRACTION]
+                             [--percentile P]
+
+The stand-in answers most requests after --latency seconds and a --tail fraction after
+--tail-latency seconds. The same stream of --requests interactive calls (arriving at --rate
+per second) runs without hedging, with hedging on the same model and with hedges sent to
+the small model (which the stand-in answers --small-speedup times faster). Reports latency
+percentiles, hedges sent and won, and the extra requests the servers saw."""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from metrics import metrics, percentile
+
+MODES = {
+    "off": {"HEDGE_REQUESTS": "0"},
+    "hedge": {"HEDGE_REQUESTS": "1", "HEDGE_MODEL": ""},
+    "hedge-small": {"HEDGE_REQUESTS": "1", "HEDGE_MODEL": "mistral-small-latest"},
+}
+
+
+async def run_stream(agent, requests: int, rate: float, seed: int = 0):
+    from scheduler import INTERACTIVE, current_guild
+
+    rng = random.Random(seed)
+    latencies = []
+
+    async def call(i):
+        current_guild.set(f"guild-{i % 5}")
+        start = time.perf_counter()
+        await agent._complete([{"role": "user", "content": f"Rate this attack {i}; answer with damage_score."}],
+                              priority=INTERACTIVE, method="bench")
+        latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    for i in range(requests):
+        tasks.append(asyncio.ensure_future(call(i)))
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+async def bench(args):
+    from agent import MistralAgent
+    from budget import TokenBudget
+    from mistral_standin import MistralStandIn
+
+    os.environ["HEDGE_MAX_RATE"] = str(args.max_rate)
+    os.environ["HEDGE_PERCENTILE"] = str(args.percentile)
+    for mode, env in MODES.items():
+        os.environ.update(env)
+        standin = MistralStandIn(quota=100000, window=60, latency=args.latency, tail=args.tail,
+                                 tail_latency=args.tail_latency, small_speedup=args.small_speedup)
+        runner = await standin.start()
+        os.environ["MISTRAL_ENDPOINTS"] = "bench@http://%s:%d" % runner.addresses[0][:2]
+        agent = MistralAgent()
+        agent.budget = TokenBudget()
+        hedges = metrics.counter("llm.hedges", method="bench")
+        won = metrics.counter("llm.hedge_wins", method="bench", winner="hedge")
+        latencies = await run_stream(agent, args.requests, args.rate)
+        await runner.cleanup()
+        await agent.keys.close()
+        hedges = metrics.counter("llm.hedges", method="bench") - hedges
+        won = metrics.counter("llm.hedge_wins", method="bench", winner="hedge") - won
+        print(f"{mode:<12} p50 {percentile(latencies, 50):6.2f}s  p95 {percentile(latencies, 95):6.2f}s  "
+              f"p99 {percentile(latencies, 99):6.2f}s  max {max(latencies):6.2f}s  hedges {hedges:>4.0f} "
+              f"(won {won:>3.0f})  extra load {standin.served / args.requests - 1:6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--rate", type=float, default=20.0, help="requests per second")
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--tail", type=float, default=0.03, help="share of slow responses")
+    parser.add_argument("--tail-latency", type=float, default=3.0)
+    parser.add_argument("--small-speedup", type=float, default=2.0)
+    parser.add_argument("--max-rate", type=float, default=0.1, help="HEDGE_MAX_RATE")
+    parser.add_argument("--percentile", type=float, default=95.0, help="HEDGE_PERCENTILE")
+    args = parser.parse_args()
+    os.environ.setdefault("MISTRAL_API_KEY", "bench")
+    os.environ["HTTP_PREWARM"] = "0"
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
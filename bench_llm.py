@@ -0,0 +1,97 @@
+"""Compare the old fixed request spacing with adaptive concurrency against mistral_standin.py.
+
+Usage: python bench_llm.py [--requests N] [--quotas 10,30,120] [--window SECONDS] [--endpoints N]
+                           [--max-concurrent N] [--latency SECONDS] [--no-headers]
+
+For each quota (requests per --window), fresh stand-ins are started and the same burst of
+--requests story-priority calls from several guilds goes through MistralAgent._complete,
+once with the old limiter (one request at a time, 1.5s apart) and once with the adaptive one.
+With --endpoints N, N stand-ins (each with that quota) serve as a key pool for the adaptive run.
+Reports throughput, end-to-end latency, 429s seen by the servers and failed calls."""
+import argparse
+import asyncio
+import os
+import time
+
+from metrics import metrics
+
+FIXED_INTERVAL = 1.5  # the spacing the agent used before adaptive concurrency
+
+
+async def run_burst(agent, requests: int, guilds: int = 5):
+    from scheduler import STORY, current_guild
+
+    latencies = []
+    failures = 0
+
+    async def call(i):
+        nonlocal failures
+        current_guild.set(f"guild-{i % guilds}")
+        start = time.perf_counter()
+        try:
+            await agent._complete([{"role": "user", "content": f"Continue the story, part {i}."}],
+                                  priority=STORY, timeout=3600, method="bench")
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(i) for i in range(requests)))
+    return time.perf_counter() - started, sorted(latencies), failures
+
+
+async def bench(requests: int, quota: int, window: float, max_concurrent: int, latency: float, headers: bool,
+                endpoints: int = 1):
+    from agent import MistralAgent
+    from budget import TokenBudget
+    from mistral_standin import MistralStandIn
+    from scheduler import LLMScheduler
+
+    for mode in ("fixed", "adaptive"):
+        standins = [MistralStandIn(quota, window, max_concurrent, latency, headers=headers, seed=i)
+                    for i in range(endpoints if mode == "adaptive" else 1)]
+        runners = [await standin.start() for standin in standins]
+        os.environ["MISTRAL_ENDPOINTS"] = ",".join(f"bench{i}@http://%s:%d" % runner.addresses[0][:2]
+                                                   for i, runner in enumerate(runners))
+        agent = MistralAgent()
+        agent.budget = TokenBudget()
+        if mode == "fixed":
+            agent.scheduler = LLMScheduler(min_interval=FIXED_INTERVAL)
+        elapsed, latencies, failures = await run_burst(agent, requests)
+        for runner in runners:
+            await runner.cleanup()
+        p50 = latencies[len(latencies) // 2] if latencies else 0.0
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+        limit = sum(endpoint.concurrency.limit for endpoint in agent.keys.endpoints)
+        limit = f"{limit:5.1f}" if mode == "adaptive" else "    -"
+        print(f"quota {quota:>4}/{window:g}s x{len(standins)}  {mode:<9}{elapsed:8.1f}s {len(latencies) / elapsed:7.2f} req/s  "
+              f"p50 {p50:6.1f}s  p95 {p95:6.1f}s  429s {sum(standin.throttled for standin in standins):>4}  "
+              f"failed {failures:>3}  peak in flight {sum(standin.peak_in_flight for standin in standins):>3}  "
+              f"final limit {limit}")
+        if mode == "adaptive" and len(standins) > 1:
+            print(agent.keys.format_usage())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--quotas", default="10,30,120", help="comma-separated requests per window")
+    parser.add_argument("--window", type=float, default=10.0)
+    parser.add_argument("--endpoints", type=int, default=1, help="stand-ins in the adaptive run's key pool")
+    parser.add_argument("--max-concurrent", type=int, default=8, help="stand-in concurrency cap (0: none)")
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--no-headers", action="store_true", help="stand-in sends no rate-limit headers")
+    args = parser.parse_args()
+    os.environ.setdefault("MISTRAL_API_KEY", "bench")
+
+    async def run_all():
+        for quota in [int(quota) for quota in args.quotas.split(",")]:
+            await bench(args.requests, quota, args.window, args.max_concurrent, args.latency, not args.no_headers,
+                        args.endpoints)
+        print(metrics.report("llm."))
+
+    asyncio.run(run_all())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Measure how long the bot takes to import and to become ready, to catch startup regressions.
+
+Usage: python bench_startup.py [--runs N] [--modules bot,agent,start_story] [--json results.json]
+                               [--baseline results.json]
+
+Every measurement runs in a fresh interpreter. Import time is the median wall time of
+importing each module (less the bare interpreter's start-up); a module that starts threads
+or builds the agent on import is reported, since importing must have no side effects.
+Time to ready is from spawning `python` to the bot answering `!ping`: the child imports
+bot.py, builds the bot and the agent as main() does, and gets its first command through
+gateway_sim's simulated Discord, so no network is involved. With --baseline, the change
+against a previous --json file is printed too."""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+IMPORT_PROBE = """
+import logging, sys, threading, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+bot = sys.modules.get("bot")
+print(elapsed, threading.active_count(), int("agent" in sys.modules), int("mistralai" in sys.modules),
+      int(bool(bot is not None and bot.agent is not None)), len(logging.getLogger().handlers))
+"""
+
+
+def _python(code: str, env=None) -> str:
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                          env=env).stdout.strip()
+
+
+def _child_env():
+    env = dict(os.environ)
+    env.setdefault("MISTRAL_API_KEY", "bench")
+    env["HTTP_PREWARM"] = "0"  # warm-ups would go to the real API
+    env["HTTP_PING_INTERVAL"] = "0"
+    return env
+
+
+def interpreter_time(runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        _python("pass")
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def import_time(module: str, runs: int) -> dict:
+    samples = [_python(IMPORT_PROBE.format(module=module), _child_env()).split() for _ in range(runs)]
+    threads, agent_module, sdk, agent, handlers = (int(value) for value in samples[-1][1:])
+    return {"seconds": statistics.median(float(sample[0]) for sample in samples),
+            "threads": threads, "imports_agent": agent_module, "imports_sdk": sdk,
+            "builds_agent": agent, "log_handlers": handlers}
+
+
+async def _ready_child():
+    import asyncio
+
+    started = time.perf_counter()
+    import bot
+    imported = time.perf_counter()
+    from gateway_sim import SimulatedGateway
+
+    built = bot.build_bot()
+    bot.get_agent()
+    gateway = SimulatedGateway(built, echo=False)
+    gateway.install()
+    channel = gateway.add_channel(gateway.add_guild("bench"), "bench")
+    replies = gateway.subscribe(channel)
+    await bot.on_ready()
+    gateway.deliver(channel, {"id": "42", "username": "bench", "discriminator": "0", "avatar": None}, "!ping")
+    await asyncio.wait_for(replies.get(), 10)
+    answered = time.perf_counter()
+    print(json.dumps({"import": imported - started, "build": answered - imported, "in_process": answered - started}))
+
+
+def ready_time(runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, __file__, "--ready-child"], capture_output=True, text=True,
+                                check=True, env=_child_env())
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        sample["total"] = time.perf_counter() - start
+        samples.append(sample)
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modules", default="bot,agent,start_story", help="comma-separated modules to import")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare with a previous --json file")
+    parser.add_argument("--ready-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.ready_child:
+        import asyncio
+
+        asyncio.run(_ready_child())
+        return
+
+    results = {"interpreter": interpreter_time(args.runs), "imports": {}, "ready": ready_time(args.runs)}
+    print(f"interpreter start-up      {results['interpreter'] * 1000:7.0f}ms")
+    for module in args.modules.split(","):
+        measured = results["imports"][module] = import_time(module, args.runs)
+        notes = [note for note, flag in (("starts threads", measured["threads"] > 1),
+                                         ("imports the Mistral SDK", measured["imports_sdk"]),
+                                         ("builds the agent", measured["builds_agent"]),
+                                         ("configures logging", measured["log_handlers"])) if flag]
+        print(f"import {module:<18} {measured['seconds'] * 1000:7.0f}ms  {', '.join(notes)}")
+    ready = results["ready"]
+    print(f"time to ready             {ready['total'] * 1000:7.0f}ms  (import {ready['import'] * 1000:.0f}ms, "
+          f"bot, agent and first command {ready['build'] * 1000:.0f}ms)")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print("\nChange against", args.baseline)
+        for module, measured in results["imports"].items():
+            if module in baseline.get("imports", {}):
+                before = baseline["imports"][module]["seconds"]
+                print(f"import {module:<18} {(measured['seconds'] - before) * 1000:+7.0f}ms")
+        print(f"time to ready             {(ready['total'] - baseline['ready']['total']) * 1000:+7.0f}ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,70 @@
+import asyncio
 import os
+import time
 import discord
 import json
 import logging
 
 from discord.ext import commands
 from dotenv import load_dotenv
-from agent import MistralAgent
-from battle import Battle
-from village import Village
 from start_story import StorySystem
+from sessions import SessionManager
+from metrics import metrics
+from scheduler import current_guild
+from tracing import span, record, message_lag_ms
+from recording import SessionRecorder
+from log_setup import setup_logging
+from state import get_backend
+from fleet import create_bot, HealthReporter, fleet_health, format_fleet
+from admission import AdmissionControl
 # from user import get_user
 # from user import load_users
 
 PREFIX = "!"
 STORY_STARTED = False
-story = None
 
-# Setup logging
 logger = logging.getLogger("discord")
 
-# Load the environment variables
-load_dotenv()
+# Importing this module has no side effects: main() loads the environment, sets up logging and
+# builds the bot (build_bot), and the Mistral agent is only created when first needed (get_agent).
+# gateway_sim.py and bench_startup.py call build_bot themselves and drive the bot locally.
+bot = None
+health = None
+admission = None
+sessions = None  # Running adventure per player, so concurrent games each have their own !end
+agent = None
+_main_started = None
 
-# Create the bot with all intents
-# The message content and members intent must be enabled in the Discord Developer Portal for the bot to work.
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix=PREFIX, intents=intents)
 
-# Import the Mistral agent from the agent.py file
-agent = MistralAgent()
+def get_agent():
+    """The Mistral agent, created on first use (importing agent.py pulls in the Mistral SDK)"""
+    global agent
+    if agent is None:
+        from agent import MistralAgent
+        agent = MistralAgent()
+    return agent
 
-# Get the token from the environment variables
-token = os.getenv("DISCORD_TOKEN")
+
+def build_bot() -> commands.Bot:
+    """Create the bot (sharded when run by supervisor.py or with SHARDS=auto) and register the
+    event handlers and commands below on it"""
+    global bot, health, admission, sessions
+    # The message content and members intent must be enabled in the Discord Developer Portal for the bot to work.
+    intents = discord.Intents.all()
+    bot = create_bot(PREFIX, intents)
+    health = HealthReporter(bot, get_backend(), sessions=lambda: sessions.count())
+    # Caps running and bootstrapping adventures; the rest queue (ADVENTURE_MAX_SESSIONS, ...)
+    admission = AdmissionControl.from_env()
+    # Routes players' messages to their adventures and pages out idle ones (SESSION_PAGE_OUT_AFTER)
+    sessions = SessionManager.from_env(get_agent, admission)
+    bot.event(on_ready)
+    bot.event(on_message)
+    bot.event(on_interaction)
+    for command in (ping, start, show_metrics, fleet, spend, profile, end, village, quit):
+        bot.add_command(command)
+    return bot
 
 
-@bot.event
 async def on_ready():
     """
     Called when the client is done preparing the data received from Discord.
@@ -42,22 +72,42 @@ async def on_ready():
 
     https://discordpy.readthedocs.io/en/latest/api.html#discord.on_ready
     """
+    from profiling import start_loop_monitor
+
     logger.info(f"{bot.user} has connected to Discord!")
+    if _main_started is not None:
+        ready = time.perf_counter() - _main_started
+        metrics.observe("startup.time_to_ready", ready)
+        logger.info("Ready %.2fs after startup", ready, extra={"event": "startup.ready"})
+    # Warn (with a stack) whenever something blocks the event loop
+    start_loop_monitor()
+    health.start()
+    # Open the LLM connections now rather than on the first player's request
+    asyncio.ensure_future(get_agent().keys.warm_up())
 
 
-@bot.event
 async def on_message(message: discord.Message):
     """
     Called when a message is sent in any channel the bot can see.
 
     https://discordpy.readthedocs.io/en/latest/api.html#discord.on_message
     """
+    # How long Discord took to deliver this message to us
+    lag_ms = message_lag_ms(message)
+    if lag_ms is not None:
+        record("discord.on_message", lag_ms)
+    metrics.incr("discord.messages", shard=message.guild.shard_id if message.guild else 0)
+
     # Don't delete this line! It's necessary for the bot to process commands.
     await bot.process_commands(message)
 
     # Ignore messages from self or other bots to prevent infinite loops.
     if message.author.bot or message.content.startswith("!"):
         return
+
+    # A player's answer to their adventure's prompt advances it
+    if await sessions.deliver(message):
+        return
     
     # Check if bot is paused before making API calls
     if STORY_STARTED:
@@ -66,7 +116,9 @@ async def on_message(message: discord.Message):
     # Process the message with the agent you wrote
     # Open up the agent.py file to customize the agent
     logger.info(f"Processing message from {message.author}: {message.content}")
-    response = await agent.run(message)
+    current_guild.set(message.guild.id if message.guild else None)
+    with span("chat.agent"):
+        response = await get_agent().run(message)
 
     # Split response into chunks of 2000 characters or less
     # Use a helper function to split on sentence boundaries when possible
@@ -97,13 +149,25 @@ async def on_message(message: discord.Message):
 
     # Send each chunk as a separate message
     chunks = split_into_chunks(response)
-    for i, chunk in enumerate(chunks):
-        if i == 0:
-            # First chunk uses reply to maintain threading
-            await message.reply(chunk)
-        else:
-            # Subsequent chunks use regular send
-            await message.channel.send(chunk)
+    with span("discord.send", chunks=len(chunks)):
+        for i, chunk in enumerate(chunks):
+            if i == 0:
+                # First chunk uses reply to maintain threading
+                await message.reply(chunk)
+            else:
+                # Subsequent chunks use regular send
+                await message.channel.send(chunk)
+
+
+async def on_interaction(interaction: discord.Interaction):
+    """
+    Called when a user presses a button or picks from a select menu; the game's go straight
+    to the adventure that offered them (see components.py).
+
+    https://discordpy.readthedocs.io/en/latest/api.html#discord.on_interaction
+    """
+    metrics.incr("discord.interactions", shard=interaction.guild.shard_id if interaction.guild else 0)
+    await sessions.deliver_interaction(interaction)
 
 
 # Commands
@@ -112,72 +176,120 @@ async def on_message(message: discord.Message):
 # This example command is here to show you how to add commands to the bot.
 # Run !ping with any number of arguments to see the command in action.
 # Feel free to delete this if your project will not need commands.
-@bot.command(name="ping", help="Pings the bot.")
+@commands.command(name="ping", help="Pings the bot.")
 async def ping(ctx, *, arg=None):
     if arg is None:
         await ctx.send("Pong!")
     else:
         await ctx.send(f"Pong! Your argument was {arg}")
 
-@bot.command(name="start", help="Starts the game")
+@commands.command(name="start", help="Starts the game")
 async def start(ctx, *, arg=None):
     global STORY_STARTED
     STORY_STARTED = True
-    global story
-    print(arg)
-    story = StorySystem(agent)
-    story_details = []
+    # SESSION_RECORD_DIR set: record the adventure so it can be replayed with replay.py
+    recorder = SessionRecorder.from_env()
+    theme = None
     if arg is None:
         await ctx.send("Starting the game...")
     else:
-        print(arg.strip())
-        story_details.append(arg.strip())
-        await agent.generate_theme_header(story_details)
+        theme = arg.strip()
         await ctx.send(f"Starting the game... {arg}")
-    # Start the adventure
-    try:
-        await story.start_adventure(ctx, story_details)
-    except Exception as e:
-        await ctx.send(f"An error occurred: {str(e)}")
+    # Start the adventure; the theme header is generated while the player describes their character.
+    # It runs on in the background, each of the player's answers advancing it (see sessions.py).
+    await sessions.start(ctx, theme=theme, recorder=recorder)
+
+@commands.command(name="metrics", help="Shows performance metrics, optionally filtered by prefix.")
+async def show_metrics(ctx, *, prefix=""):
+    await ctx.send(f"```\n{metrics.report(prefix.strip())[:1900]}\n```")
 
-@bot.command(name="end", help="Ends the current game")
+@commands.command(name="fleet", help="Shows the health of every bot worker.")
+async def fleet(ctx):
+    await ctx.send(f"```\n{format_fleet(await fleet_health(get_backend()))[:1900]}\n```")
+
+@commands.command(name="spend", help="Shows token usage and spend against the budgets.")
+async def spend(ctx):
+    guild = ctx.guild.id if ctx.guild else None
+    await ctx.send(f"```\n{get_agent().budget.report(guild)}\n```")
+
+@commands.group(name="profile", help="Admin only: profile the running bot.", invoke_without_command=True)
+@commands.has_permissions(administrator=True)
+async def profile(ctx):
+    await ctx.send("Usage: `!profile cpu <seconds> [sample|cprofile]` or `!profile mem [stop]`")
+
+@profile.command(name="cpu", help="Profiles CPU for a number of seconds (sampling by default).")
+@commands.has_permissions(administrator=True)
+async def profile_cpu_command(ctx, seconds: float = 10.0, mode: str = "sample"):
+    from profiling import profile_cpu
+
+    seconds = max(1.0, min(seconds, 300.0))
+    await ctx.send(f"Profiling CPU for {seconds:.0f}s ({mode})...")
+    summary = await profile_cpu(seconds, mode=mode)
+    await ctx.send(f"```\n{summary[:1900]}\n```")
+
+@profile.command(name="mem", help="Takes a tracemalloc snapshot, or stops tracing with `stop`.")
+@commands.has_permissions(administrator=True)
+async def profile_mem_command(ctx, action: str = "snapshot"):
+    from profiling import snapshot_memory, stop_memory_tracing
+
+    if action == "stop":
+        await ctx.send(stop_memory_tracing())
+        return
+    summary = await snapshot_memory()
+    await ctx.send(f"```\n{summary[:1900]}\n```")
+
+@commands.command(name="end", help="Ends the current game")
 async def end(ctx):
-    global story
-    if story is None:
-        await ctx.send("No game is currently running!")
+    if sessions.running(ctx.author.id):
+        await ctx.send("Ending the current game...")
+        # Cancels the game's LLM requests right away
+        await sessions.end(ctx.author.id)
+    elif await get_backend().get(f"session:{ctx.author.id}"):
+        # The game is running on another worker, which polls for this flag (SessionManager.sweep_once)
+        await get_backend().set(f"session:{ctx.author.id}:end", True, ttl=StorySystem.SESSION_TTL)
+        await ctx.send("Ending the current game...")
     else:
-        story.force_end = True  # Set the flag instead of probability
-        await ctx.send("Ending the current game at the next available spot...")
+        await ctx.send("No game is currently running!")
 
-@bot.command(name="village", help="Tests Village")
+@commands.command(name="village", help="Tests Village")
 async def village(ctx, *, arg=None):
     global STORY_STARTED
     STORY_STARTED = True
-    story = StorySystem(agent)
     if arg is None:
         await ctx.send("Starting the village test...")
     else:
         await ctx.send(f"Starting the village tst... {arg}")
     # Start the adventure
-    try:
-        await story.test_village(ctx)
-    except Exception as e:
-        await ctx.send(f"An error occurred: {str(e)}")
+    await sessions.start_village(ctx)
     
 # This command prints all existing users
-# @bot.command(name="show_users", help="Prints all stored users.")
+# @commands.command(name="show_users", help="Prints all stored users.")
 # async def show_users(ctx):
 #     users = load_users()
 #     await ctx.send(f"```json\n{json.dumps(users, indent=4)}```")
 
 # Makes the bot stop
-@bot.command(name="quit", help="Shuts down the bot.")
+@commands.command(name="quit", help="Shuts down the bot.")
 async def quit(ctx):
     """Safely shuts down the bot"""
     await ctx.send("Shutting down... Goodbye!")
-    await bot.close()
+    await ctx.bot.close()
+
+
 
+def main():
+    """Start the bot, connecting it to the gateway"""
+    global _main_started
+    _main_started = time.perf_counter()
+    # Load the environment variables
+    load_dotenv()
+    # Setup logging: ours and discord.py's go through one queue to a background thread (see log_setup.py)
+    setup_logging()
+    build_bot()
+    # Get the token from the environment variables
+    token = os.getenv("DISCORD_TOKEN")
+    bot.run(token, log_handler=None)  # logging is already set up; don't let discord.py add its own handler
 
 
-# Start the bot, connecting it to the gateway
-bot.run(token)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import logging
+import os
+import time
+from collections import defaultdict, deque
+from typing import Dict, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Degradation levels, cheapest last. Each level keeps everything the previous ones gave up.
+NORMAL = 0  # full quality
+ECONOMY = 1  # switch to the smaller model
+CACHED = 2  # reuse cached/pooled content (bestiary, shop) instead of generating more
+LOCAL = 3  # no LLM calls: hard-coded monster templates, storylines and fallbacks
+
+LEVEL_NAMES = {NORMAL: "normal", ECONOMY: "economy", CACHED: "cached", LOCAL: "local"}
+
+# USD per million (prompt, completion) tokens; only used to show an estimated spend
+MODEL_PRICES = {
+    "mistral-large-latest": (2.0, 6.0),
+    "mistral-small-latest": (0.2, 0.6),
+}
+
+WINDOWS = {"hour": 3600, "day": 86400}
+
+
+class BudgetExhausted(Exception):
+    """Raised instead of calling the API once a budget is used up"""
+
+
+def _env_limit(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+class _RollingCounter:
+    """Token totals over the last hour and day, kept in one-minute buckets"""
+
+    def __init__(self, bucket_seconds: int = 60):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = deque()  # (bucket start, tokens, cost)
+
+    def add(self, tokens: int, cost: float, now: float):
+        start = now - now % self.bucket_seconds
+        if self.buckets and self.buckets[-1][0] == start:
+            _, old_tokens, old_cost = self.buckets[-1]
+            self.buckets[-1] = (start, old_tokens + tokens, old_cost + cost)
+        else:
+            self.buckets.append((start, tokens, cost))
+        # Nothing older than the longest window is ever needed again
+        while self.buckets and self.buckets[0][0] <= now - WINDOWS["day"]:
+            self.buckets.popleft()
+
+    def total(self, window: str, now: float):
+        """(tokens, cost) used in the last window"""
+        cutoff = now - WINDOWS[window]
+        tokens = cost = 0
+        for start, bucket_tokens, bucket_cost in self.buckets:
+            if start > cutoff:
+                tokens += bucket_tokens
+                cost += bucket_cost
+        return tokens, cost
+
+
+class TokenBudget:
+    """Per-guild and global token accounting with rolling hourly and daily budgets
+
+    Usage comes from the usage block of each Mistral response. The fuller the tightest
+    applicable budget is, the higher the degradation level callers should run at; no
+    limit configured means that budget never fills."""
+
+    def __init__(self, hourly_limit=None, daily_limit=None, guild_hourly_limit=None, guild_daily_limit=None,
+                 thresholds=(0.6, 0.8, 0.95)):
+        self.limits = {
+            "global": {"hour": hourly_limit, "day": daily_limit},
+            "guild": {"hour": guild_hourly_limit, "day": guild_daily_limit},
+        }
+        self.thresholds = thresholds  # usage fraction at which ECONOMY, CACHED and LOCAL kick in
+        self.global_usage = _RollingCounter()
+        self.guild_usage = defaultdict(_RollingCounter)
+        self.model_tokens = defaultdict(int)
+        self._last_level = {}
+
+    @classmethod
+    def from_env(cls) -> "TokenBudget":
+        return cls(
+            hourly_limit=_env_limit("TOKEN_BUDGET_HOURLY"),
+            daily_limit=_env_limit("TOKEN_BUDGET_DAILY"),
+            guild_hourly_limit=_env_limit("GUILD_TOKEN_BUDGET_HOURLY"),
+            guild_daily_limit=_env_limit("GUILD_TOKEN_BUDGET_DAILY"),
+        )
+
+    def record(self, guild, model: str, prompt_tokens: int, completion_tokens: int):
+        """Account for one response's usage"""
+        now = time.time()
+        prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+        cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+        tokens = prompt_tokens + completion_tokens
+        self.global_usage.add(tokens, cost, now)
+        self.guild_usage[guild].add(tokens, cost, now)
+        self.model_tokens[model] += tokens
+        metrics.incr("llm.tokens", tokens, model=model)
+        metrics.incr("llm.cost_usd", cost, model=model)
+
+    def record_response(self, guild, model: str, response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        self.record(guild, model, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+    def usage_fraction(self, guild=None) -> float:
+        """Fullness of the tightest budget that applies to this guild (0 when unlimited)"""
+        now = time.time()
+        fraction = 0.0
+        scopes = [("global", self.global_usage)]
+        if guild is not None:
+            scopes.append(("guild", self.guild_usage[guild]))
+        for scope, counter in scopes:
+            for window, limit in self.limits[scope].items():
+                if limit:
+                    tokens, _ = counter.total(window, now)
+                    fraction = max(fraction, tokens / limit)
+        return fraction
+
+    def level(self, guild=None) -> int:
+        fraction = self.usage_fraction(guild)
+        level = NORMAL
+        for candidate, threshold in zip((ECONOMY, CACHED, LOCAL), self.thresholds):
+            if fraction >= threshold:
+                level = candidate
+        if self._last_level.get(guild, NORMAL) != level:
+            logger.warning("Token budget for guild %s: %.0f%% used, switching to %s mode", guild, fraction * 100, LEVEL_NAMES[level])
+            metrics.incr("budget.level_changes", level=LEVEL_NAMES[level])
+            self._last_level[guild] = level
+        return level
+
+    def report(self, guild=None) -> str:
+        """Current spend, for the !spend command"""
+        now = time.time()
+        lines = []
+        scopes = [("Global", "global", self.global_usage)]
+        if guild is not None:
+            scopes.append((f"Guild {guild}", "guild", self.guild_usage[guild]))
+        for title, scope, counter in scopes:
+            lines.append(f"{title}:")
+            for window, limit in self.limits[scope].items():
+                tokens, cost = counter.total(window, now)
+                limit_text = f"/{limit}" if limit else " (no limit)"
+                lines.append(f"  last {window}: {tokens}{limit_text} tokens, ~${cost:.4f}")
+        lines.append(f"Mode: {LEVEL_NAMES[self.level(guild)]} ({self.usage_fraction(guild):.0%} of tightest budget)")
+        for model, tokens in sorted(self.model_tokens.items()):
+            lines.append(f"  {model}: {tokens} tokens since start")
+        return "\n".join(lines)
@@ -0,0 +1,45 @@
+from typing import Iterable, Optional, Tuple
+
+import discord
+
+# Buttons and select menus offered with the game's prompts. A press reaches the adventure that
+# sent the prompt through its custom_id, adv:<player>:<turn>:<phase>:<answer>, where answer is
+# what the player would otherwise have typed (SELECT: the chosen option's value). The turn and
+# phase tell a press on an old prompt from one on the current one.
+PREFIX = "adv"
+SELECT = "select"
+
+
+def custom_id(player, turn: int, phase: str, answer: str) -> str:
+    return f"{PREFIX}:{player}:{turn}:{phase}:{answer}"
+
+
+def parse_custom_id(value: str) -> Optional[Tuple[int, int, str, str]]:
+    """(player, turn, phase, answer), or None for a custom_id that isn't the game's"""
+    parts = value.split(":", 4)
+    if len(parts) != 5 or parts[0] != PREFIX:
+        return None
+    try:
+        return int(parts[1]), int(parts[2]), parts[3], parts[4]
+    except ValueError:
+        return None
+
+
+def button_view(player, turn: int, phase: str, choices: Iterable[Tuple[str, str]],
+                style: discord.ButtonStyle = discord.ButtonStyle.primary) -> discord.ui.View:
+    """One button per (answer, label), at most 25"""
+    view = discord.ui.View(timeout=None)
+    for answer, label in list(choices)[:25]:
+        view.add_item(discord.ui.Button(label=label[:80], style=style,
+                                        custom_id=custom_id(player, turn, phase, answer)))
+    return view
+
+
+def select_view(player, turn: int, phase: str, choices: Iterable[Tuple[str, str]],
+                placeholder: str) -> discord.ui.View:
+    """A select menu with one option per (answer, label), at most 25"""
+    view = discord.ui.View(timeout=None)
+    view.add_item(discord.ui.Select(custom_id=custom_id(player, turn, phase, SELECT), placeholder=placeholder,
+                                    options=[discord.SelectOption(label=label[:100], value=answer)
+                                             for answer, label in list(choices)[:25]]))
+    return view
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Per-request rate-limit headers, in the spellings APIs commonly use (OpenAI style first,
+# then the IETF RateLimit draft and the bare x-ratelimit-* form)
+REMAINING_HEADERS = ("x-ratelimit-remaining-requests", "ratelimit-remaining", "x-ratelimit-remaining")
+LIMIT_HEADERS = ("x-ratelimit-limit-requests", "ratelimit-limit", "x-ratelimit-limit")
+RESET_HEADERS = ("x-ratelimit-reset-requests", "ratelimit-reset", "x-ratelimit-reset")
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)?")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0, None: 1.0}
+
+
+def parse_seconds(value) -> Optional[float]:
+    """A delay header as seconds from now: "2", "0.5", "250ms", "1m30s", an epoch timestamp
+    or an HTTP date. None if missing or unparseable."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        seconds = float(value)
+        # Some APIs send the reset time as a Unix timestamp rather than a delay
+        return max(0.0, seconds - time.time()) if seconds > 1e9 else max(0.0, seconds)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if parts and "".join(number + (unit or "") for number, unit in parts) == value:
+        return sum(float(number) * _UNITS[unit or None] for number, unit in parts)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _first(headers, names):
+    if headers is None:
+        return None
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+def retry_after(headers) -> Optional[float]:
+    """Seconds a throttled client is asked to wait: Retry-After (0 included), else the rate-limit reset"""
+    seconds = parse_seconds(_first(headers, ("retry-after",)))
+    if seconds is None:
+        seconds = parse_seconds(_first(headers, RESET_HEADERS))
+    return seconds
+
+
+class AdaptiveConcurrency:
+    """Limits how many LLM requests are in flight at once, learning the limit from the API
+
+    The limit grows additively while requests succeed (by increase per limit's worth of
+    successes, i.e. about one more request per round trip) and is multiplied by decrease on
+    a 429 (AIMD), after which nothing is sent until Retry-After has passed. A burst of 429s
+    caused by one overshoot only shrinks the limit once: requests granted before the last
+    decrease don't count. When responses carry rate-limit headers, no more requests are
+    started in the current window than the server says remain."""
+
+    def __init__(self, initial: float = 2.0, minimum: float = 1.0, maximum: float = 32.0,
+                 increase: float = 1.0, decrease: float = 0.5, default_pause: float = 1.0, name: str = "llm"):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.default_pause = default_pause  # wait after a 429 that has no Retry-After
+        self.name = name
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.window_remaining = None  # requests left in the server's current window, if it tells us
+        self.window_reset = 0.0
+        self.quota = None  # requests per window, if the server tells us
+        self._last_decrease = float("-inf")
+        self._changed = None
+
+    def _window_exhausted(self, now) -> bool:
+        if self.window_remaining is None:
+            return False
+        if now >= self.window_reset:
+            self.window_remaining = None
+            return False
+        return self.window_remaining <= 0
+
+    def has_room(self) -> bool:
+        now = time.monotonic()
+        return now >= self.paused_until and not self._window_exhausted(now) and self.in_flight < int(self.limit)
+
+    def wake_in(self) -> Optional[float]:
+        """Seconds until a pause or an exhausted window stops blocking new requests, or None
+        if only requests finishing can make room"""
+        now = time.monotonic()
+        wake = self.paused_until - now
+        if self._window_exhausted(now):
+            wake = max(wake, self.window_reset - now)
+        return wake if wake > 0 else None
+
+    async def wait_for_slot(self):
+        """Wait until another request may be started"""
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        while not self.has_room():
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), self.wake_in())
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> float:
+        """Count a request as in flight; returns its grant time, to pass back to release"""
+        self.in_flight += 1
+        if self.window_remaining is not None:
+            self.window_remaining -= 1
+        metrics.gauge("llm.in_flight", self.in_flight, limiter=self.name)
+        return time.monotonic()
+
+    def release(self, granted: float, status: str = "ok", retry_after: Optional[float] = None):
+        """A request granted at granted has finished: status is "ok", "throttled" (429) or
+        anything else ("error", "cancelled"), which leaves the limit alone"""
+        self.in_flight -= 1
+        now = time.monotonic()
+        if status == "ok":
+            self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+        elif status == "throttled":
+            metrics.incr("llm.throttled", limiter=self.name)
+            if granted >= self._last_decrease:
+                previous = self.limit
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self._last_decrease = now
+                logger.info("Throttled: concurrency limit %.1f -> %.1f", previous, self.limit,
+                            extra={"event": "llm.throttled", "retry_after": retry_after})
+            pause = self.default_pause if retry_after is None else retry_after
+            self.paused_until = max(self.paused_until, now + pause)
+        metrics.gauge("llm.concurrency_limit", self.limit, limiter=self.name)
+        metrics.gauge("llm.in_flight", self.in_flight, limiter=self.name)
+        if self._changed is not None:
+            self._changed.set()
+
+    def observe_headers(self, headers):
+        """Take the server's view of the current window from a response's rate-limit headers"""
+        remaining = _first(headers, REMAINING_HEADERS)
+        if remaining is None:
+            return
+        try:
+            remaining = int(float(remaining))
+        except ValueError:
+            return
+        limit = _first(headers, LIMIT_HEADERS)
+        if limit is not None and limit.isdigit() and int(limit) != self.quota:
+            self.quota = int(limit)
+            logger.info("Server reports a quota of %d requests per window", self.quota)
+        reset = parse_seconds(_first(headers, RESET_HEADERS))
+        self.window_remaining = remaining
+        self.window_reset = time.monotonic() + (self.default_pause if reset is None else reset)
+        metrics.gauge("llm.window_remaining", remaining, limiter=self.name)
+        if remaining > 0 and self._changed is not None:
+            self._changed.set()
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import resource
+import time
+from typing import Callable, List, Optional
+
+from discord.ext import commands
+
+from metrics import metrics
+from state import StateBackend, WORKER_ID
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PREFIX = "health:"
+
+
+def shard_settings():
+    """(shard_ids, shard_count) for this worker, or None for the classic unsharded bot.
+
+    SHARD_COUNT and SHARD_IDS ("0,2") are set by supervisor.py for each worker process;
+    SHARDS=auto runs every shard in this one process with Discord's recommended count
+    (shard_ids and shard_count both None)."""
+    count = os.getenv("SHARD_COUNT")
+    if count:
+        ids = os.getenv("SHARD_IDS")
+        return ([int(shard) for shard in ids.split(",")] if ids else None), int(count)
+    if os.getenv("SHARDS") == "auto":
+        return None, None
+    return None
+
+
+def create_bot(command_prefix, intents) -> commands.Bot:
+    """An AutoShardedBot when sharding is configured, otherwise a plain Bot.
+
+    Discord sends every event of a guild to shard (guild_id >> 22) % shard_count, so a
+    worker owning a set of shards sees all messages of its guilds: a player's adventure,
+    their replies and their !end always reach the same process."""
+    settings = shard_settings()
+    if settings is None:
+        return commands.Bot(command_prefix=command_prefix, intents=intents)
+    shard_ids, shard_count = settings
+    logger.info("Worker %s running shards %s of %s", WORKER_ID, shard_ids or "all", shard_count or "auto")
+    return commands.AutoShardedBot(command_prefix=command_prefix, intents=intents,
+                                   shard_ids=shard_ids, shard_count=shard_count)
+
+
+class HealthReporter:
+    """Publishes this worker's health to the shared state every interval seconds (and as
+    shard-labelled gauges), where the supervisor and !fleet read it. A worker whose record
+    has expired has stopped reporting."""
+
+    def __init__(self, bot, backend: StateBackend, sessions: Callable[[], int], interval: float = 10.0):
+        self.bot = bot
+        self.backend = backend
+        self.sessions = sessions
+        self.interval = interval
+        self.started = time.time()
+        self._task = None
+
+    def snapshot(self) -> dict:
+        shards = {}
+        latencies = getattr(self.bot, "latencies", None) or [(0, self.bot.latency)]
+        for shard_id, latency in latencies:
+            guilds = sum(1 for guild in self.bot.guilds if (guild.shard_id or 0) == shard_id)
+            latency_ms = None if latency != latency else round(latency * 1000, 1)  # NaN before the first heartbeat
+            shards[str(shard_id)] = {"latency_ms": latency_ms, "guilds": guilds}
+            metrics.gauge("discord.shard_latency", latency_ms or 0, shard=shard_id)
+            metrics.gauge("discord.shard_guilds", guilds, shard=shard_id)
+        loop_lag = metrics.summary("loop.lag")
+        return {
+            "worker": WORKER_ID,
+            "pid": os.getpid(),
+            "at": time.time(),
+            "uptime": round(time.time() - self.started),
+            "shards": shards,
+            "sessions": self.sessions(),
+            "loop_lag_p95_ms": round(loop_lag["p95"] * 1000, 1) if loop_lag else None,
+            "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                snapshot = self.snapshot()
+                metrics.gauge("worker.sessions", snapshot["sessions"])
+                await self.backend.set(HEALTH_PREFIX + WORKER_ID, snapshot, ttl=self.interval * 3)
+            except Exception as e:
+                logger.warning("Health report failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+
+async def fleet_health(backend: StateBackend) -> List[dict]:
+    """Latest health record of every worker still reporting"""
+    snapshots = []
+    for key in await backend.keys(HEALTH_PREFIX):
+        snapshot = await backend.get(key)
+        if snapshot:
+            snapshots.append(snapshot)
+    return sorted(snapshots, key=lambda snapshot: snapshot["worker"])
+
+
+def format_fleet(snapshots: List[dict], expected: Optional[int] = None) -> str:
+    if not snapshots:
+        return "No workers are reporting health."
+    lines = [f"{'worker':<24}{'shards':<12}{'guilds':>7}{'sessions':>9}{'latency':>10}{'loop p95':>10}{'rss MB':>8}{'age s':>7}"]
+    now = time.time()
+    for snapshot in snapshots:
+        shards = snapshot["shards"]
+        latencies = [shard["latency_ms"] for shard in shards.values() if shard["latency_ms"] is not None]
+        latency = f"{max(latencies):.0f}ms" if latencies else "-"
+        loop_lag = snapshot.get("loop_lag_p95_ms")
+        lines.append(f"{snapshot['worker'][:23]:<24}{','.join(shards)[:11]:<12}"
+                     f"{sum(shard['guilds'] for shard in shards.values()):>7}{snapshot['sessions']:>9}{latency:>10}"
+                     f"{'-' if loop_lag is None else f'{loop_lag:.0f}ms':>10}{snapshot['rss_mb']:>8.0f}"
+                     f"{now - snapshot['at']:>7.0f}")
+    if expected is not None and len(snapshots) < expected:
+        lines.append(f"{expected - len(snapshots)} of {expected} workers are not reporting")
+    return "\n".join(lines)
@@ -0,0 +1,371 @@
+"""Drive bot.py's real command handlers with simulated Discord users, without a network.
+
+Usage: python gateway_sim.py [--users N] [--guilds G] [--think SECONDS] [--llm-latency SECONDS]
+                             [--llm-interval SECONDS] [--duration SECONDS] [--out sent.jsonl] [--buttons]
+
+Player messages are fed through discord.py's own MESSAGE_CREATE handling, so they reach
+on_message, command dispatch and wait_for exactly as gateway events would. The HTTP client
+is replaced with one that records every message the bot sends (and echoes it back as a
+gateway event, as Discord does). Each simulated player starts an adventure, describes a
+character, attacks and shops with some think time, and the run reports dispatch latency
+and send throughput. With --buttons, players answer through the prompts' buttons and select
+menus (INTERACTION_CREATE events) instead of typing. LLM calls get canned responses after
+--llm-latency seconds."""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from types import MethodType, SimpleNamespace
+
+import discord
+from discord.webhook.async_ import async_context
+
+from metrics import metrics
+
+_ids = itertools.count(1_000_000)
+
+
+def _snowflake() -> str:
+    return str(next(_ids))
+
+
+def _user_payload(user_id, name, bot=False):
+    return {"id": str(user_id), "username": name, "discriminator": "0", "avatar": None, "global_name": name, "bot": bot}
+
+
+def _message_payload(channel, author, content, guild_id=None):
+    data = {
+        "id": _snowflake(),
+        "channel_id": str(channel),
+        "author": author,
+        "content": content,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+    if guild_id is not None:
+        data["guild_id"] = str(guild_id)
+        data["member"] = {"roles": [], "joined_at": data["timestamp"], "deaf": False, "mute": False}
+    return data
+
+
+class SimulatedHTTP:
+    """Stands in for discord.http.HTTPClient. Only the routes the game uses are implemented;
+    anything else raises, so a new call into Discord shows up as an error rather than silently
+    doing nothing."""
+
+    # Read by discord.Interaction and its responses, which go through the webhook adapter below
+    _HTTPClient__session = None
+    proxy = None
+    proxy_auth = None
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    async def send_message(self, channel_id, *, params):
+        content = params.payload.get("content") or ""
+        return self.gateway.bot_sent(int(channel_id), content, params.payload.get("components"))
+
+
+class SimulatedWebhookAdapter:
+    """Stands in for discord.py's webhook adapter, which interaction responses are sent with"""
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    async def create_interaction_response(self, interaction_id, token, *, session, proxy=None, proxy_auth=None,
+                                          params):
+        self.gateway.interaction_responses += 1
+        return {"interaction": {"id": str(interaction_id), "type": 3}}
+
+    def __getattr__(self, name):
+        raise NotImplementedError(f"Simulated gateway does not implement webhook route {name}")
+
+    async def send_typing(self, channel_id):
+        return None
+
+    def __getattr__(self, name):
+        raise NotImplementedError(f"Simulated gateway does not implement HTTP route {name}")
+
+
+class SimulatedGateway:
+    """Installs itself on a commands.Bot and plays the part of Discord for it"""
+
+    def __init__(self, bot, echo: bool = True, record_path: str = None):
+        self.bot = bot
+        self.echo = echo  # Discord sends the bot's own messages back as MESSAGE_CREATE events
+        self.state = bot._connection
+        self.bot_user = _user_payload(1, "adventure-bot", bot=True)
+        self.guild_of_channel = {}
+        self.listeners = defaultdict(list)  # channel id -> queues receiving the bot's messages
+        self.sent = 0
+        self.received = 0
+        self.interactions = 0
+        self.interaction_responses = 0
+        self.prompts = {}  # channel id -> the bot's last message there with buttons or a select menu
+        self.record_file = open(record_path, "a") if record_path else None
+
+    def install(self):
+        self.bot.loop = asyncio.get_running_loop()
+        self.bot.http = self.state.http = SimulatedHTTP(self)
+        self.state.user = discord.ClientUser(state=self.state, data=self.bot_user)
+        async_context.set(SimulatedWebhookAdapter(self))
+
+    def add_guild(self, name: str) -> int:
+        guild_id = int(_snowflake())
+        guild = discord.Guild(data={"id": str(guild_id), "name": name, "roles": [], "emojis": [], "stickers": [],
+                                    "features": [], "member_count": 0}, state=self.state)
+        self.state._add_guild(guild)
+        return guild_id
+
+    def add_channel(self, guild_id: int, name: str) -> int:
+        channel_id = int(_snowflake())
+        guild = self.state._get_guild(guild_id)
+        guild._add_channel(discord.TextChannel(state=self.state, guild=guild, data={
+            "id": str(channel_id), "name": name, "type": 0, "position": 0, "permission_overwrites": [],
+            "guild_id": str(guild_id)}))
+        self.guild_of_channel[channel_id] = guild_id
+        return channel_id
+
+    def subscribe(self, channel_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self.listeners[channel_id].append(queue)
+        return queue
+
+    def deliver(self, channel_id: int, author: dict, content: str):
+        """A user message arriving over the gateway"""
+        self.received += 1
+        data = _message_payload(channel_id, author, content, self.guild_of_channel.get(channel_id))
+        self.state.parse_message_create(data)
+
+    def interact(self, channel_id: int, author: dict, message: dict, custom_id: str, component_type: int,
+                 values=None):
+        """A user pressing a button (component_type 2) or picking from a select menu (3) on message"""
+        self.interactions += 1
+        guild_id = self.guild_of_channel.get(channel_id)
+        data = {
+            "id": str(discord.utils.time_snowflake(datetime.now(timezone.utc))),
+            "application_id": self.bot_user["id"],
+            "type": 3,
+            "token": "simulated",
+            "version": 1,
+            "attachment_size_limit": 8 * 1024 * 1024,
+            "channel_id": str(channel_id),
+            "channel": {"id": str(channel_id), "type": 0},
+            "message": message,
+            "data": {"custom_id": custom_id, "component_type": component_type, "values": values or []},
+        }
+        if guild_id is not None:
+            data["guild_id"] = str(guild_id)
+            data["member"] = {"user": author, "roles": [], "joined_at": message["timestamp"], "deaf": False,
+                              "mute": False, "flags": 0, "permissions": "0"}
+        else:
+            data["user"] = author
+        self.state.parse_interaction_create(data)
+
+    def bot_sent(self, channel_id: int, content: str, components=None) -> dict:
+        self.sent += 1
+        metrics.incr("sim.bot_messages")
+        if self.record_file is not None:
+            self.record_file.write(json.dumps({"t": time.time(), "channel": channel_id, "content": content}) + "\n")
+        data = _message_payload(channel_id, self.bot_user, content, self.guild_of_channel.get(channel_id))
+        if components:
+            data["components"] = components
+            self.prompts[channel_id] = data
+        for queue in self.listeners[channel_id]:
+            queue.put_nowait(content)
+        if self.echo:
+            self.bot.loop.call_soon(self.state.parse_message_create, dict(data))
+        return data
+
+    def close(self):
+        if self.record_file is not None:
+            self.record_file.close()
+
+
+ATTACKS = ["swing my sword as hard as I can", "cast a fireball", "sneak behind it and stab", "throw my shield",
+           "call down holy light", "sweep its legs"]
+
+
+class SimulatedPlayer:
+    """Plays one adventure through the bot's commands, answering whatever it is asked"""
+
+    def __init__(self, gateway, guild_id: int, number: int, think: float, seed: int, buttons: bool = False):
+        self.gateway = gateway
+        self.buttons = buttons
+        self.rng = random.Random(seed)
+        self.think = think
+        self.author = _user_payload(2_000_000 + number, f"player{number}")
+        self.channel = gateway.add_channel(guild_id, f"adventure-{number}")
+        self.inbox = gateway.subscribe(self.channel)
+        self.finished = False
+        self.said_at = None
+        self.awaiting_reply = False
+
+    async def say(self, content: str):
+        if self.think:
+            await asyncio.sleep(self.rng.expovariate(1 / self.think))
+        self.said_at = time.perf_counter()
+        self.awaiting_reply = True
+        self.gateway.deliver(self.channel, self.author, content)
+
+    def reply_to(self, content: str):
+        """What the player types in answer to a bot message, or None if it needs no answer"""
+        if "What kind of character" in content:
+            return self.rng.choice(["a grumpy dwarf warrior", "an elven mage", "surprise me", "a sneaky halfling rogue"])
+        if "Which monster do you want to attack" in content:
+            return f"1 {self.rng.choice(ATTACKS)}"
+        if "What would you like to do?" in content:
+            return self.rng.choice(["1", "2", "3", "3"])
+        if "What would you like to buy?" in content:
+            return self.rng.choice(["1", "2", "back"])
+        return None
+
+    async def press(self, content: str, answer: str) -> bool:
+        """Give answer through the prompt's button or select menu, if content came with one"""
+        prompt = self.gateway.prompts.get(self.channel)
+        if not self.buttons or prompt is None or prompt["content"] != content:
+            return False
+        key = answer.split(" ", 1)[0]
+        for row in prompt["components"]:
+            for component in row["components"]:
+                if component["type"] == 2 and component["custom_id"].rsplit(":", 1)[-1] == key:
+                    values = None
+                elif component["type"] == 3 and any(option["value"] == key for option in component["options"]):
+                    values = [key]
+                else:
+                    continue
+                if self.think:
+                    await asyncio.sleep(self.rng.expovariate(1 / self.think))
+                self.said_at = time.perf_counter()
+                self.awaiting_reply = True
+                self.gateway.interact(self.channel, self.author, prompt, component["custom_id"], component["type"],
+                                      values)
+                return True
+        return False
+
+    async def play(self, theme: str):
+        await self.say(f"!start {theme}")
+        while True:
+            content = await self.inbox.get()
+            if self.awaiting_reply:
+                # Time from the player's message to the bot's first reply: dispatch plus handling
+                metrics.observe("sim.response_time", time.perf_counter() - self.said_at)
+                self.awaiting_reply = False
+            if content.startswith("Final Coins") or "journey comes to an end" in content or content.startswith("An error occurred"):
+                self.finished = True
+                return
+            answer = self.reply_to(content)
+            if answer is not None and not await self.press(content, answer):
+                await self.say(answer)
+
+
+CANNED = {
+    "generate_monster_template": lambda rng: json.dumps({"name": f"Simulated Beast {rng.randint(1, 10**6)}",
+                                                         "hp": rng.randint(20, 60), "attack": rng.randint(5, 12),
+                                                         "defense": rng.randint(2, 8)}),
+    "generate_village_items": lambda rng: json.dumps({"items": [
+        {"name": f"Simulated Potion {rng.randint(1, 999)}", "price": 10, "description": "Restores health", "type": "Potion"},
+        {"name": f"Simulated Blade {rng.randint(1, 999)}", "price": 40, "description": "Sharp", "type": "Weapon"}]}),
+    "estimate_attack_damage": lambda rng: json.dumps({"damage_score": rng.randint(3, 10)}),
+    "generate_character": lambda rng: json.dumps({"name": "Sim Hero", "character_class": rng.choice(["Warrior", "Mage"]),
+                                                  "level": 2, "stats": {"Strength": 12, "Dexterity": 11, "Constitution": 12,
+                                                                        "Intelligence": 10, "Wisdom": 10, "Charisma": 9},
+                                                  "inventory": ["Health Potion"], "abilities": ["Slash", "Block"],
+                                                  "background": "Simulated."}),
+    "generate_encounter": lambda rng: json.dumps({"setting": f"Simulated Glade {rng.randint(1, 99)}",
+                                                  "narrative": "Simulated beasts block the path.",
+                                                  "monsters": [{"name": f"Simulated Beast {rng.randint(1, 10**6)}",
+                                                                "hp": rng.randint(20, 60), "attack": rng.randint(5, 12),
+                                                                "defense": rng.randint(2, 8)}
+                                                               for _ in range(rng.randint(1, 3))]}),
+    "generate_story_arc": lambda rng: json.dumps({"title": "The Simulated Crown", "antagonist": "the Simulated Lich",
+                                                  "beats": [{"setting": f"Simulated Vale {i}",
+                                                             "milestone": "Something stirs ahead."} for i in range(5)],
+                                                  "ending": "The simulated land is at peace."}),
+}
+
+
+def install_canned_llm(agent, latency: float, seed: int = 0):
+    """Answer the agent's LLM calls locally after latency seconds, so load runs cost nothing"""
+    rng = random.Random(seed)
+
+    async def _send(self, model, messages, method=None, client=None, **options):
+        await asyncio.sleep(latency)
+        if method == "estimate_attack_damage_batch":
+            count = len(re.findall(r'^\d+\. "', messages[-1]["content"], re.MULTILINE))
+            content = json.dumps({"scores": [rng.randint(3, 10) for _ in range(count)]})
+        else:
+            content = CANNED.get(method, lambda rng: "The adventure continues in a simulated land.")(rng)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                               usage=SimpleNamespace(prompt_tokens=0, completion_tokens=0))
+
+    agent._send = MethodType(_send, agent)
+
+
+async def run(users: int, guilds: int, think: float, llm_latency: float, llm_interval: float, duration: float,
+              out: str = None, buttons: bool = False):
+    import bot as bot_module
+
+    agent = bot_module.get_agent()
+    install_canned_llm(agent, llm_latency)
+    agent.scheduler.min_interval = llm_interval
+    gateway = SimulatedGateway(bot_module.build_bot(), record_path=out)
+    gateway.install()
+
+    guild_ids = [gateway.add_guild(f"guild-{i}") for i in range(guilds)]
+    players = [SimulatedPlayer(gateway, guild_ids[i % guilds], i, think, seed=i, buttons=buttons)
+               for i in range(users)]
+    started = time.perf_counter()
+    tasks = [asyncio.ensure_future(player.play(theme=f"theme {i % 7}")) for i, player in enumerate(players)]
+    done, pending = await asyncio.wait(tasks, timeout=duration)
+    for task in pending:
+        task.cancel()
+    elapsed = time.perf_counter() - started
+    gateway.close()
+
+    response = metrics.summary("sim.response_time") or {"count": 0, "mean": 0, "p50": 0, "p95": 0, "max": 0}
+    print(f"{users} players in {guilds} guilds for {elapsed:.1f}s: "
+          f"{sum(player.finished for player in players)} finished, {len(pending)} still playing")
+    print(f"Player messages: {gateway.received} ({gateway.received / elapsed:.0f}/s), "
+          f"interactions: {gateway.interactions} ({gateway.interaction_responses} acknowledged), "
+          f"bot messages: {gateway.sent} ({gateway.sent / elapsed:.0f}/s, "
+          f"{gateway.sent / max(1, gateway.received + gateway.interactions):.1f} per player input)")
+    print(f"Response time: p50 {response['p50'] * 1000:.1f}ms, p95 {response['p95'] * 1000:.1f}ms, "
+          f"max {response['max'] * 1000:.1f}ms (last {response['count']} replies)")
+    print(metrics.report("adventure.turn_time"))
+    print(metrics.report("discord.interaction_ack"))
+    print(metrics.report("llm."))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--think", type=float, default=0.5, help="mean player think time in seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds per simulated LLM call")
+    parser.add_argument("--llm-interval", type=float, default=0.0, help="scheduler spacing between LLM calls")
+    parser.add_argument("--duration", type=float, default=60.0, help="stop after this many seconds")
+    parser.add_argument("--out", help="append every message the bot sends to this JSONL file")
+    parser.add_argument("--buttons", action="store_true", help="answer with the prompts' buttons and select menus")
+    args = parser.parse_args()
+    os.environ.setdefault("MISTRAL_API_KEY", "simulated")
+    asyncio.run(run(args.users, args.guilds, args.think, args.llm_latency, args.llm_interval, args.duration, args.out,
+                    args.buttons))
+
+
+if __name__ == "__main__":
+    main()
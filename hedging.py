@@ -0,0 +1,71 @@
+import os
+from collections import defaultdict, deque
+from typing import Optional
+
+from metrics import metrics, percentile
+
+
+class HedgePolicy:
+    """When to send a second copy of a slow request, and how often that is allowed
+
+    A request that has not finished after the percentile of its method's recent latencies
+    (clamped to min_delay..max_delay; initial_delay until min_samples are known) gets a
+    duplicate, optionally on a faster model, and whichever finishes first is used. Hedges
+    are capped at max_rate of the hedgeable requests: every request earns max_rate of a
+    credit (up to burst) and a hedge spends a whole one. A hedge is also only sent while the
+    scheduler has a free slot and nothing queued, so it never delays another request or
+    pushes the rate limiter past its quota."""
+
+    def __init__(self, percentile: float = 95.0, min_delay: float = 0.2, max_delay: float = 5.0,
+                 initial_delay: float = 2.0, max_rate: float = 0.1, burst: float = 2.0, window: int = 200,
+                 min_samples: int = 20, model: Optional[str] = None):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.initial_delay = initial_delay
+        self.max_rate = max_rate
+        self.burst = burst
+        self.min_samples = min_samples
+        self.model = model  # None: hedge on the same model as the original request
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+        self.credit = burst
+
+    @classmethod
+    def from_env(cls) -> Optional["HedgePolicy"]:
+        """None unless HEDGE_REQUESTS=1. HEDGE_PERCENTILE (95), HEDGE_MIN_DELAY (0.2s),
+        HEDGE_MAX_DELAY (5s), HEDGE_MAX_RATE (0.1 hedges per request) and HEDGE_MODEL (a
+        faster model for the duplicates, e.g. mistral-small-latest) tune it."""
+        if os.getenv("HEDGE_REQUESTS", "0") != "1":
+            return None
+        return cls(percentile=float(os.getenv("HEDGE_PERCENTILE", "95")),
+                   min_delay=float(os.getenv("HEDGE_MIN_DELAY", "0.2")),
+                   max_delay=float(os.getenv("HEDGE_MAX_DELAY", "5")),
+                   max_rate=float(os.getenv("HEDGE_MAX_RATE", "0.1")),
+                   model=os.getenv("HEDGE_MODEL") or None)
+
+    def observe(self, method: str, seconds: float):
+        """Latency of a finished (or, for the slow original of a hedge, abandoned) attempt"""
+        self.latencies[method].append(seconds)
+
+    def delay(self, method: str) -> float:
+        """Seconds to wait for a request before hedging it"""
+        samples = self.latencies[method]
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        return min(self.max_delay, max(self.min_delay, percentile(samples, self.percentile)))
+
+    def request(self):
+        """A hedgeable request has started"""
+        self.credit = min(self.burst, self.credit + self.max_rate)
+
+    def allow(self, scheduler, method: str) -> bool:
+        """Whether a hedge may be sent now; spends a credit if so"""
+        concurrency = scheduler.concurrency
+        if scheduler.queue_length() or (concurrency is not None and not concurrency.has_room()):
+            metrics.incr("llm.hedges_skipped", method=method, reason="busy")
+            return False
+        if self.credit < 1.0:
+            metrics.incr("llm.hedges_skipped", method=method, reason="rate")
+            return False
+        self.credit -= 1.0
+        return True
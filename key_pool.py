@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from typing import Callable, List, Optional
+
+import httpx
+
+from concurrency import AdaptiveConcurrency
+from metrics import metrics
+from transport import TransportSettings, WarmClient
+
+logger = logging.getLogger(__name__)
+
+
+class Lease:
+    """A request granted on one endpoint; handed back to KeyPool.release when it is done"""
+
+    __slots__ = ("endpoint", "granted")
+
+    def __init__(self, endpoint, granted: float):
+        self.endpoint = endpoint
+        self.granted = granted
+
+
+class Endpoint:
+    """One API key on one server, with its own client (over a pooled, pre-warmable
+    transport.WarmClient), concurrency limit and health. The Mistral client is created on
+    first use: importing the SDK is the slowest part of starting the bot.
+
+    After eject_after consecutive errors (not 429s, which only slow it down) the endpoint is
+    ejected for eject_time seconds, doubling with every further ejection up to max_eject_time;
+    a successful request restores it fully."""
+
+    def __init__(self, name: str, api_key: str, server_url: Optional[str] = None, initial_concurrency: float = 2.0,
+                 max_concurrency: float = 32.0, eject_after: int = 3, eject_time: float = 15.0,
+                 max_eject_time: float = 600.0, on_change: Optional[Callable[[], None]] = None,
+                 transport: Optional[TransportSettings] = None):
+        self.name = name
+        self.server_url = server_url
+        self.concurrency = AdaptiveConcurrency(initial=initial_concurrency, maximum=max_concurrency, name=name)
+        self.http = WarmClient(name, server_url, api_key, event_hooks={"response": [self._observe_response]},
+                               settings=transport)
+        self._client = None
+        self.eject_after = eject_after
+        self.eject_time = eject_time
+        self.max_eject_time = max_eject_time
+        self.on_change = on_change
+        self.failures = 0  # consecutive errors
+        self.ejections = 0  # ejections since the last success
+        self.ejected_until = 0.0
+        self.usage = Counter()
+
+    @property
+    def client(self):
+        if self._client is None:
+            from mistralai import Mistral
+
+            self._client = Mistral(api_key=self.http.api_key, server_url=self.server_url,
+                                   async_client=self.http.client)
+        return self._client
+
+    async def _observe_response(self, response: httpx.Response):
+        """httpx response hook: feeds rate-limit headers of completion responses to the limiter"""
+        if not response.request.url.path.endswith("/chat/completions"):
+            return  # warm-up pings say nothing about the chat quota
+        self.concurrency.observe_headers(response.headers)
+        if self.on_change is not None:
+            self.on_change()
+
+    def healthy(self, now: Optional[float] = None) -> bool:
+        return (time.monotonic() if now is None else now) >= self.ejected_until
+
+    def has_room(self) -> bool:
+        return self.healthy() and self.concurrency.has_room()
+
+    def preference(self):
+        """Endpoints with the largest share of their window's quota left go first, then those
+        with the most free concurrency"""
+        limiter = self.concurrency
+        if limiter.window_remaining is None or not limiter.quota:
+            remaining = 1.0
+        else:
+            remaining = limiter.window_remaining / limiter.quota
+        return remaining, int(limiter.limit) - limiter.in_flight
+
+    def finished(self, status: str):
+        self.usage[status] += 1
+        metrics.incr("llm.key_requests", key=self.name, status=status)
+        if status == "ok":
+            self.failures = 0
+            self.ejections = 0
+        elif status == "error":
+            self.failures += 1
+            if self.failures >= self.eject_after and self.healthy():
+                duration = min(self.max_eject_time, self.eject_time * 2 ** self.ejections)
+                self.ejections += 1
+                self.ejected_until = time.monotonic() + duration
+                self.usage["ejections"] += 1
+                metrics.incr("llm.key_ejections", key=self.name)
+                logger.warning("Ejecting endpoint %s for %.0fs after %d consecutive errors", self.name, duration,
+                               self.failures)
+
+    def summary(self) -> dict:
+        limiter = self.concurrency
+        return {
+            "endpoint": self.name,
+            "healthy": self.healthy(),
+            "limit": round(limiter.limit, 1),
+            "in_flight": limiter.in_flight,
+            "window_remaining": limiter.window_remaining,
+            "quota": limiter.quota,
+            **{key: self.usage[key] for key in ("ok", "throttled", "error", "ejections",
+                                                "prompt_tokens", "completion_tokens")},
+        }
+
+
+def failure_status(error: Exception) -> str:
+    """How a failed request reflects on its endpoint: "throttled" for a 429, "rejected" for
+    other client errors (the request's fault, not the key's), else "error" (5xx, bad key,
+    network trouble)"""
+    status_code = getattr(error, "status_code", None)
+    if status_code == 429:
+        return "throttled"
+    if status_code is not None and 400 <= status_code < 500 and status_code not in (401, 403):
+        return "rejected"
+    return "error"
+
+
+def _endpoint_name(index: int, api_key: Optional[str], server_url: Optional[str]) -> str:
+    """A log-safe name: the server's host and port and/or the last characters of the key"""
+    parts = []
+    if server_url:
+        parts.append(httpx.URL(server_url).netloc.decode())
+    if api_key:
+        parts.append(f"key…{api_key[-4:]}")
+    return "/".join(parts) or f"endpoint-{index}"
+
+
+class KeyPool:
+    """Spreads LLM requests over several API keys and/or servers
+
+    Used as the scheduler's concurrency limiter: a slot is free when any healthy endpoint has
+    room, and each grant goes to the preferred endpoint with room (see Endpoint.preference).
+    The scheduler returns the Lease, whose endpoint's client sends the request."""
+
+    def __init__(self, endpoints: List[Endpoint]):
+        if not endpoints:
+            raise ValueError("KeyPool needs at least one endpoint")
+        self.endpoints = endpoints
+        self._changed = None
+        for endpoint in endpoints:
+            endpoint.on_change = self._notify
+
+    @classmethod
+    def from_env(cls) -> "KeyPool":
+        """Endpoints from MISTRAL_ENDPOINTS ("url" or "key@url", comma-separated), else one
+        per key in MISTRAL_API_KEYS, else the single MISTRAL_API_KEY; keys without a URL use
+        MISTRAL_SERVER_URL (or Mistral's own API)"""
+        default_key = os.getenv("MISTRAL_API_KEY")
+        default_url = os.getenv("MISTRAL_SERVER_URL")
+        specs = []
+        for entry in filter(None, (item.strip() for item in os.getenv("MISTRAL_ENDPOINTS", "").split(","))):
+            key, at, url = entry.partition("@")
+            if at and "://" not in key:
+                specs.append((key, url))
+            else:
+                specs.append((default_key, entry))
+        if not specs:
+            keys = [key.strip() for key in os.getenv("MISTRAL_API_KEYS", "").split(",") if key.strip()]
+            specs = [(key, default_url) for key in keys or [default_key]]
+        if any(key is None and url is None for key, url in specs):
+            logger.warning("MISTRAL_API_KEY is not set; requests to the Mistral API will be rejected")
+        settings = dict(initial_concurrency=float(os.getenv("MISTRAL_INITIAL_CONCURRENCY", "2")),
+                        max_concurrency=float(os.getenv("MISTRAL_MAX_CONCURRENCY", "32")),
+                        transport=TransportSettings.from_env())
+        endpoints = [Endpoint(_endpoint_name(index, key, url), key, url, **settings)
+                     for index, (key, url) in enumerate(specs)]
+        if len(endpoints) > 1:
+            logger.info("Spreading requests over %d endpoints: %s", len(endpoints),
+                        ", ".join(endpoint.name for endpoint in endpoints))
+        return cls(endpoints)
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    async def warm_up(self):
+        """Open connections to every endpoint and keep them warm while idle"""
+        await asyncio.gather(*(endpoint.http.warm() for endpoint in self.endpoints))
+        for endpoint in self.endpoints:
+            endpoint.http.start_pings()
+
+    async def close(self):
+        for endpoint in self.endpoints:
+            await endpoint.http.close()
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
+
+    def has_room(self) -> bool:
+        return any(endpoint.has_room() for endpoint in self.endpoints)
+
+    def _wake_in(self) -> Optional[float]:
+        """Seconds until the earliest ejection, pause or exhausted window ends"""
+        now = time.monotonic()
+        waits = []
+        for endpoint in self.endpoints:
+            if not endpoint.healthy(now):
+                waits.append(endpoint.ejected_until - now)
+            elif endpoint.concurrency.wake_in() is not None:
+                waits.append(endpoint.concurrency.wake_in())
+        return min(waits) if waits else None
+
+    async def wait_for_slot(self):
+        """Wait until some healthy endpoint can take another request"""
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        while not self.has_room():
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), self._wake_in())
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> Lease:
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.has_room()]
+        # wait_for_slot found room; should every endpoint be unhealthy by now, use the least bad
+        endpoint = max(candidates or self.endpoints, key=Endpoint.preference)
+        endpoint.usage["requests"] += 1
+        return Lease(endpoint, endpoint.concurrency.start())
+
+    def release(self, lease: Lease, status: str = "ok", retry_after: Optional[float] = None):
+        lease.endpoint.concurrency.release(lease.granted, status, retry_after)
+        lease.endpoint.finished(status)
+        self._notify()
+
+    def record_usage(self, lease: Lease, response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        lease.endpoint.usage["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        lease.endpoint.usage["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+    def usage(self) -> List[dict]:
+        """Per-endpoint usage and state"""
+        return [endpoint.summary() for endpoint in self.endpoints]
+
+    def format_usage(self) -> str:
+        lines = [f"{'endpoint':<32}{'state':<9}{'ok':>7}{'429':>6}{'errors':>7}{'tokens':>10}{'limit':>7}{'remaining':>10}"]
+        for row in self.usage():
+            remaining = "-" if row["window_remaining"] is None else str(row["window_remaining"])
+            lines.append(f"{row['endpoint'][:31]:<32}{'up' if row['healthy'] else 'ejected':<9}{row['ok']:>7}"
+                         f"{row['throttled']:>6}{row['error']:>7}{row['prompt_tokens'] + row['completion_tokens']:>10}"
+                         f"{row['limit']:>7}{remaining:>10}")
+        return "\n".join(lines)
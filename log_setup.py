@@ -0,0 +1,132 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from collections import defaultdict
+from typing import Dict, Optional
+
+# Attributes every LogRecord has; anything else on a record came from extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _fields(record) -> Dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record: either "time level logger: message key=value ..." or a JSON object.
+    Fields passed with extra={...} (event, guild, method, ...) are kept as structured fields."""
+
+    def __init__(self, json_lines: bool = False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = _fields(record)
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if self.json_lines:
+            entry = {"time": record.created, "level": record.levelname, "logger": record.name, "message": message}
+            entry.update(fields)
+            if record.exc_text:
+                entry["exception"] = record.exc_text
+            return json.dumps(entry, default=str)
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.name}: {message}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one in every 1/rate records of each high-volume event (records logged with
+    extra={"event": name}); records without a sampled event always pass. Kept records
+    carry sampled=N, meaning each stands for N records."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.every = {event: max(1, round(1 / rate)) for event, rate in rates.items() if rate > 0}
+        self.dropped = {event for event, rate in rates.items() if rate <= 0}
+        self.seen = defaultdict(int)
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        if event in self.dropped:
+            return False
+        every = self.every.get(event)
+        if every is None or every == 1:
+            return True
+        self.seen[event] += 1
+        if self.seen[event] % every != 1:
+            return False
+        record.sampled = every
+        return True
+
+
+class _LoopSafeQueueHandler(logging.handlers.QueueHandler):
+    """Only merges the message arguments on the calling thread; traceback formatting and all
+    I/O happen on the listener thread"""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _parse_pairs(text: Optional[str]) -> Dict[str, str]:
+    """"agent=DEBUG,discord=WARNING" -> {"agent": "DEBUG", "discord": "WARNING"}"""
+    pairs = {}
+    for item in (text or "").split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+_listener = None
+
+
+def setup_logging(level: str = None, module_levels: Dict[str, str] = None, json_lines: bool = None,
+                  sample_rates: Dict[str, float] = None, log_file: str = None):
+    """Route all logging (ours and discord.py's) through a queue to a background thread.
+
+    Defaults come from the environment: LOG_LEVEL (INFO), LOG_LEVELS per logger
+    ("agent=DEBUG,discord.gateway=WARNING"), LOG_FORMAT ("text" or "json"), LOG_SAMPLE
+    per event ("attack.response=0.05"; 0 drops the event) and LOG_FILE (also write there)."""
+    global _listener
+    if _listener is not None:
+        return _listener
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    module_levels = module_levels if module_levels is not None else _parse_pairs(os.getenv("LOG_LEVELS"))
+    if json_lines is None:
+        json_lines = os.getenv("LOG_FORMAT", "text") == "json"
+    if sample_rates is None:
+        sample_rates = {event: float(rate) for event, rate in _parse_pairs(os.getenv("LOG_SAMPLE")).items()}
+    log_file = log_file or os.getenv("LOG_FILE")
+
+    formatter = StructuredFormatter(json_lines)
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = _LoopSafeQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(SamplingFilter(sample_rates))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+    for name, module_level in module_levels.items():
+        logging.getLogger(name).setLevel(module_level.upper())
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
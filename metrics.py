@@ -0,0 +1,83 @@
+import time
+from collections import defaultdict, deque
+from typing import Dict, Optional
+
+
+def _key(name: str, labels: Dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def _format_key(key: tuple) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+def percentile(samples, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Metrics:
+    """In-process counters, gauges and timing samples keyed by name and labels
+
+    Timings keep the most recent max_samples observations per key, which is plenty for
+    the percentiles shown by !metrics without growing forever."""
+
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self.started_at = time.time()
+
+    def incr(self, name: str, amount: float = 1, **labels):
+        self.counters[_key(name, labels)] += amount
+
+    def gauge(self, name: str, value: float, **labels):
+        self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        self.samples[_key(name, labels)].append(value)
+
+    def counter(self, name: str, **labels) -> float:
+        return self.counters.get(_key(name, labels), 0)
+
+    def summary(self, name: str, **labels) -> Optional[Dict]:
+        """count/mean/p50/p95/max for one timing key, or None if nothing was observed"""
+        samples = self.samples.get(_key(name, labels))
+        if not samples:
+            return None
+        samples = list(samples)
+        return {
+            "count": len(samples),
+            "mean": sum(samples) / len(samples),
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "max": max(samples),
+        }
+
+    def report(self, prefix: str = "") -> str:
+        """Human readable dump of every metric whose name starts with prefix"""
+        lines = []
+        for key in sorted(self.counters):
+            if key[0].startswith(prefix):
+                lines.append(f"{_format_key(key)} = {self.counters[key]:g}")
+        for key in sorted(self.gauges):
+            if key[0].startswith(prefix):
+                lines.append(f"{_format_key(key)} = {self.gauges[key]:g}")
+        for key in sorted(self.samples):
+            if key[0].startswith(prefix) and self.samples[key]:
+                stats = self.summary(key[0], **dict(key[1]))
+                lines.append(f"{_format_key(key)}: n={stats['count']} mean={stats['mean']:.2f} "
+                             f"p50={stats['p50']:.2f} p95={stats['p95']:.2f} max={stats['max']:.2f}")
+        return "\n".join(lines) if lines else "No metrics recorded yet."
+
+
+# Shared registry for the whole bot process
+metrics = Metrics()
@@ -0,0 +1,155 @@
+"""A local stand-in for Mistral's chat completions endpoint, with a configurable quota, for
+exercising the bot's rate limiting without an API key or cost.
+
+Usage: python mistral_standin.py [--port 8090] [--quota N] [--window SECONDS]
+                                 [--max-concurrent N] [--latency SECONDS] [--no-headers]
+                                 [--tail FRACTION] [--tail-latency SECONDS] [--small-speedup N]
+
+Allows --quota requests per fixed --window and at most --max-concurrent at once; anything
+beyond gets a 429 with Retry-After. Responses carry x-ratelimit-{limit,remaining,reset}-requests
+headers unless --no-headers is given (leaving the client to find the limit from 429s alone).
+Answers are canned (gateway_sim.CANNED, picked by the prompt) after --latency seconds; a
+--tail fraction of requests takes --tail-latency seconds instead (a slow replica, say), and
+small models answer --small-speedup times faster.
+Point the bot at it with MISTRAL_SERVER_URL=http://127.0.0.1:8090."""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+
+from aiohttp import web
+
+from gateway_sim import CANNED
+
+# Which canned answer to give, by a phrase from the agent's prompts
+PROMPT_METHODS = [
+    ('"scores"', "estimate_attack_damage_batch"),
+    ('"milestone"', "generate_story_arc"),
+    ('"narrative"', "generate_encounter"),
+    ("damage_score", "estimate_attack_damage"),
+    ("monster", "generate_monster_template"),
+    ("items", "generate_village_items"),
+    ("character_class", "generate_character"),
+]
+
+
+class MistralStandIn:
+    def __init__(self, quota: int = 60, window: float = 60.0, max_concurrent: int = 0, latency: float = 0.5,
+                 headers: bool = True, seed: int = 0, tail: float = 0.0, tail_latency: float = None,
+                 small_speedup: float = 1.0):
+        self.quota = quota
+        self.window = window
+        self.max_concurrent = max_concurrent  # 0: no concurrency cap
+        self.latency = latency
+        self.tail = tail  # share of requests that are slow
+        self.tail_latency = 10 * latency if tail_latency is None else tail_latency
+        self.small_speedup = small_speedup
+        self.headers = headers
+        self.rng = random.Random(seed)
+        self.window_start = time.monotonic()
+        self.used = 0
+        self.in_flight = 0
+        self.served = 0
+        self.throttled = 0
+        self.peak_in_flight = 0
+
+    def _window(self):
+        now = time.monotonic()
+        if now - self.window_start >= self.window:
+            self.window_start += (now - self.window_start) // self.window * self.window
+            self.used = 0
+        return self.window_start + self.window - now  # seconds until the next window
+
+    def _rate_headers(self, reset):
+        if not self.headers:
+            return {}
+        return {"x-ratelimit-limit-requests": str(self.quota),
+                "x-ratelimit-remaining-requests": str(max(0, self.quota - self.used)),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s"}
+
+    def _latency(self, model) -> float:
+        latency = self.tail_latency if self.rng.random() < self.tail else self.latency
+        if model and "small" in model:
+            latency /= self.small_speedup
+        return latency * self.rng.uniform(0.8, 1.2)
+
+    def _content(self, messages):
+        prompt = " ".join(str(message.get("content", "")) for message in messages)
+        for phrase, method in PROMPT_METHODS:
+            if phrase in prompt:
+                if method == "estimate_attack_damage_batch":
+                    count = len(re.findall(r'^\d+\. "', prompt, re.MULTILINE)) or 1
+                    return json.dumps({"scores": [self.rng.randint(3, 10) for _ in range(count)]})
+                return CANNED[method](self.rng)
+        return "The adventure continues in a simulated land."
+
+    async def chat_completions(self, request):
+        reset = self._window()
+        over_quota = self.used >= self.quota
+        if over_quota or (self.max_concurrent and self.in_flight >= self.max_concurrent):
+            self.throttled += 1
+            retry = reset if over_quota else self.latency
+            return web.json_response({"object": "error", "message": "Requests rate limit exceeded",
+                                      "type": "rate_limited", "code": "1300"}, status=429,
+                                     headers={"Retry-After": f"{retry:.3f}", **self._rate_headers(reset)})
+        self.used += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            body = await request.json()
+            await asyncio.sleep(self._latency(body.get("model")))
+        finally:
+            self.in_flight -= 1
+        self.served += 1
+        content = self._content(body.get("messages", []))
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in body.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        return web.json_response({
+            "id": uuid.uuid4().hex, "object": "chat.completion", "model": body.get("model"), "created": int(time.time()),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }, headers=self._rate_headers(self._window()))
+
+    async def models(self, request):
+        """Outside the quota, like the real model listing"""
+        return web.json_response({"object": "list", "data": [{"id": "mistral-large-latest", "object": "model"},
+                                                             {"id": "mistral-small-latest", "object": "model"}]})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/v1/models", self.models)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+        """Serve in the running loop; port 0 picks a free port (see the runner's addresses)"""
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--quota", type=int, default=60, help="requests allowed per window")
+    parser.add_argument("--window", type=float, default=60.0, help="quota window in seconds")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="requests allowed at once (0: unlimited)")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per completion")
+    parser.add_argument("--no-headers", action="store_true", help="don't send rate-limit headers")
+    parser.add_argument("--tail", type=float, default=0.0, help="share of requests that are slow")
+    parser.add_argument("--tail-latency", type=float, help="seconds per slow completion (default 10x --latency)")
+    parser.add_argument("--small-speedup", type=float, default=1.0, help="how much faster small models answer")
+    args = parser.parse_args()
+    standin = MistralStandIn(args.quota, args.window, args.max_concurrent, args.latency, headers=not args.no_headers,
+                             tail=args.tail, tail_latency=args.tail_latency, small_speedup=args.small_speedup)
+    web.run_app(standin.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Dict, Iterable, List
+
+from session_scope import current_scope
+from tracing import span
+
+
+class Pipeline:
+    """A small dependency graph of async steps.
+
+    Each step starts as soon as all of its dependencies have finished, so independent
+    LLM calls overlap instead of running back to back. Every step records when it
+    started and finished so the critical path of a run can be reported afterwards.
+    Started within a session_scope.SessionScope, the steps are cancelled with the session."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.steps = {}  # step name -> (func, deps)
+        self.results = {}
+        self.timings = {}  # step name -> (start, end), seconds since the run started
+        self.total_time = 0.0
+        self.tasks = {}
+        self._run_future = None
+
+    def add(self, name: str, func: Callable, deps: Iterable[str] = ()) -> "Pipeline":
+        """Register a step. func is called with the results of its dependencies as
+        keyword arguments and may return either a value or an awaitable."""
+        deps = tuple(deps)
+        for dep in deps:
+            if dep not in self.steps:
+                raise ValueError(f"Unknown dependency {dep!r} for step {name!r}")
+        if name in self.steps:
+            raise ValueError(f"Step {name!r} already registered")
+        self.steps[name] = (func, deps)
+        return self
+
+    def start(self) -> "asyncio.Future":
+        """Start every step without waiting for them; returns a future for the whole run.
+        Individual step results can be awaited early with result()."""
+        if self.tasks:
+            return self._run_future
+        run_start = time.perf_counter()
+
+        async def run_step(name):
+            func, deps = self.steps[name]
+            if deps:
+                await asyncio.gather(*(self.tasks[dep] for dep in deps))
+            step_start = time.perf_counter()
+            try:
+                with span(f"{self.name}.{name}"):
+                    result = func(**{dep: self.results[dep] for dep in deps})
+                    if inspect.isawaitable(result):
+                        result = await result
+            finally:
+                self.timings[name] = (step_start - run_start, time.perf_counter() - run_start)
+            self.results[name] = result
+            return result
+
+        # Steps are registered after their dependencies, so every task a step waits on already exists
+        for name in self.steps:
+            self.tasks[name] = asyncio.ensure_future(run_step(name))
+
+        async def run_all():
+            try:
+                await asyncio.gather(*self.tasks.values())
+            except BaseException:
+                self.cancel()
+                raise
+            finally:
+                self.total_time = time.perf_counter() - run_start
+            return self.results
+
+        self._run_future = asyncio.ensure_future(run_all())
+        scope = current_scope.get()
+        if scope is not None:
+            for task in [*self.tasks.values(), self._run_future]:
+                scope.track(task)
+        return self._run_future
+
+    async def result(self, name: str) -> Any:
+        """Wait for a single step of a started pipeline. Cancelling the caller does not cancel the step."""
+        return await asyncio.shield(self.tasks[name])
+
+    async def run(self) -> Dict[str, Any]:
+        """Run every step, returning a dict of step name -> result"""
+        return await self.start()
+
+    def done(self) -> bool:
+        return self._run_future is not None and self._run_future.done()
+
+    def cancel(self):
+        """Cancel every step that is still running"""
+        for task in self.tasks.values():
+            task.cancel()
+
+    def critical_path(self) -> List[str]:
+        """The chain of steps that determined the total run time, first step first"""
+        if not self.timings:
+            return []
+        current = max(self.timings, key=lambda step: self.timings[step][1])
+        path = [current]
+        while True:
+            deps = [dep for dep in self.steps[current][1] if dep in self.timings]
+            if not deps:
+                break
+            current = max(deps, key=lambda step: self.timings[step][1])
+            path.append(current)
+        return list(reversed(path))
+
+    def timing_report(self) -> str:
+        """Per-step timings, with the critical path marked by *"""
+        critical = set(self.critical_path())
+        lines = [f"[{self.name}] total {self.total_time:.2f}s, critical path: {' -> '.join(self.critical_path())}"]
+        for name, (start, end) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            marker = "*" if name in critical else " "
+            lines.append(f"  {marker} {name:<12} {start:6.2f}s -> {end:6.2f}s ({end - start:.2f}s)")
+        return "\n".join(lines)
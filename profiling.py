@@ -0,0 +1,267 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from collections import Counter
+from typing import Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# tracemalloc slows every allocation down, so memory tracing stops on its own after this long
+MEMORY_TRACE_WINDOW = float(os.getenv("MEMORY_TRACE_WINDOW", "900"))
+
+
+def _output_path(kind: str, extension: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+
+def _stack_of(frame):
+    """Labels from the outermost frame to the innermost"""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    return list(reversed(stack))
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack from a background thread
+
+    The loop itself is never instrumented, so the overhead is one stack walk per sample
+    (200 per second by default), which is low enough to run under production load."""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.stacks[";".join(_stack_of(frame))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, path: str):
+        """Collapsed stack format, as read by flamegraph.pl and speedscope"""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def summary(self, top_n: int = 15) -> str:
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+        samples = max(1, self.samples)
+        lines = [f"{self.samples} samples every {self.interval * 1000:.0f}ms", "", "Top functions by own time:"]
+        for label, count in own.most_common(top_n):
+            lines.append(f"  {count / samples:6.1%}  {label}")
+        lines += ["", "Top functions by total time:"]
+        for label, count in total.most_common(top_n):
+            lines.append(f"  {count / samples:6.1%}  {label}")
+        return "\n".join(lines)
+
+
+def _save_cprofile(profiler: cProfile.Profile, top_n: int):
+    path = _output_path("cpu", "pstats")
+    profiler.dump_stats(path)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top_n)
+    return path, out.getvalue()
+
+
+def _save_samples(profiler: SamplingProfiler, top_n: int):
+    path = _output_path("cpu", "collapsed")
+    profiler.write_collapsed(path)
+    return path, profiler.summary(top_n)
+
+
+def _write_summary(path: str, summary: str) -> str:
+    summary_path = path.rsplit(".", 1)[0] + ".txt"
+    with open(summary_path, "w") as f:
+        f.write(summary)
+    return summary_path
+
+
+async def profile_cpu(seconds: float, mode: str = "sample", top_n: int = 15) -> str:
+    """Profile the running event loop for a number of seconds.
+    mode "sample" writes collapsed stacks; "cprofile" writes a pstats file (higher overhead).
+    Returns a short summary; the full summary is written next to the profile. Files are
+    written from a worker thread, off the event loop."""
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        path, summary = await asyncio.to_thread(_save_cprofile, profiler, top_n)
+    else:
+        profiler = SamplingProfiler(threading.get_ident())
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+        path, summary = await asyncio.to_thread(_save_samples, profiler, top_n)
+
+    summary_path = await asyncio.to_thread(_write_summary, path, summary)
+    return f"Wrote {path} and {summary_path}\n\n{summary}"
+
+
+_last_snapshot = None
+_stop_timer = None
+
+
+def stop_memory_tracing() -> str:
+    """Stop tracemalloc and drop the snapshot kept for comparison"""
+    global _last_snapshot, _stop_timer
+    if _stop_timer is not None:
+        _stop_timer.cancel()
+        _stop_timer = None
+    _last_snapshot = None
+    if not tracemalloc.is_tracing():
+        return "tracemalloc is not running."
+    tracemalloc.stop()
+    return "Stopped tracemalloc."
+
+
+async def snapshot_memory(top_n: int = 15, window: float = None) -> str:
+    """Take a tracemalloc snapshot and report the biggest allocation sites, plus growth
+    since the previous snapshot. The first call starts tracing, so it only sees
+    allocations made from then on; tracing stops window seconds later (default
+    MEMORY_TRACE_WINDOW), or at stop_memory_tracing(). Snapshots are taken and compared
+    in a worker thread, off the event loop."""
+    global _stop_timer
+    if not tracemalloc.is_tracing():
+        stop_memory_tracing()
+        window = MEMORY_TRACE_WINDOW if window is None else window
+        tracemalloc.start(10)
+        _stop_timer = asyncio.get_running_loop().call_later(window, stop_memory_tracing)
+        return (f"Started tracemalloc for {window / 60:g} minutes; run !profile mem again to see "
+                f"allocations made since now, or !profile mem stop to stop it sooner.")
+    return await asyncio.to_thread(_memory_report, top_n)
+
+
+def _memory_report(top_n: int) -> str:
+    global _last_snapshot
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"Traced memory: {current / 1024 / 1024:.1f} MiB (peak {peak / 1024 / 1024:.1f} MiB)", "",
+             "Top allocation sites:"]
+    for stat in snapshot.statistics("lineno")[:top_n]:
+        lines.append(f"  {stat.size / 1024:9.1f} KiB {stat.count:7} blocks  {stat.traceback}")
+    if _last_snapshot is not None:
+        lines += ["", "Growth since last snapshot:"]
+        for stat in snapshot.compare_to(_last_snapshot, "lineno")[:top_n]:
+            lines.append(f"  {stat.size_diff / 1024:+9.1f} KiB {stat.count_diff:+7} blocks  {stat.traceback}")
+    _last_snapshot = snapshot
+
+    summary = "\n".join(lines)
+    path = _output_path("mem", "txt")
+    with open(path, "w") as f:
+        f.write(summary)
+    snapshot.dump(path[:-4] + ".snapshot")
+    return f"Wrote {path}\n\n{summary}"
+
+
+class LoopLagMonitor:
+    """Flags code that blocks the event loop
+
+    A coroutine on the loop touches a heartbeat every interval seconds. A watchdog thread
+    checks the heartbeat; when it is more than threshold seconds late, the loop is stuck
+    in synchronous code, so the watchdog logs the loop thread's current stack (once per
+    stall), which points straight at the blocking call."""
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_beat = time.monotonic()
+        self.thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stop = threading.Event()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            metrics.observe("loop.lag", max(0.0, now - expected))
+            self.last_beat = now
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.threshold / 2):
+            stalled_for = time.monotonic() - self.last_beat
+            if stalled_for < self.threshold + self.interval or reported_beat == self.last_beat:
+                continue
+            reported_beat = self.last_beat
+            frame = sys._current_frames().get(self.thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(no frame)"
+            metrics.incr("loop.stalls")
+            logger.warning("Event loop blocked for %.0fms, currently in:\n%s", stalled_for * 1000, stack)
+
+    def start(self):
+        if self._task is not None:
+            return
+        self.thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._task = asyncio.ensure_future(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+loop_monitor: Optional[LoopLagMonitor] = None
+
+
+def start_loop_monitor(threshold: float = None) -> LoopLagMonitor:
+    """Start the shared loop lag monitor (threshold from LOOP_LAG_THRESHOLD, default 100ms)"""
+    global loop_monitor
+    if loop_monitor is None:
+        if threshold is None:
+            threshold = float(os.getenv("LOOP_LAG_THRESHOLD", "0.1"))
+        loop_monitor = LoopLagMonitor(threshold=threshold)
+        loop_monitor.start()
+    return loop_monitor
@@ -0,0 +1,116 @@
+import atexit
+import contextvars
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from typing import Optional
+
+# Recorder of the session the current task is playing, if it is being recorded; agent calls
+# made on its behalf (including from prefetch tasks it starts) log their responses to it.
+current_recorder = contextvars.ContextVar("current_recorder", default=None)
+
+_ADDRESS = re.compile(r" at 0x[0-9a-fA-F]+")
+
+
+def prompt_hash(messages) -> str:
+    """Stable key for a prompt. Object reprs that leak into prompts (e.g. monsters in the
+    battle info) carry memory addresses, which differ between runs, so they are dropped."""
+    text = _ADDRESS.sub("", json.dumps(messages, sort_keys=True, default=str))
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+class SessionRecorder:
+    """Records one adventure as a JSONL trace: the seed and theme it started with, every
+    player input (or timeout) with how long the player took, every LLM response with its
+    latency, every lookup in the agent's caches, and every message the bot sent. replay.py
+    plays a trace back without Discord or the Mistral API."""
+
+    def __init__(self, path: str, flush_every: int = 50):
+        self.path = path
+        self.flush_every = flush_every
+        self.buffer = []
+        self.started = time.monotonic()
+        self.closed = False
+        atexit.register(self.close)
+
+    @classmethod
+    def from_env(cls) -> Optional["SessionRecorder"]:
+        """A recorder writing to a new file under SESSION_RECORD_DIR, or None when recording is off"""
+        directory = os.getenv("SESSION_RECORD_DIR")
+        if not directory:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        name = f"session-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.jsonl"
+        return cls(os.path.join(directory, name))
+
+    def _write(self, kind: str, **fields):
+        entry = {"type": kind, "t": round(time.monotonic() - self.started, 4), **fields}
+        self.buffer.append(json.dumps(entry, default=str))
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def record_session(self, seed, theme=None, arc_mode=None, encounters=False, components=False):
+        self._write("session", seed=seed, theme=theme, arc_mode=arc_mode, encounters=encounters,
+                    components=components)
+
+    def record_input(self, content: Optional[str], wait: float):
+        """A player message, or content None when the player timed out"""
+        if content is None:
+            self._write("input", timeout=True, wait=round(wait, 4))
+        else:
+            self._write("input", content=content, wait=round(wait, 4))
+
+    def record_output(self, content):
+        self._write("output", content=content)
+
+    def record_llm(self, method, model, messages, content, latency: float, usage=None, error=None):
+        entry = {
+            "method": method,
+            "model": model,
+            "prompt": prompt_hash(messages),
+            "content": content,
+            "latency": round(latency, 4),
+        }
+        if usage is not None:
+            entry["usage"] = {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+        if error:
+            entry["error"] = error
+        self._write("llm", **entry)
+
+    def record_cache_lookup(self, cache: str, key, value):
+        """A lookup in one of the agent's caches: the value served instead of calling the LLM,
+        or None for a miss"""
+        self._write("cache", cache=cache, key=key, value=value)
+
+    def flush(self):
+        if self.buffer:
+            with open(self.path, "a") as f:
+                f.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+
+    def close(self):
+        """Mark the end of the session and write everything out"""
+        if self.closed:
+            return
+        self.closed = True
+        self._write("end")
+        self.flush()
+        atexit.unregister(self.close)  # or the process keeps every finished recorder alive
+
+
+class RecordingContext:
+    """Wraps a discord command context so that every message sent is recorded"""
+
+    def __init__(self, ctx, recorder: SessionRecorder):
+        self._ctx = ctx
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._ctx, name)
+
+    async def send(self, content=None, *args, **kwargs):
+        self._recorder.record_output(content)
+        return await self._ctx.send(content, *args, **kwargs)
@@ -0,0 +1,198 @@
+"""A small stand-in for a Redis server, for running several bot workers against shared
+state on one machine (and testing RedisBackend) without installing Redis.
+
+Usage: python redis_standin.py [--host 127.0.0.1] [--port 6379]
+
+Implements only the commands RedisBackend uses: PING, SELECT, GET, SET (with PX), DEL,
+RPUSH, LRANGE, LTRIM, KEYS, TIME, WATCH, UNWATCH, MULTI, EXEC, DISCARD and FLUSHALL.
+Data lives in memory and is lost when the process exits."""
+import argparse
+import asyncio
+import fnmatch
+import itertools
+import time
+
+
+class RedisStandIn:
+    def __init__(self):
+        self.data = {}  # key -> bytes or list of bytes
+        self.expires = {}  # key -> monotonic deadline
+        self.versions = {}  # key -> write counter, for WATCH
+        self._version = itertools.count(1)
+
+    def _touch(self, key):
+        self.versions[key] = next(self._version)
+
+    def _expire(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            del self.expires[key]
+            self._touch(key)
+
+    def _get(self, key):
+        self._expire(key)
+        return self.data.get(key)
+
+    def _delete(self, key):
+        self.expires.pop(key, None)
+        if self.data.pop(key, None) is not None:
+            self._touch(key)
+            return 1
+        return 0
+
+    def run(self, args):
+        """Execute one command; returns a reply value or raises ValueError for an error reply"""
+        name = args[0].decode().upper()
+        keys = args[1:]
+        if name == "PING":
+            return "PONG"
+        if name == "SELECT":
+            return "OK"  # a single database is all the stand-in offers
+        if name == "FLUSHALL":
+            for key in list(self.data):
+                self._delete(key)
+            return "OK"
+        if name == "GET":
+            value = self._get(keys[0])
+            if isinstance(value, list):
+                raise ValueError("WRONGTYPE Operation against a key holding the wrong kind of value")
+            return value
+        if name == "SET":
+            key, value = keys[0], keys[1]
+            self.data[key] = value
+            self.expires.pop(key, None)
+            if len(keys) >= 4 and keys[2].upper() == b"PX":
+                self.expires[key] = time.monotonic() + int(keys[3]) / 1000
+            self._touch(key)
+            return "OK"
+        if name == "DEL":
+            return sum(self._delete(key) for key in keys)
+        if name == "RPUSH":
+            items = self._get(keys[0])
+            if items is None:
+                items = self.data[keys[0]] = []
+            items.extend(keys[1:])
+            self._touch(keys[0])
+            return len(items)
+        if name in ("LRANGE", "LTRIM"):
+            items = self._get(keys[0]) or []
+            start, stop = int(keys[1]), int(keys[2])
+            stop = len(items) + stop if stop < 0 else stop
+            selected = items[max(0, len(items) + start if start < 0 else start):stop + 1]
+            if name == "LRANGE":
+                return selected
+            if items:
+                self.data[keys[0]] = selected
+                self._touch(keys[0])
+            return "OK"
+        if name == "KEYS":
+            pattern = keys[0].decode()
+            return [key for key in list(self.data) if self._get(key) is not None and fnmatch.fnmatchcase(key.decode(), pattern)]
+        if name == "TIME":
+            now = time.time()
+            return [str(int(now)).encode(), str(int(now % 1 * 1_000_000)).encode()]
+        raise ValueError(f"ERR unknown command '{name}'")
+
+
+def _encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, Exception):
+        return f"-{reply}\r\n".encode()
+    return b"*%d\r\n" % len(reply) + b"".join(_encode(item) for item in reply)
+
+
+async def _read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.split()  # inline command, e.g. from telnet
+    args = []
+    for _ in range(int(line[1:])):
+        length = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+async def serve(host: str = "127.0.0.1", port: int = 6379):
+    store = RedisStandIn()
+
+    async def handle(reader, writer):
+        watched = {}  # key -> version when watched
+        queued = None  # commands queued since MULTI
+        try:
+            while True:
+                args = await _read_command(reader)
+                if args is None:
+                    break
+                if not args:
+                    continue
+                name = args[0].decode().upper()
+                if name == "WATCH":
+                    for key in args[1:]:
+                        store._expire(key)
+                        watched[key] = store.versions.get(key, 0)
+                    reply = "OK"
+                elif name == "UNWATCH":
+                    watched.clear()
+                    reply = "OK"
+                elif name == "MULTI":
+                    queued = []
+                    reply = "OK"
+                elif name == "DISCARD":
+                    queued = None
+                    watched.clear()
+                    reply = "OK"
+                elif name == "EXEC":
+                    if queued is None:
+                        reply = ValueError("ERR EXEC without MULTI")
+                    elif any(store.versions.get(key, 0) != version for key, version in watched.items()):
+                        reply = None  # a watched key changed: abort the transaction
+                    else:
+                        reply = []
+                        for command in queued:
+                            try:
+                                reply.append(store.run(command))
+                            except ValueError as e:
+                                reply.append(e)
+                    queued = None
+                    watched.clear()
+                elif queued is not None:
+                    queued.append(args)
+                    reply = "QUEUED"
+                else:
+                    try:
+                        reply = store.run(args)
+                    except ValueError as e:
+                        reply = e
+                writer.write(_encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Redis stand-in listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
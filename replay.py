@@ -0,0 +1,247 @@
+"""Replay sessions recorded with SESSION_RECORD_DIR set, without Discord or the Mistral API.
+
+Usage: python replay.py sessions/*.jsonl [--speed N] [--out results.json] [--baseline results.json]
+
+Every LLM call is answered from the recording after sleeping its recorded latency (divided
+by --speed), and the player's inputs are fed back with their recorded think time. The game
+is seeded with the recorded seed, so it takes the same path as the original session. Prints
+wall time, time to first battle and LLM calls per session; with --baseline, also the change
+against a previous run's --out file, so two builds can be compared on the same traffic."""
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import Counter, defaultdict, deque
+from types import SimpleNamespace
+
+from agent import MistralAgent
+from budget import TokenBudget
+from recording import prompt_hash
+from start_story import StorySystem, PHASE_TIMEOUTS
+
+
+class ReplayFinished(Exception):
+    """The game asked for more player input than the recording holds"""
+
+
+class ReplayMiss(Exception):
+    """The game made an LLM call the recording has no response for"""
+
+
+def load_session(path):
+    session = {"path": path, "seed": None, "theme": None, "arc_mode": None, "encounters": False,
+               "components": False, "inputs": [], "llm": [], "cache": [], "outputs": []}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            kind = entry["type"]
+            if kind == "session":
+                session["seed"] = entry["seed"]
+                session["theme"] = entry.get("theme")
+                session["arc_mode"] = entry.get("arc_mode")
+                session["encounters"] = entry.get("encounters", False)
+                session["components"] = entry.get("components", False)
+            elif kind == "input":
+                session["inputs"].append(entry)
+            elif kind == "llm":
+                session["llm"].append(entry)
+            elif kind == "cache":
+                session["cache"].append(entry)
+            elif kind == "output":
+                session["outputs"].append(entry["content"])
+    return session
+
+
+class RecordedCache:
+    """Stands in for one of the agent's SimilarityCaches: answers each lookup of a key as the
+    recorded session's lookup of it went, hit or miss (the call after a miss is in the
+    recording); lookups the recording doesn't have miss"""
+
+    def __init__(self, name, entries):
+        self.name = name
+        self.lookups = defaultdict(deque)
+        for entry in entries:
+            if entry["cache"] == name:
+                self.lookups[entry["key"]].append(entry["value"])
+
+    def get(self, key):
+        lookups = self.lookups.get(key)
+        return lookups.popleft() if lookups else None
+
+    def put(self, key, value):
+        pass
+
+
+class ReplayAgent(MistralAgent):
+    """MistralAgent answering from a recording. Responses are matched by prompt first and
+    otherwise by call order per method, so small prompt changes between builds still replay."""
+
+    def __init__(self, session, speed: float = 1.0):
+        super().__init__()
+        self.speed = speed
+        self.min_request_interval /= speed
+        self.scheduler.min_interval = self.min_request_interval
+        self.budget = TokenBudget()  # replays are never throttled by the live budget settings
+        # Misses and recorded errors say nothing about the endpoint: ejecting it would stall
+        # the replay for eject_time seconds of real time, whatever the speed
+        for endpoint in self.keys.endpoints:
+            endpoint.eject_after = math.inf
+        # Caches filled by other sessions of the original process would serve this one differently
+        self.attack_cache = RecordedCache(self.attack_cache.name, session["cache"])
+        self.theme_cache = RecordedCache(self.theme_cache.name, session["cache"])
+        self.entries = session["llm"]
+        self.used = [False] * len(self.entries)
+        self.by_prompt = defaultdict(deque)
+        self.by_method = defaultdict(deque)
+        for index, entry in enumerate(self.entries):
+            self.by_prompt[entry["prompt"]].append(index)
+            self.by_method[entry["method"]].append(index)
+        self.calls = Counter()
+        self.misses = Counter()
+
+    def _take(self, method, messages):
+        for queue in (self.by_prompt[prompt_hash(messages)], self.by_method[method]):
+            while queue:
+                index = queue.popleft()
+                if not self.used[index]:
+                    self.used[index] = True
+                    return self.entries[index]
+        return None
+
+    async def _send(self, model, messages, method=None, client=None, **options):
+        self.calls[method] += 1
+        entry = self._take(method, messages)
+        if entry is None:
+            self.misses[method] += 1
+            raise ReplayMiss(f"No recorded response left for {method}")
+        await asyncio.sleep(entry["latency"] / self.speed)
+        if entry.get("error"):
+            raise RuntimeError(f"Recorded {entry['error']}")
+        usage = entry.get("usage")
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=entry["content"]))],
+            usage=SimpleNamespace(**usage) if usage else None,
+        )
+
+
+async def feed_inputs(story, ctx, inputs, speed: float):
+    """Answer the game's prompts with the recorded inputs after their recorded think time, as
+    SessionManager does with a live player's messages; the game runs until it finishes or
+    asks for more input than was recorded"""
+    inputs = deque(inputs)
+    while story.phase in PHASE_TIMEOUTS:
+        if not inputs:
+            raise ReplayFinished("Recorded inputs exhausted")
+        entry = inputs.popleft()
+        await asyncio.sleep(min(entry.get("wait", 0.0), PHASE_TIMEOUTS[story.phase]) / speed)
+        if entry.get("timeout"):
+            await story.on_timeout()
+            continue
+        message = SimpleNamespace(content=entry["content"], author=ctx.author, channel=ctx.channel, created_at=None)
+        if story.accepts(message):
+            await story.handle(message)
+
+
+class ReplayContext:
+    """Stands in for the discord command context of the recorded session"""
+
+    def __init__(self, session):
+        self.author = SimpleNamespace(id=0, name="replay", bot=False)
+        self.channel = SimpleNamespace(id=0)
+        self.guild = SimpleNamespace(id="replay")
+        self.sent = []
+
+    async def send(self, content=None, *args, **kwargs):
+        self.sent.append(content)
+
+
+async def replay_session(path, speed: float = 1.0) -> dict:
+    session = load_session(path)
+    agent = ReplayAgent(session, speed)
+    story = StorySystem(agent, seed=session["seed"])
+    if session["arc_mode"]:
+        story.arc_mode = session["arc_mode"]
+    story.encounters = session["encounters"]
+    story.components = session["components"]  # prompts with buttons are sent as one message
+    ctx = ReplayContext(session)
+
+    start = time.perf_counter()
+    outcome = "finished"
+    try:
+        await story.start_adventure(ctx, [], theme=session["theme"])
+        await feed_inputs(story, ctx, session["inputs"], speed)
+    except ReplayFinished:
+        outcome = "inputs exhausted"
+    finally:
+        await story.close()
+        await agent.close()
+    wall = time.perf_counter() - start
+
+    diverged = next((i for i, (a, b) in enumerate(zip(ctx.sent, session["outputs"])) if str(a) != str(b)), None)
+    if diverged is None and len(ctx.sent) != len(session["outputs"]):
+        diverged = min(len(ctx.sent), len(session["outputs"]))
+    return {
+        "path": path,
+        "outcome": outcome,
+        "wall_s": round(wall, 3),
+        "time_to_first_battle_s": None if story.time_to_first_battle is None else round(story.time_to_first_battle, 3),
+        "llm_calls": dict(agent.calls),
+        "llm_misses": dict(agent.misses),
+        "messages": len(ctx.sent),
+        "recorded_messages": len(session["outputs"]),
+        "diverged_at": diverged,
+    }
+
+
+def _delta(current, baseline):
+    if current is None or not baseline:
+        return ""
+    return f" ({(current - baseline) / baseline:+.1%})"
+
+
+def print_results(results, baseline=None):
+    baseline = {entry["path"]: entry for entry in baseline or []}
+    for result in results:
+        previous = baseline.get(result["path"], {})
+        print(result["path"])
+        print(f"  outcome: {result['outcome']}, {result['messages']}/{result['recorded_messages']} messages"
+              + (f", diverged at message {result['diverged_at']}" if result["diverged_at"] is not None else ""))
+        print(f"  wall time: {result['wall_s']:.3f}s{_delta(result['wall_s'], previous.get('wall_s'))}")
+        if result["time_to_first_battle_s"] is not None:
+            print(f"  time to first battle: {result['time_to_first_battle_s']:.3f}s"
+                  f"{_delta(result['time_to_first_battle_s'], previous.get('time_to_first_battle_s'))}")
+        calls = ", ".join(f"{method}={count}" for method, count in sorted(result["llm_calls"].items()))
+        print(f"  llm calls: {sum(result['llm_calls'].values())} ({calls})"
+              f"{_delta(sum(result['llm_calls'].values()), sum(previous.get('llm_calls', {}).values()))}")
+        if result["llm_misses"]:
+            print(f"  llm calls with no recorded response: {result['llm_misses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sessions", nargs="+", help="session files written with SESSION_RECORD_DIR set")
+    parser.add_argument("--speed", type=float, default=1.0, help="divide recorded latencies and think times by this")
+    parser.add_argument("--out", help="write the results as JSON, for use as a later --baseline")
+    parser.add_argument("--baseline", help="results JSON from a previous run to compare against")
+    args = parser.parse_args()
+
+    async def run_all():
+        return [await replay_session(path, args.speed) for path in args.sessions]
+
+    results = asyncio.run(run_all())
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from typing import Dict, Optional
+
+from metrics import metrics
+
+# Priority classes, most urgent first. A request is only dispatched when no request of a
+# more urgent class is waiting.
+INTERACTIVE = 0  # the player is waiting on it mid-combat (attack scoring, chat replies)
+STORY = 1  # story beats, character creation, conclusions
+BACKGROUND = 2  # prefetch: theme headers, bestiary top-ups, shop refreshes
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", STORY: "story", BACKGROUND: "background"}
+
+# Guild the current task is working for; set once per session so that every agent call
+# made on its behalf (including from prefetch tasks it starts) is queued under that guild.
+current_guild = contextvars.ContextVar("current_guild", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Raised when a request's deadline passes before it could be dispatched"""
+
+
+class _Ticket:
+    __slots__ = ("priority", "guild", "deadline", "enqueued_at", "finish_tag", "future")
+
+    def __init__(self, priority, guild, deadline, finish_tag, future):
+        self.priority = priority
+        self.guild = guild
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.finish_tag = finish_tag
+        self.future = future
+
+
+class LLMScheduler:
+    """Orders LLM requests by priority class and shares capacity fairly between guilds
+
+    Requests are granted one at a time, at least min_interval seconds apart. Within a
+    priority class, guilds are served by weighted fair queuing: every request gets a
+    virtual finish tag of max(class virtual time, guild's last tag) + 1 / weight and the
+    smallest tag goes next, so a busy guild cannot starve a quiet one. Requests carry a
+    deadline (monotonic time); expired requests are dropped with DeadlineExceeded.
+    With a rate_limiter (e.g. a state.DistributedTokenBucket shared by several workers),
+    every grant also takes a token from it. With a concurrency limiter (a
+    concurrency.AdaptiveConcurrency, or a key_pool.KeyPool of them), several requests may be
+    in flight at once, up to the limit it has learned; callers then report each granted
+    request back through release."""
+
+    def __init__(self, min_interval: float = 1.5, guild_weights: Optional[Dict] = None, rate_limiter=None,
+                 concurrency=None):
+        self.min_interval = min_interval
+        self.guild_weights = guild_weights or {}
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+        self.queues = {priority: [] for priority in PRIORITY_NAMES}
+        self.virtual_time = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.last_finish = {priority: {} for priority in PRIORITY_NAMES}
+        self.next_slot = 0.0
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+
+    def queue_length(self, priority: Optional[int] = None) -> int:
+        priorities = PRIORITY_NAMES if priority is None else [priority]
+        return sum(
+            1 for p in priorities for _, _, ticket in self.queues[p] if not ticket.future.done()
+        )
+
+    async def acquire(self, priority: int = STORY, guild=None, deadline: Optional[float] = None):
+        """Wait until this request may be sent. guild defaults to current_guild.
+        Returns the grant (the concurrency limiter's lease, or else the grant time), which
+        release expects once the request has finished."""
+        if guild is None:
+            guild = current_guild.get()
+        labels = {"priority": PRIORITY_NAMES[priority], "guild": guild}
+        if deadline is not None and deadline <= time.monotonic():
+            metrics.incr("llm.dropped", **labels)
+            raise DeadlineExceeded("Request deadline passed before it was queued")
+
+        weight = self.guild_weights.get(guild, 1.0)
+        finish_tag = max(self.virtual_time[priority], self.last_finish[priority].get(guild, 0.0)) + 1.0 / weight
+        self.last_finish[priority][guild] = finish_tag
+        ticket = _Ticket(priority, guild, deadline, finish_tag, asyncio.get_running_loop().create_future())
+        heapq.heappush(self.queues[priority], (finish_tag, next(self._sequence), ticket))
+        metrics.gauge("llm.queue_length", self.queue_length(priority), priority=labels["priority"])
+        self._ensure_dispatcher()
+        self._wakeup.set()
+
+        timeout = None if deadline is None else deadline - time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout)
+        except asyncio.TimeoutError:
+            if not ticket.future.cancel():
+                # Granted just as the deadline passed
+                self.release(ticket.future.result(), "cancelled")
+            metrics.incr("llm.dropped", **labels)
+            raise DeadlineExceeded(f"Request waited {time.monotonic() - ticket.enqueued_at:.2f}s and expired") from None
+        except asyncio.CancelledError:
+            # The caller went away; leave the slot for the next request
+            if not ticket.future.cancel():
+                self.release(ticket.future.result(), "cancelled")
+            raise
+        metrics.observe("llm.queue_wait", time.monotonic() - ticket.enqueued_at, **labels)
+        return ticket.future.result()
+
+    def release(self, granted, status: str = "ok", retry_after: Optional[float] = None):
+        """Report how a granted request ended: "ok", "throttled" (a 429), "rejected", "error" or
+        "cancelled" (abandoned before it finished, e.g. the slower copy of a hedged request)."""
+        if self.concurrency is not None:
+            self.concurrency.release(granted, status, retry_after)
+
+    async def close(self):
+        """Stop dispatching; requests still queued are cancelled"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for queue in self.queues.values():
+            for _, _, ticket in queue:
+                ticket.future.cancel()
+            queue.clear()
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    def _pop_next(self) -> Optional[_Ticket]:
+        """Most urgent live ticket, discarding cancelled and expired ones on the way"""
+        now = time.monotonic()
+        for priority in sorted(self.queues):
+            queue = self.queues[priority]
+            while queue:
+                finish_tag, _, ticket = heapq.heappop(queue)
+                if ticket.future.done():
+                    continue
+                if ticket.deadline is not None and ticket.deadline <= now:
+                    ticket.future.cancel()
+                    continue
+                self.virtual_time[priority] = finish_tag
+                # Guilds the class has caught up with start from its virtual time anyway
+                finishes = self.last_finish[priority]
+                for guild in [guild for guild, tag in finishes.items() if tag <= finish_tag]:
+                    del finishes[guild]
+                return ticket
+        return None
+
+    async def _dispatch(self):
+        holding_token = False  # taken from the rate limiter, but every waiting request had gone
+        while True:
+            if not self.queue_length():
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Wait for the next free slot before choosing, so that an urgent request that
+            # arrives in the meantime still goes first
+            delay = self.next_slot - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.concurrency is not None:
+                await self.concurrency.wait_for_slot()
+            if self.rate_limiter is not None and not holding_token:
+                await self.rate_limiter.acquire()
+                holding_token = True
+
+            ticket = self._pop_next()
+            if ticket is None:
+                # Keep the token for the next request rather than spending it on nothing
+                continue
+            holding_token = False
+            self.next_slot = time.monotonic() + self.min_interval
+            ticket.future.set_result(self.concurrency.start() if self.concurrency is not None else time.monotonic())
+            metrics.gauge("llm.queue_length", self.queue_length(ticket.priority), priority=PRIORITY_NAMES[ticket.priority])
@@ -0,0 +1,366 @@
+"""Declared shapes of the agent's structured responses, and the one parser for all of them.
+
+Each schema serves twice: as the JSON schema sent with the request (so the API constrains its
+output), and as the validator for what comes back. Validation repairs rather than rejects:
+a missing or invalid field gets its default (out-of-range numbers are clamped, enum values
+matched case-insensitively) and the rest of the response is kept."""
+import json
+import logging
+import math
+import os
+import random
+import re
+import time
+from typing import Dict, List, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+def _default(default, rng):
+    return default(rng) if callable(default) else default
+
+
+class Field:
+    """A value in a response. default (a value, or a callable taking an rng) replaces an
+    invalid value; without one, invalid list items are dropped"""
+
+    empty = None
+
+    def __init__(self, default=None, description: str = None):
+        self.default = default
+        self.description = description
+
+    def fallback(self, rng):
+        return self.empty if self.default is None else _default(self.default, rng)
+
+    def check(self, value):
+        """The value as valid for this field, or MISSING"""
+        raise NotImplementedError
+
+    def repair(self, value, rng, path: str, repaired: List[str]):
+        checked = MISSING if value is MISSING else self.check(value)
+        if checked is MISSING:
+            repaired.append(path or "$")
+            return self.fallback(rng)
+        if checked != value:
+            repaired.append(path or "$")
+        return checked
+
+    def json_schema(self) -> Dict:
+        raise NotImplementedError
+
+    def _described(self, schema):
+        if self.description:
+            schema["description"] = self.description
+        return schema
+
+
+class Integer(Field):
+    empty = 0
+
+    def __init__(self, minimum: int = None, maximum: int = None, default=None, description: str = None):
+        super().__init__(default, description)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def fallback(self, rng):
+        if self.default is None and self.minimum is not None:
+            return self.minimum
+        return super().fallback(rng)
+
+    def check(self, value):
+        if isinstance(value, bool):
+            return MISSING
+        if isinstance(value, str):
+            try:
+                value = float(value.strip())
+            except ValueError:
+                return MISSING
+        if not isinstance(value, (int, float)) or isinstance(value, float) and not math.isfinite(value):
+            return MISSING  # NaN and infinity (e.g. 1e999) can't be rounded
+        value = int(round(value))
+        if self.minimum is not None:
+            value = max(self.minimum, value)
+        if self.maximum is not None:
+            value = min(self.maximum, value)
+        return value
+
+    def json_schema(self):
+        schema = {"type": "integer"}
+        if self.minimum is not None:
+            schema["minimum"] = self.minimum
+        if self.maximum is not None:
+            schema["maximum"] = self.maximum
+        return self._described(schema)
+
+
+class String(Field):
+    empty = ""
+
+    def check(self, value):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        if not isinstance(value, str) or not value.strip():
+            return MISSING
+        return value.strip()
+
+    def json_schema(self):
+        return self._described({"type": "string"})
+
+
+class Choice(Field):
+    """One of a fixed set of strings, matched case-insensitively"""
+
+    def __init__(self, options: List[str], default=None, description: str = None):
+        super().__init__(default, description)
+        self.options = options
+        self._lookup = {option.lower(): option for option in options}
+
+    def check(self, value):
+        if not isinstance(value, str):
+            return MISSING
+        return self._lookup.get(value.strip().lower(), MISSING)
+
+    def json_schema(self):
+        return self._described({"type": "string", "enum": list(self.options)})
+
+
+class Array(Field):
+    def __init__(self, items: Field, min_items: int = 0, max_items: int = None, default=None,
+                 description: str = None):
+        super().__init__(default, description)
+        self.items = items
+        self.min_items = min_items
+        self.max_items = max_items
+
+    def fallback(self, rng):
+        return [] if self.default is None else _default(self.default, rng)
+
+    def repair(self, value, rng, path, repaired):
+        if not isinstance(value, list):
+            repaired.append(path or "$")
+            return self.fallback(rng)
+        result = []
+        for index, item in enumerate(value):
+            item_path = f"{path}[{index}]"
+            if self.items.default is None and self.items.check(item) is MISSING:
+                repaired.append(item_path)  # nothing to repair it with: drop it
+                continue
+            result.append(self.items.repair(item, rng, item_path, repaired))
+        if self.max_items is not None and len(result) > self.max_items:
+            repaired.append(path or "$")
+            result = result[:self.max_items]
+        if len(result) < self.min_items:
+            repaired.append(path or "$")
+            return self.fallback(rng)
+        return result
+
+    def json_schema(self):
+        schema = {"type": "array", "items": self.items.json_schema()}
+        if self.min_items:
+            schema["minItems"] = self.min_items
+        if self.max_items is not None:
+            schema["maxItems"] = self.max_items
+        return self._described(schema)
+
+
+class Object(Field):
+    """A JSON object with declared fields; undeclared keys are dropped"""
+
+    def __init__(self, name: str, fields: Dict[str, Field], description: str = None):
+        super().__init__(None, description)
+        self.name = name
+        self.fields = fields
+
+    def fallback(self, rng):
+        return {key: field.fallback(rng) for key, field in self.fields.items()}
+
+    def check(self, value):
+        return value if isinstance(value, dict) else MISSING
+
+    def repair(self, value, rng, path, repaired):
+        if not isinstance(value, dict):
+            repaired.append(path or "$")
+            return self.fallback(rng)
+        return {key: field.repair(value.get(key, MISSING), rng, f"{path}.{key}" if path else key, repaired)
+                for key, field in self.fields.items()}
+
+    def json_schema(self):
+        return self._described({"type": "object",
+                                "properties": {key: field.json_schema() for key, field in self.fields.items()},
+                                "required": list(self.fields), "additionalProperties": False})
+
+
+# Fences and stray escapes models wrap JSON in despite being asked not to
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL)
+_SCALAR = r'"{}"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?)'
+
+
+def load_json(content):
+    """The JSON value in a model response, tolerating code fences, surrounding prose and
+    `\\_` escapes; None if there is none"""
+    if not isinstance(content, str):
+        return content
+    try:
+        return json.loads(content)
+    except ValueError:
+        pass
+    fenced = _FENCE.search(content)
+    text = (fenced.group(1) if fenced else content).replace("\\_", "_")
+    start, end = text.find("{"), text.rfind("}")
+    if start >= 0 and end > start:
+        text = text[start:end + 1]
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def _salvage(content, schema: Object) -> Optional[Dict]:
+    """Top-level scalar fields that can still be read out of broken JSON"""
+    if not isinstance(content, str):
+        return None
+    found = {}
+    for key, field in schema.fields.items():
+        if isinstance(field, (Integer, String, Choice)):
+            match = re.search(_SCALAR.format(re.escape(key)), content)
+            if match:
+                try:
+                    found[key] = json.loads(match.group(1))
+                except ValueError:
+                    pass
+    return found or None
+
+
+class ParseResult:
+    __slots__ = ("data", "repaired", "parsed")
+
+    def __init__(self, data, repaired: List[str], parsed: bool):
+        self.data = data  # always valid against the schema
+        self.repaired = repaired  # paths of the fields that had to be repaired
+        self.parsed = parsed  # False if nothing usable was found in the response
+
+    @property
+    def outcome(self) -> str:
+        if not self.parsed:
+            return "failed"
+        return "repaired" if self.repaired else "ok"
+
+
+def parse(content, schema: Object, method: str, rng=random) -> ParseResult:
+    """Read a response against schema, repairing invalid fields. Outcomes are counted per
+    method in llm.parse{method,outcome} (ok, repaired or failed) and repaired fields in
+    llm.parse_repairs{method,field}."""
+    start = time.perf_counter()
+    data = load_json(content)
+    if not isinstance(data, dict):
+        data = _salvage(content, schema)
+    parsed = data is not None
+    repaired = []
+    value = schema.repair(data if parsed else MISSING, rng, "", repaired)
+    result = ParseResult(value, repaired, parsed)
+    metrics.observe("llm.parse_time", time.perf_counter() - start, method=method)
+    metrics.incr("llm.parse", method=method, outcome=result.outcome)
+    for path in repaired:
+        metrics.incr("llm.parse_repairs", method=method, field=re.sub(r"\[\d+\]", "[]", path))
+    if not parsed:
+        logger.warning("[%s] no JSON in response, using defaults", method,
+                       extra={"event": "llm.parse_failed", "raw_content": str(content)[:200]})
+    elif repaired:
+        logger.info("[%s] repaired %s", method, ", ".join(repaired[:5]), extra={"event": "llm.parse_repaired"})
+    return result
+
+
+def parse_failure_rate(method: str) -> float:
+    """Share of a method's responses with nothing usable in them"""
+    counts = {outcome: metrics.counter("llm.parse", method=method, outcome=outcome)
+              for outcome in ("ok", "repaired", "failed")}
+    total = sum(counts.values())
+    return counts["failed"] / total if total else 0.0
+
+
+def response_format(schema: Object) -> Optional[Dict]:
+    """The response_format for a request expecting schema, per STRUCTURED_OUTPUT:
+    "json_schema" (default; the API enforces the schema), "json_object" (any JSON object)
+    or "off" (prompt instructions only)"""
+    mode = os.getenv("STRUCTURED_OUTPUT", "json_schema")
+    if mode == "json_schema":
+        return {"type": "json_schema",
+                "json_schema": {"name": schema.name, "schema": schema.json_schema(), "strict": True}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+MONSTER = Object("monster", {
+    "name": String(default=lambda rng: f"Mystery Creature {rng.randint(1, 100)}"),
+    "hp": Integer(20, 150, default=lambda rng: rng.randint(20, 100)),
+    "attack": Integer(5, 20, default=lambda rng: rng.randint(5, 15)),
+    "defense": Integer(2, 12, default=lambda rng: rng.randint(2, 8)),
+})
+
+ITEM_TYPES = ["Weapon", "Armor", "Potion", "Tool", "Magical"]
+
+SHOP_ITEMS = Object("shop_items", {
+    "items": Array(Object("item", {
+        "name": String(default="Curious Trinket"),
+        "price": Integer(1, 100, default=lambda rng: rng.randint(10, 50)),
+        "description": String(default="An item of uncertain use"),
+        "type": Choice(ITEM_TYPES, default="Tool"),
+    }), min_items=1, max_items=6, default=lambda rng: [
+        {"name": "Basic Health Potion", "price": rng.randint(10, 25),
+         "description": "A simple healing potion that restores some health", "type": "Potion"},
+        {"name": "Iron Dagger", "price": rng.randint(15, 30), "description": "A basic but reliable weapon",
+         "type": "Weapon"},
+    ]),
+})
+
+ATTACK_SCORE = Object("attack_score", {
+    "damage_score": Integer(3, 10, default=lambda rng: rng.randint(3, 10)),
+})
+
+ATTACK_SCORES = Object("attack_scores", {
+    "scores": Array(Integer(3, 10, default=lambda rng: rng.randint(3, 10))),
+})
+
+STAT_NAMES = ["Strength", "Dexterity", "Constitution", "Intelligence", "Wisdom", "Charisma"]
+STARTING_ITEMS = ["Health Potion", "Mana Potion", "Iron Sword", "Leather Armor", "Magic Scroll", "Shield",
+                  "Healing Herbs", "Magic Wand"]
+
+CHARACTER = Object("character", {
+    "name": String(default="Unknown Adventurer"),
+    "character_class": String(default="Warrior"),
+    "level": Integer(1, 5, default=1),
+    "stats": Object("stats", {stat: Integer(8, 20, default=10) for stat in STAT_NAMES}),
+    "inventory": Array(Choice(STARTING_ITEMS), max_items=4),
+    "abilities": Array(String(), max_items=4),
+    "background": String(default=""),
+})
+
+ARC_BEAT = Object("beat", {
+    "setting": String(default="a lonely crossroads"),
+    "milestone": String(default="Strange creatures bar the way forward."),
+})
+
+STORY_ARC = Object("story_arc", {
+    "title": String(default="The Long Road"),
+    "antagonist": String(default="a shadowy warlord"),
+    "beats": Array(ARC_BEAT, min_items=3, max_items=8, default=lambda rng: [
+        {"setting": "the edge of the Dark Forest", "milestone": "Scouts of the warlord ambush travellers on the road."},
+        {"setting": "the Ancient Ruins", "milestone": "The warlord's servants dig for a relic buried there."},
+        {"setting": "a Volcanic Cave", "milestone": "The relic's trail leads into the warlord's forges."},
+        {"setting": "the Haunted Castle", "milestone": "The warlord waits behind the last of its guards."},
+    ]),
+    "ending": String(default="With the warlord's plans undone, the land breathes again, though rumours of new "
+                             "trouble already travel the roads..."),
+})
+
+ENCOUNTER = Object("encounter", {
+    "setting": String(default="Dark Forest"),
+    "narrative": String(default="Creatures emerge from the shadows ahead of you..."),
+    "monsters": Array(MONSTER, min_items=1, max_items=3, default=lambda rng: [MONSTER.fallback(rng)]),
+})
@@ -0,0 +1,90 @@
+import asyncio
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Scope of the session the current task works for; Pipeline registers its steps with it
+current_scope = contextvars.ContextVar("current_scope", default=None)
+# Monotonic time by which the current turn's work must be done, if any. Tasks started during a
+# turn (pipeline steps, hedged requests) inherit it; agent calls stop there.
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left until the current deadline (never negative), capped at default"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return default
+    left = max(0.0, deadline - time.monotonic())
+    return left if default is None else min(default, left)
+
+
+@contextmanager
+def turn_deadline(seconds: float):
+    """Give the work inside (and the tasks it starts) seconds to finish; nested deadlines
+    only ever shorten it"""
+    deadline = time.monotonic() + seconds
+    outer = current_deadline.get()
+    token = current_deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+class SessionScope:
+    """Everything one game session has in flight: the handler advancing it and the background
+    tasks it started (prefetch pipelines). cancel() stops them all at once, which also
+    cancels their queued and in-flight LLM requests and so frees the scheduler's slots for
+    other players."""
+
+    def __init__(self, name: str = "session"):
+        self.name = name
+        self.reason = None
+        self.tasks = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def track(self, task: asyncio.Future) -> asyncio.Future:
+        if self.cancelled:
+            task.cancel()
+            return task
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def spawn(self, coro) -> asyncio.Future:
+        """Start a task that lives no longer than the session"""
+        token = current_scope.set(self)
+        try:
+            return self.track(asyncio.ensure_future(coro))
+        finally:
+            current_scope.reset(token)
+
+    def cancel(self, reason: str = "ended") -> bool:
+        """Stop the session now; False if it was already stopped"""
+        if self.cancelled:
+            return False
+        self.reason = reason
+        cancelled = self.close()
+        metrics.incr("session.cancelled", reason=reason)
+        logger.info("[%s] %s, cancelled %d tasks", self.name, reason, cancelled,
+                    extra={"event": "session.cancelled", "reason": reason})
+        return True
+
+    def close(self) -> int:
+        """Cancel whatever is still running (a prefetch nobody will use) once the session is
+        over, except the calling task; returns how many tasks were cancelled"""
+        current = asyncio.current_task()
+        pending = [task for task in self.tasks if not task.done() and task is not current]
+        for task in pending:
+            task.cancel()
+        return len(pending)
@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import os
+import time
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+from components import SELECT, parse_custom_id
+from metrics import metrics
+from start_story import StorySystem, FINISHED
+import story_arc
+from state import get_backend
+
+logger = logging.getLogger(__name__)
+
+
+class _PagedOut:
+    """What stays in memory of an adventure saved to the state backend"""
+    __slots__ = ("expires_at", "ctx", "admission", "session_key")
+
+    def __init__(self, expires_at: float, ctx, admission, session_key):
+        self.expires_at = expires_at
+        self.ctx = ctx  # where its messages go
+        self.admission = admission
+        self.session_key = session_key  # its record in the shared state (StorySystem.register_session)
+
+
+class SessionManager:
+    """The running adventures of this worker. Each is a StorySystem state machine waiting for
+    its player: deliver() hands it their messages and one sweeper task fires its prompt
+    timeouts, idle expiry and !end issued on other workers, each turn running as a short
+    handler task. An adventure that has waited page_out_after seconds is written to the state
+    backend (game:<player>) and dropped from memory until the player answers or its prompt
+    times out. page_out_after 0 keeps every adventure in memory. With components, prompts
+    come with buttons and select menus, whose presses deliver_interaction() routes. arc_mode
+    is how new adventures are narrated (see story_arc); with encounters each battle is
+    generated together with its narrative (Battle.generate_encounter)."""
+
+    def __init__(self, get_agent: Callable, admission=None, page_out_after: float = 60.0,
+                 sweep_interval: float = 1.0, components: bool = True, arc_mode: str = story_arc.OFF,
+                 encounters: bool = True):
+        self.get_agent = get_agent
+        self.admission = admission  # admission.AdmissionControl for new adventures, or None
+        self.components = components
+        self.arc_mode = arc_mode
+        self.encounters = encounters
+        self.page_out_after = page_out_after
+        self.sweep_interval = sweep_interval
+        self.live = {}  # player id -> StorySystem
+        self.paged = {}  # player id -> _PagedOut
+        self.tasks = set()
+        self.sweeper = None
+        self.last_remote_poll = 0.0
+
+    @classmethod
+    def from_env(cls, get_agent: Callable, admission=None) -> "SessionManager":
+        """SESSION_PAGE_OUT_AFTER (60s), DISCORD_COMPONENTS (1; 0 for typed answers only),
+        STORY_ARC (off, llm or local) and ENCOUNTERS (1; 0 for separate monster and story calls)"""
+        return cls(get_agent, admission, page_out_after=float(os.getenv("SESSION_PAGE_OUT_AFTER", "60")),
+                   components=os.getenv("DISCORD_COMPONENTS", "1") == "1",
+                   arc_mode=story_arc.mode(os.getenv("STORY_ARC", story_arc.OFF)),
+                   encounters=os.getenv("ENCOUNTERS", "1") == "1")
+
+    def count(self) -> int:
+        return len(self.live) + len(self.paged)
+
+    def running(self, player) -> bool:
+        return player in self.live or player in self.paged
+
+    @staticmethod
+    def _key(player) -> str:
+        return f"game:{player}"
+
+    def _report(self):
+        metrics.gauge("sessions.live", len(self.live))
+        metrics.gauge("sessions.paged", len(self.paged))
+
+    def _background(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def _ensure_sweeper(self):
+        if self.sweeper is None or self.sweeper.done():
+            self.sweeper = self._background(self.sweep())
+
+    async def start(self, ctx, theme=None, recorder=None) -> StorySystem:
+        """Start ctx.author's adventure (ending the one they had); returns once it runs in the background"""
+        await self.end(ctx.author.id)
+        story = StorySystem(self.get_agent(), recorder=recorder)
+        story.ctx = ctx
+        story.components = self.components
+        story.arc_mode = self.arc_mode
+        story.encounters = self.encounters
+        self.live[ctx.author.id] = story
+        self._report()
+        self._ensure_sweeper()
+        self._run(story, story.start_adventure(ctx, [], theme=theme, admission=self.admission))
+        return story
+
+    async def start_village(self, ctx) -> StorySystem:
+        """Start a lone village visit (!village)"""
+        await self.end(ctx.author.id)
+        story = StorySystem(self.get_agent())
+        story.ctx = ctx
+        story.components = self.components
+        self.live[ctx.author.id] = story
+        self._report()
+        self._ensure_sweeper()
+        self._run(story, story.test_village(ctx))
+        return story
+
+    def _run(self, story: StorySystem, coro, answer: str = "start"):
+        """Advance story with coro in a task of its session scope; the story is busy until it is done"""
+        story.busy = True
+        return story.scope.spawn(self._advance(story, coro, answer))
+
+    async def _advance(self, story: StorySystem, coro, answer: str):
+        started = time.perf_counter()
+        try:
+            await coro
+            # From the player's answer (typed, a button or a timeout) to the next prompt
+            metrics.observe("adventure.turn_time", time.perf_counter() - started, answer=answer)
+        except Exception as e:
+            logger.exception("Adventure of player %s failed: %s", story.player_id, e)
+            story.busy = False
+            story.finish()
+            await story.ctx.send(f"An error occurred: {str(e)}")
+        finally:
+            story.busy = False
+        if story.phase == FINISHED:
+            await self._close(story)
+
+    async def _close(self, story: StorySystem):
+        if self.live.get(story.player_id) is story:
+            del self.live[story.player_id]
+            self._report()
+        await story.close()
+
+    async def get(self, player) -> Optional[StorySystem]:
+        """player's adventure, loaded back into memory if it was paged out"""
+        story = self.live.get(player)
+        if story is None and player in self.paged:
+            story = await self.page_in(player)
+        return story
+
+    async def deliver(self, message) -> bool:
+        """Hand a player's message to their adventure, if it waits for it; False if they have no adventure here"""
+        story = await self.get(message.author.id)
+        if story is None:
+            return False
+        if story.accepts(message) and not story.scope.cancelled:
+            self._run(story, story.handle(message), answer="typed")
+        return True
+
+    async def deliver_interaction(self, interaction) -> bool:
+        """Route a press on a prompt's button or select menu to the adventure that sent it,
+        as if the player had typed the answer; False if the component isn't the game's"""
+        data = interaction.data or {}
+        parsed = parse_custom_id(data.get("custom_id", ""))
+        if parsed is None:
+            return False
+        received = time.perf_counter()
+        player, turn, phase, answer = parsed
+        if interaction.user.id != player:
+            await interaction.response.send_message("Those choices belong to another player's adventure.",
+                                                    ephemeral=True)
+            return True
+        if answer == SELECT:
+            answer = (data.get("values") or [""])[0]
+        story = await self.get(player)
+        message = SimpleNamespace(content=answer, author=interaction.user, channel=interaction.channel,
+                                  created_at=interaction.created_at)
+        if (story is not None and story.turn_number == turn and story.phase == phase
+                and story.accepts(message) and not story.scope.cancelled):
+            self._run(story, story.handle(message), answer="component")
+        else:
+            metrics.incr("discord.stale_interactions")
+        # Acknowledge by taking the controls off the prompt, so it can't be answered twice;
+        # the next prompt is already being prepared meanwhile
+        await interaction.response.edit_message(view=None)
+        metrics.observe("discord.interaction_ack", time.perf_counter() - received)
+        return True
+
+    async def end(self, player, reason: str = "ended") -> bool:
+        """Stop player's adventure now and wrap it up; False if they have none here"""
+        story = await self.get(player)
+        if story is None or not story.end(reason):
+            return False
+        await self._conclude(story, reason)
+        return True
+
+    async def _conclude(self, story: StorySystem, reason: str):
+        try:
+            await story.conclude_early(reason)
+        finally:
+            await self._close(story)
+
+    async def page_out(self, story: StorySystem) -> bool:
+        """Save a waiting adventure to the state backend and drop it from memory"""
+        player, prompted_at = story.player_id, story.prompted_at
+        try:
+            await get_backend().set(self._key(player), story.to_record(), ttl=StorySystem.SESSION_TTL)
+        except Exception as e:
+            logger.warning("Could not page out the adventure of player %s: %s", player, e)
+            return False
+        if not story.waiting() or story.prompted_at != prompted_at or self.live.get(player) is not story:
+            # The player answered while it was being saved: it carries on in memory
+            await get_backend().delete(self._key(player))
+            return False
+        del self.live[player]
+        self.paged[player] = _PagedOut(story.expires_at, story.ctx, story.admission, story.session_key)
+        metrics.incr("sessions.paged_out")
+        self._report()
+        return True
+
+    async def page_in(self, player) -> Optional[StorySystem]:
+        """Load a paged out adventure back into memory; None if its record is gone"""
+        entry = self.paged.pop(player)
+        try:
+            data = await get_backend().get(self._key(player))
+        except Exception as e:
+            logger.warning("Could not load the adventure of player %s: %s", player, e)
+            data = None
+        if data is None:
+            # Nothing to resume: give back what it held, as a finished adventure does, so other
+            # workers don't see it running any more
+            story = StorySystem(self.get_agent())
+            story.player_id, story.session_key, story.admission = player, entry.session_key, entry.admission
+            try:
+                await story.close()
+            except Exception as e:
+                logger.warning("Could not clean up the lost adventure of player %s: %s", player, e)
+            self._report()
+            return None
+        await get_backend().delete(self._key(player))
+        story = StorySystem.from_record(data, self.get_agent(), entry.ctx)
+        story.admission = entry.admission
+        self.live[player] = story
+        metrics.incr("sessions.paged_in")
+        self._report()
+        return story
+
+    async def sweep(self):
+        """Fire due timeouts and page out adventures left waiting, every sweep_interval seconds"""
+        while self.live or self.paged:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep_once()
+            except Exception as e:
+                logger.exception("Session sweep failed: %s", e)
+
+    async def sweep_once(self):
+        now = time.time()
+        for player in [player for player, entry in self.paged.items() if entry.expires_at <= now]:
+            await self.page_in(player)
+        for player, story in list(self.live.items()):
+            if not story.waiting():
+                continue
+            if story.expires_at <= now:
+                metrics.incr("sessions.timeouts", phase=story.phase)
+                if story.idle_for(now) >= StorySystem.IDLE_TIMEOUT:
+                    if story.end("expired"):
+                        self._background(self._conclude(story, "expired"))
+                else:
+                    self._run(story, story.on_timeout(), answer="timeout")
+            elif (self.page_out_after and story.recorder is None and story.prefetched_round is None
+                  and now - story.prompted_at >= self.page_out_after):
+                await self.page_out(story)
+        if get_backend().shared and now - self.last_remote_poll >= StorySystem.REMOTE_END_POLL:
+            # !end handled by another worker can only leave a flag in the shared state
+            self.last_remote_poll = now
+            for player in [*self.live, *self.paged]:
+                if await get_backend().get(f"session:{player}:end"):
+                    self._background(self.end(player))
@@ -0,0 +1,141 @@
+import random
+import re
+import time
+import zlib
+from collections import OrderedDict, defaultdict
+from typing import Any, Optional
+
+from metrics import metrics
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# Words that change the phrasing of an attack or theme but not what it is
+_FILLER = {"a", "an", "the", "my", "i", "it", "its", "at", "to", "with", "and", "of", "on", "in", "as", "so",
+           "very", "really", "just", "then", "them", "him", "her", "this", "that"}
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip punctuation and filler words: "1 Swing my sword!!" -> "swing sword" """
+    words = re.findall(r"[a-z]+", str(text).lower())
+    return " ".join(word for word in words if word not in _FILLER)
+
+
+def shingles(text: str, n: int = 3) -> set:
+    """Character n-grams of the normalized text, padded so short words still get some"""
+    padded = f" {text} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class _Entry:
+    __slots__ = ("key", "shingles", "bands", "value", "created", "hits")
+
+    def __init__(self, key, shingle_set, bands, value):
+        self.key = key
+        self.shingles = shingle_set
+        self.bands = bands
+        self.value = value
+        self.created = time.monotonic()
+        self.hits = 0
+
+
+class SimilarityCache:
+    """Cache keyed by approximate text, for prompts players phrase slightly differently
+
+    Keys are normalized and split into character 3-grams. A MinHash signature of the
+    n-grams is banded into an LSH index, so a lookup only compares against entries that
+    share a band; candidates are then checked by exact Jaccard similarity against the
+    threshold. Entries expire after ttl seconds and the least recently used are evicted
+    beyond max_entries. Hits, misses, similarity of hits and the age of what was served
+    are recorded as cache.* metrics."""
+
+    def __init__(self, name: str, threshold: float = 0.8, ttl: float = 3600.0, max_entries: int = 5000,
+                 num_perm: int = 64, bands: int = 16):
+        assert num_perm % bands == 0
+        self.name = name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bands = bands
+        self.rows = num_perm // bands
+        # Universal hash functions (a * x + b) mod p standing in for random permutations
+        rng = random.Random(0)
+        self.permutations = [rng.randrange(1, _MERSENNE_PRIME) for _ in range(num_perm)]
+        self.offsets = [rng.randrange(0, _MERSENNE_PRIME) for _ in range(num_perm)]
+        self.entries = OrderedDict()  # normalized key -> _Entry, least recently used first
+        self.index = defaultdict(set)  # (band, band hash) -> normalized keys
+
+    def _signature(self, shingle_set):
+        hashes = [zlib.crc32(shingle.encode()) for shingle in shingle_set]
+        return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in zip(self.permutations, self.offsets)]
+
+    def _bands(self, shingle_set):
+        signature = self._signature(shingle_set)
+        return [(band, hash(tuple(signature[band * self.rows:(band + 1) * self.rows]))) for band in range(self.bands)]
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        for band in entry.bands:
+            bucket = self.index.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.index[band]
+
+    def get(self, text: str) -> Optional[Any]:
+        """Value cached for the most similar key at or above the threshold, or None"""
+        key = normalize(text)
+        now = time.monotonic()
+        best, best_similarity = None, 0.0
+        if key in self.entries:
+            best, best_similarity = self.entries[key], 1.0
+        else:
+            shingle_set = shingles(key)
+            candidates = set()
+            for band in self._bands(shingle_set):
+                candidates |= self.index.get(band, set())
+            for candidate in candidates:
+                similarity = jaccard(shingle_set, self.entries[candidate].shingles)
+                if similarity > best_similarity:
+                    best, best_similarity = self.entries[candidate], similarity
+
+        if best is not None and now - best.created > self.ttl:
+            self._remove(best.key)
+            metrics.incr("cache.expired", cache=self.name)
+            best = None
+        if best is None or best_similarity < self.threshold:
+            metrics.incr("cache.misses", cache=self.name)
+            return None
+
+        best.hits += 1
+        self.entries.move_to_end(best.key)
+        metrics.incr("cache.hits", cache=self.name, match="exact" if best_similarity == 1.0 else "fuzzy")
+        metrics.observe("cache.hit_similarity", best_similarity, cache=self.name)
+        metrics.observe("cache.hit_age", now - best.created, cache=self.name)
+        return best.value
+
+    def put(self, text: str, value: Any):
+        key = normalize(text)
+        if key in self.entries:
+            self._remove(key)
+        shingle_set = shingles(key)
+        entry = _Entry(key, shingle_set, self._bands(shingle_set), value)
+        self.entries[key] = entry
+        for band in entry.bands:
+            self.index[band].add(key)
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+        metrics.gauge("cache.entries", len(self.entries), cache=self.name)
+
+    def hit_rate(self) -> float:
+        hits = metrics.counter("cache.hits", cache=self.name, match="exact") + \
+            metrics.counter("cache.hits", cache=self.name, match="fuzzy")
+        total = hits + metrics.counter("cache.misses", cache=self.name)
+        return hits / total if total else 0.0
@@ -3,20 +3,109 @@ import random
 from battle import Battle, Monster
 from village import Village
 from user import User, make_random_user, parse_character_json
+from pipeline import Pipeline
+from metrics import metrics
+from scheduler import current_guild
+from budget import LOCAL
+from tracing import span, start_session, start_turn, record, message_lag_ms, TracedContext
+from recording import current_recorder, RecordingContext
+from state import get_backend, WORKER_ID
+from session_scope import SessionScope, turn_deadline, remaining
+from components import button_view, select_view
+import story_arc
 import asyncio
+import base64
+import discord
+import logging
 import re
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+# Phases of an adventure. In each of these it waits for the player's next message, or for the
+# phase's timeout, and nothing of the game runs in between (see StorySystem.advance).
+CHARACTER = "character"          # describing the character they want to play
+BATTLE_TARGET = "battle_target"  # picking the monster to attack
+VILLAGE_MENU = "village_menu"    # healer, shop or leave
+SHOP = "shop"                    # picking an item to buy
+FINISHED = "finished"
+
+# Seconds the player has to answer in each phase before the game moves on without them
+PHASE_TIMEOUTS = {CHARACTER: 120.0, BATTLE_TARGET: 60.0, VILLAGE_MENU: 30.0, SHOP: 30.0}
+
+
+def _save_rng(rng: random.Random):
+    """A generator's position, packed (about 3kB rather than 625 numbers as JSON)"""
+    version, internal, gauss_next = rng.getstate()
+    return [base64.b64encode(struct.pack(f"<{len(internal)}I", *internal)).decode(), gauss_next]
+
+
+def _load_rng(saved) -> random.Random:
+    packed, gauss_next = saved
+    data = base64.b64decode(packed)
+    rng = random.Random()
+    rng.setstate((3, struct.unpack(f"<{len(data) // 4}I", data), gauss_next))
+    return rng
+
 
 class StorySystem:
-    def __init__(self, agent = None):
+    """One adventure, as a state machine: each prompt leaves it in a phase (CHARACTER,
+    BATTLE_TARGET, ...) and the player's answer, or the prompt's timeout, advances it to the
+    next one through a short handler. Between two messages an adventure is only its state,
+    which to_record() saves and from_record() restores, so a waiting adventure can be paged
+    out to the state backend (sessions.SessionManager does that and routes the messages)."""
+
+    def __init__(self, agent = None, seed=None, recorder=None):
         self.agent = agent
-        self.battle_system = Battle(agent=self.agent)
+        # All game randomness comes from per-session generators derived from one seed, so a
+        # recorded session can be replayed exactly. Battle and Village get their own streams
+        # because they draw concurrently with character creation.
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        self.rng = random.Random(f"{self.seed}:story")
+        self.recorder = recorder  # Optional SessionRecorder capturing inputs and LLM responses
+        self.battle_system = Battle(agent=self.agent, rng=random.Random(f"{self.seed}:battle"))
         #self.village = Village()
-        self.village = Village(agent=self.agent)
+        self.village = Village(agent=self.agent, rng=random.Random(f"{self.seed}:village"))
         self.base_end_probability = 0.1  # Starting 10% chance to end
         self.current_end_probability = self.base_end_probability
         self.force_end = False
+        self.scope = SessionScope()  # Cancelled by !end or an idle player, with everything in flight
+        self.ctx = None  # Where the adventure's messages go
+        self.player_id = None
+        self.channel_id = None
+        self.guild = None
+        self.phase = None  # What the adventure waits for; None while a handler is running
+        self.prompted_at = None  # When the current prompt was sent (wall clock, as it is saved)
+        self.expires_at = None  # When the current prompt times out
+        self.last_input = None  # When the player last said something
+        self.busy = False  # A handler is advancing the adventure (set by SessionManager)
+        self.closed = False
+        self.village_only = False  # !village: the adventure is one village visit
+        # Offer the player's choices as buttons and select menus, each prompt a single message
+        # (set by SessionManager on Discord; replays and the terminal stay with typed answers)
+        self.components = False
+        self.user = None
+        self.combat_stats = None
+        self.battle = None  # The battle being fought
+        self.battle_turn = 0
+        self.round = 0
+        self.admission = None  # This adventure's admission.Admission, when admission control is on
+        self.story_details = []  # The adventure's theme and story so far, as given to the LLM
         self.story_info = []  # Track story information
-        
+        self.arc_mode = story_arc.OFF  # How rounds are narrated (set by SessionManager, see story_arc)
+        self.arc = None  # The adventure's outline (schemas.STORY_ARC), in the arc modes
+        # Generate each battle with its narrative in one call (Battle.generate_encounter; set by
+        # SessionManager, replays follow the recording)
+        self.encounters = False
+        self.prefetched_round = None  # Round pipeline started ahead of time by the bootstrap stage
+        self.adventure_started = None
+        self.character_reply_at = None
+        self.time_to_first_battle = None
+        self.session_id = None  # Trace correlation id for this adventure
+        self.session_key = None  # Key of this adventure's record in the shared state backend
+        self.turn_number = 0
+
         # Class-based stat modifiers
         self.class_modifiers = {
             "Warrior": {"Strength": 2, "Constitution": 2, "Dexterity": 1},
@@ -24,10 +113,15 @@ class StorySystem:
             "Rogue": {"Dexterity": 3, "Charisma": 1, "Constitution": 1},
             "Cleric": {"Wisdom": 2, "Charisma": 2, "Intelligence": 1}
         }
-    
+
+    def llm_available(self) -> bool:
+        """Whether story content should come from the agent; once the token budget is used up
+        the adventure carries on with the hard-coded storylines and fallbacks instead"""
+        return self.agent != None and self.agent.degradation_level() < LOCAL
+
     def should_end_story(self) -> bool:
         """Determine if the story should end based on current probability"""
-        should_end = random.random() < self.current_end_probability
+        should_end = self.rng.random() < self.current_end_probability
         if not should_end:
             # Double the probability for next time
             self.current_end_probability *= 2
@@ -46,7 +140,7 @@ class StorySystem:
             "defense": 5 + (user.stats["Constitution"] * 1.5) + (user.level * 2),
             "coins": 100 + (user.level * 50)
         }
-        
+
         # Apply class modifiers
         if user.character_class in self.class_modifiers:
             mods = self.class_modifiers[user.character_class]
@@ -58,262 +152,670 @@ class StorySystem:
                     base_stats["attack"] += mod * 3
                 elif stat == "Dexterity":
                     base_stats["defense"] += mod * 2
-        
+
         return base_stats
 
-    async def start_adventure(self, ctx, story_info=None) -> None:
-        """Main story flow with repeating adventures"""
-        # Get or create user
-        # Ask the user what kind of adventurer they want to be
-        await ctx.send("Welcome to the adventure! What kind of character would you like to be? Describe your ideal adventurer (class, background, etc.) Press Enter to skip:")
-        
-        def check(message):
-            # Check if the message is from the user who initiated the command
-            return message.author == ctx.author
-        
-        try:
-            # Wait for player's response with a 120-second timeout
-            player_response = await ctx.bot.wait_for('message', check=check, timeout=120.0)
-            
-            # Append the user's preference to story_info for context
-            user_preference = player_response.content
+    def start_tracing(self, ctx, theme=None):
+        """Give this adventure a trace session id and record every message it sends.
+        When a SessionRecorder is attached, the session is also recorded for replay."""
+        self.session_id = start_session()
+        self.turn_number = 0
+        ctx = TracedContext(ctx)
+        if self.recorder is not None:
+            current_recorder.set(self.recorder)
+            self.recorder.record_session(self.seed, theme, self.arc_mode, self.encounters, self.components)
+            ctx = RecordingContext(ctx, self.recorder)
+        return ctx
 
-            if len(user_preference) < 2:
-                user = make_random_user()
+    def attach(self, ctx):
+        """Remember who plays this adventure and where, and send its messages there"""
+        self.player_id = ctx.author.id
+        self.channel_id = getattr(getattr(ctx, "channel", None), "id", None)
+        self.guild = getattr(getattr(ctx, "guild", None), "id", None)
+        # Queue every agent call made for this adventure under its guild
+        current_guild.set(self.guild)
+        self.ctx = ctx
+
+    def resume_context(self):
+        """Point the running task's context (guild, trace session and turn, recorder) at this
+        adventure; every handler runs in a task of its own"""
+        current_guild.set(self.guild)
+        start_session(self.session_id)
+        if self.turn_number:
+            start_turn(self.turn_number)
+        if self.recorder is not None:
+            current_recorder.set(self.recorder)
+
+    # How long a session record outlives its last update (a crashed worker's games expire)
+    SESSION_TTL = 6 * 3600
+    # A player silent for this long has left: the session expires rather than playing on alone
+    IDLE_TIMEOUT = 300.0
+    # Time allowed for the work of one turn (the LLM calls between the player's message and the
+    # next prompt); calls still queued or running when it passes are cancelled and the turn
+    # falls back to local content
+    TURN_DEADLINE = 90.0
+    # How often SessionManager polls for an !end issued on another worker
+    REMOTE_END_POLL = 2.0
+
+    async def register_session(self, ctx):
+        """Record the running adventure in the shared state, so any worker can find it (e.g. for !end)"""
+        self.session_key = f"session:{ctx.author.id}"
+        await get_backend().set(self.session_key, {
+            "worker": WORKER_ID,
+            "guild": getattr(getattr(ctx, "guild", None), "id", None),
+            "trace_session": self.session_id,
+            "seed": self.seed,
+            "started": time.time(),
+        }, ttl=self.SESSION_TTL)
+
+    async def unregister_session(self):
+        if self.session_key is not None:
+            await get_backend().delete(self.session_key)
+            await get_backend().delete(self.session_key + ":end")
+            self.session_key = None
+
+    def end(self, reason: str = "ended") -> bool:
+        """Stop the adventure now (!end, or "expired" for an idle player), cancelling whatever
+        it has in flight; False if it is already over. conclude_early() then wraps it up."""
+        if self.phase == FINISHED:
+            return False
+        self.force_end = True
+        return self.scope.cancel(reason)
+
+    async def end_requested(self) -> bool:
+        """Whether !end was issued for this adventure, here or on another worker"""
+        if self.force_end:
+            return True
+        if self.session_key is not None and await get_backend().get(self.session_key + ":end"):
+            self.force_end = True
+        return self.force_end
+
+    def next_turn(self):
+        self.turn_number += 1
+        start_turn(self.turn_number)
+
+    def prompt(self, phase: str):
+        """The prompt for phase has been sent: wait for the player's answer"""
+        self.phase = phase
+        self.prompted_at = time.time()
+        self.expires_at = self.prompted_at + PHASE_TIMEOUTS[phase]
+
+    async def send_prompt(self, content: str, view):
+        """Send a prompt with its buttons. Presses are routed by custom_id
+        (SessionManager.deliver_interaction), so discord.py need not keep the view."""
+        await self.ctx.send(content, view=view)
+        view.stop()
+
+    def finish(self):
+        self.phase = FINISHED
+        self.expires_at = None
+
+    def waiting(self) -> bool:
+        """Whether the adventure is waiting for the player (rather than running or over)"""
+        return not self.busy and self.phase in PHASE_TIMEOUTS
+
+    def idle_for(self, now: float) -> float:
+        return now - (self.last_input or self.prompted_at or now)
+
+    def accepts(self, message) -> bool:
+        """Whether message answers the prompt the adventure is waiting on"""
+        if not self.waiting() or message.author.id != self.player_id:
+            return False
+        if self.phase == BATTLE_TARGET:
+            return message.content.strip()[:1].isdigit()
+        if self.phase in (VILLAGE_MENU, SHOP):
+            return getattr(message.channel, "id", None) == self.channel_id
+        return True
+
+    async def handle(self, message):
+        """Advance the adventure with the player's answer to the current prompt (see accepts())"""
+        self.resume_context()
+        now = time.time()
+        waited = now - self.prompted_at
+        self.last_input = now
+        if self.recorder is not None:
+            self.recorder.record_input(message.content, waited)
+        # How long the player took, and how late the gateway delivered their answer
+        lag_ms = message_lag_ms(message)
+        if lag_ms is not None:
+            record("player.wait", waited * 1000, dispatch_ms=round(lag_ms, 3))
+            record("discord.dispatch", lag_ms)
+        else:
+            record("player.wait", waited * 1000)
+        await self.advance(message.content)
+
+    async def on_timeout(self):
+        """The player left the current prompt unanswered until it timed out"""
+        self.resume_context()
+        if self.recorder is not None:
+            self.recorder.record_input(None, time.time() - self.prompted_at)
+        await self.advance(None)
+
+    async def advance(self, content):
+        """Run the current phase's handler on the player's answer (None: timed out). It ends
+        by sending the next prompt (prompt()) or finishing the adventure."""
+        phase, self.phase, self.expires_at = self.phase, None, None
+        handlers = {
+            CHARACTER: self.on_character,
+            BATTLE_TARGET: self.on_attack,
+            VILLAGE_MENU: self.on_village_choice,
+            SHOP: self.on_purchase,
+        }
+        await handlers[phase](content)
+
+    def to_record(self) -> Dict:
+        """The adventure's state as JSON-serialisable data. Only a waiting adventure with no
+        prefetch in flight can be saved (see SessionManager.page_out)."""
+        return {
+            "phase": self.phase,
+            "prompted_at": self.prompted_at,
+            "expires_at": self.expires_at,
+            "last_input": self.last_input,
+            "player": self.player_id,
+            "channel": self.channel_id,
+            "guild": self.guild,
+            "seed": self.seed,
+            "rng": {"story": _save_rng(self.rng), "battle": _save_rng(self.battle_system.rng),
+                    "village": _save_rng(self.village.rng)},
+            "session_id": self.session_id,
+            "session_key": self.session_key,
+            "turn_number": self.turn_number,
+            "round": self.round,
+            "battle_turn": self.battle_turn,
+            "end_probability": self.current_end_probability,
+            "force_end": self.force_end,
+            "village_only": self.village_only,
+            "components": self.components,
+            "user": self.user.to_dict() if self.user is not None else None,
+            "combat_stats": self.combat_stats,
+            "battle": None if self.battle is None else {
+                "setting": self.battle["setting"],
+                "storyline": self.battle["storyline"],
+                "monsters": [monster.to_dict() for monster in self.battle["monsters"]],
+            },
+            "bestiary": self.battle_system.monster_templates,
+            "shop": self.village.shop_items,
+            "story_details": self.story_details,
+            "story_info": self.story_info,
+            "arc_mode": self.arc_mode,
+            "arc": self.arc,
+            "encounters": self.encounters,
+        }
+
+    @classmethod
+    def from_record(cls, data: Dict, agent=None, ctx=None) -> "StorySystem":
+        """An adventure saved with to_record(), sending its messages to ctx"""
+        story = cls(agent, seed=data["seed"])
+        story.ctx = ctx
+        story.rng = _load_rng(data["rng"]["story"])
+        story.battle_system.rng = _load_rng(data["rng"]["battle"])
+        story.village.rng = _load_rng(data["rng"]["village"])
+        story.battle_system.monster_templates = list(data["bestiary"])
+        story.village.shop_items = dict(data["shop"])
+        story.phase = data["phase"]
+        story.prompted_at = data["prompted_at"]
+        story.expires_at = data["expires_at"]
+        story.last_input = data["last_input"]
+        story.player_id = data["player"]
+        story.channel_id = data["channel"]
+        story.guild = data["guild"]
+        story.session_id = data["session_id"]
+        story.session_key = data["session_key"]
+        story.turn_number = data["turn_number"]
+        story.round = data["round"]
+        story.battle_turn = data["battle_turn"]
+        story.current_end_probability = data["end_probability"]
+        story.force_end = data["force_end"]
+        story.village_only = data["village_only"]
+        story.components = data["components"]
+        story.user = User.from_dict(data["user"]) if data["user"] is not None else None
+        story.combat_stats = data["combat_stats"]
+        if data["battle"] is not None:
+            story.battle = dict(data["battle"], monsters=[Monster.from_dict(monster)
+                                                           for monster in data["battle"]["monsters"]])
+        story.story_details = list(data["story_details"])
+        story.story_info = list(data["story_info"])
+        story.arc_mode = data.get("arc_mode", story_arc.OFF)
+        story.arc = data.get("arc")
+        story.encounters = data.get("encounters", False)
+        story.scope.name = f"session {story.session_id}"
+        return story
+
+    async def create_character(self, ctx, story_info, user_preference) -> User:
+        """Build the player's character from their description, or a random one if they skipped"""
+        if user_preference is None or len(user_preference) < 2 or not self.llm_available():
+            return make_random_user(self.rng)
+
+        await ctx.send("Creating your character... Please wait a moment.")
+
+        # Generate character based on player's preference using Mistral API
+        character_json = await self.agent.generate_character(story_info, user_preference)
+
+        # Parse the JSON into a User object
+        return parse_character_json(character_json, self.rng)
+
+    def add_round_steps(self, pipeline: Pipeline, story_info, story_deps=(), beat: int = 0):
+        """Add the steps of one battle round (beat: its index in the story arc) to a pipeline.
+        With encounters, the battle and its narrative come from a single generated encounter.
+        Otherwise the bestiary top-up feeds the battle, which feeds the story beat; the extra
+        "variety" template only matters for later battles, so it runs alongside. A beat
+        narrated from the story arc doesn't need the battle and runs alongside too."""
+        if self.encounters and self.arc_mode != story_arc.LOCAL and self.llm_available():
+            pipeline.add("battle", lambda **_: self.battle_system.generate_battle(self.story_so_far(story_info, beat)),
+                         deps=[*story_deps])
+            return
+        pipeline.add("bestiary", lambda: self.battle_system.fill_bestiary(story_info))
+        pipeline.add("variety", lambda: self.battle_system.add_new_template(story_info))
+        pipeline.add("battle", lambda bestiary: self.battle_system.compose_battle(), deps=["bestiary"])
+        if self.arc_mode != story_arc.OFF:
+            pipeline.add("story", lambda **_: self.narrate_beat(beat), deps=[*story_deps])
+        elif self.llm_available():
+            # API CALL: Send battle data (ie. setting, monsters, current user) to Mistral, and generate a story line to print out
+            pipeline.add("story", lambda battle, **_: self.agent.generate_story(story_info, battle),
+                         deps=["battle", *story_deps])
+
+    def start_pipeline(self, pipeline: Pipeline):
+        """Start a pipeline and print its timing report once every step has finished"""
+        def report(future):
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                logger.error("[%s] failed: %s", pipeline.name, future.exception())
+                return
+            logger.info("%s", pipeline.timing_report())
+        pipeline.start().add_done_callback(report)
+        return pipeline
+
+    async def start_adventure(self, ctx, story_info=None, theme=None, admission=None) -> None:
+        """Start the adventure and return once it waits for the player's character. From then on
+        handle() takes each answer and on_timeout() each unanswered prompt; !end or a player
+        gone idle stops it with end() and conclude_early(). With an admission.AdmissionControl,
+        the adventure first waits for its turn to start."""
+        self.adventure_started = time.monotonic()
+        self.attach(ctx)
+        self.ctx = self.start_tracing(ctx, theme)
+        await self.register_session(ctx)
+        self.scope.name = f"session {self.session_id}"
+        if admission is not None:
+            await self.wait_for_admission(ctx, admission)
+        if story_info is None:
+            story_info = []
+        self.story_details = story_info
+
+        # Bootstrap pipeline, started the moment !start arrives: the theme header, the initial
+        # bestiary and the opening story beat are generated while the player is still typing
+        # their character description. Character creation needs the header and the reply.
+        pipeline = Pipeline("bootstrap")
+        if theme:
+            story_info.append(theme)
+        if theme and self.llm_available():
+            pipeline.add("header", lambda: self.agent.generate_theme_header(story_info))
+        else:
+            pipeline.add("header", lambda: None)
+        if self.arc_mode != story_arc.OFF:
+            # The outline is planned once, here; the first beat is narrated from it
+            pipeline.add("arc", lambda header: self.plan_arc(story_info), deps=["header"])
+            self.add_round_steps(pipeline, story_info, story_deps=["arc"])
+        else:
+            self.add_round_steps(pipeline, story_info, story_deps=["header"])
+        self.prefetched_round = self.start_pipeline(pipeline)
+        if self.admission is not None:
+            # Bootstrap burst over once its calls are done (not when the player has described
+            # their character): let the next queued adventure start
+            pipeline.start().add_done_callback(lambda _: self.admission.bootstrapped())
+
+        await self.ctx.send("Welcome to the adventure! What kind of character would you like to be? Describe your ideal adventurer (class, background, etc.) Press Enter to skip:")
+        self.last_input = time.time()
+        self.prompt(CHARACTER)
+
+    async def plan_arc(self, story_info):
+        """Get the adventure's outline (the schema's fallback one without the LLM); its gist
+        joins the story details, which the monster prompts still get"""
+        arc = await self.agent.generate_story_arc(story_info) if self.llm_available() else None
+        self.arc = arc or story_arc.default_arc(self.rng)
+        story_info.append(story_arc.gist(self.arc))
+        return self.arc
+
+    def story_so_far(self, story_info, beat: int):
+        """What the round's prompts get of the story: all of it, or with STORY_ARC=llm just its part of the arc"""
+        if self.arc_mode == story_arc.LLM:
+            return story_arc.context(self.arc, beat)
+        return story_info
+
+    async def narrate_beat(self, index: int) -> str:
+        """Round index + 1's part of the story arc, expanded by the LLM (STORY_ARC=llm) or from a template"""
+        if self.arc_mode == story_arc.LLM and self.llm_available():
+            previous = story_arc.beat(self.arc, index - 1)["milestone"] if index else None
+            narration = await self.agent.expand_story_beat(story_arc.gist(self.arc), previous,
+                                                           story_arc.beat(self.arc, index))
+            if narration:
+                return narration
+        return story_arc.narrate(self.arc, index)
+
+    async def wait_for_admission(self, ctx, admission):
+        # Queue notices bypass the recording: a replay never waits in the queue
+        notices = TracedContext(ctx)
+
+        async def tell_position(position):
+            await notices.send(f"Many adventures are under way right now. You are #{position} in line; "
+                               f"yours will start as soon as there is room.")
+
+        resuming = await admission.is_resuming(ctx.author.id)
+        with span("admission.wait", resuming=resuming):
+            self.admission = await admission.admit(ctx.author.id, resuming, notify=tell_position)
+        self.adventure_started = time.monotonic()  # time to first battle counts from admission
+
+    async def conclude_early(self, reason: str):
+        """Wrap up an adventure stopped by end(), without calling the LLM again"""
+        self.resume_context()
+        self.finish()
+        if reason == "expired":
+            await self.ctx.send("No reply for a while, so your adventure ends here.")
+        else:
+            await self.ctx.send("Your adventure concludes for now, but new challenges await on the horizon...")
+        if self.user is not None:
+            await self.ctx.send(f"Final Level: {self.user.level}")
+            await self.ctx.send(f"Final Coins: {self.combat_stats['coins']}")
+
+    async def close(self):
+        """Give back what the finished adventure holds: its admission slot, its session record,
+        any prefetch still running and its recording"""
+        if self.closed:
+            return
+        self.closed = True
+        self.scope.close()
+        if self.admission is not None:
+            self.admission.release()
+            await self.admission.control.finished(self.player_id)
+        await self.unregister_session()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    async def on_character(self, reply):
+        """The player described their character (reply None: they took too long)"""
+        self.character_reply_at = time.monotonic()
+        if reply is None:
+            await self.ctx.send("You took too long to respond! Creating a random character for you.")
+        await self.prefetched_round.result("header")
+        user = await self.create_character(self.ctx, self.story_details, reply)
+        combat_stats = self.calculate_combat_stats(user)
 
-            else:
-            # story_info.append(f"Player wants to be: {user_preference}")
-            
-                await ctx.send("Creating your character... Please wait a moment.")
-                
-                # Generate character based on player's preference using Mistral API
-                character_json = await self.agent.generate_character(story_info, user_preference)
-                
-                # Parse the JSON into a User object
-                user = parse_character_json(character_json)
-                
-                # Calculate combat stats based on the created character
-                combat_stats = self.calculate_combat_stats(user)
-            
-        except asyncio.TimeoutError:
-            await ctx.send("You took too long to respond! Creating a random character for you.")
-            user = make_random_user()
-            combat_stats = self.calculate_combat_stats(user)
-        
         # Initial message with character info
         if hasattr(user, 'background'):
-            await ctx.send(f"Welcome {user.name}, Level {user.level} {user.character_class}!")
-            await ctx.send(f"Background: {user.background}")
+            await self.ctx.send(f"Welcome {user.name}, Level {user.level} {user.character_class}!")
+            await self.ctx.send(f"Background: {user.background}")
         else:
-            await ctx.send(f"Welcome {user.name}, Level {user.level} {user.character_class}!")
-        
-        await ctx.send(user.show_stats())
-        await ctx.send(f"Combat Stats: HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}, "
+            await self.ctx.send(f"Welcome {user.name}, Level {user.level} {user.character_class}!")
+
+        await self.ctx.send(user.show_stats())
+        await self.ctx.send(f"Combat Stats: HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}, "
                     f"Attack: {combat_stats['attack']}, Defense: {combat_stats['defense']}, "
                     f"Coins: {combat_stats['coins']}")
         combat_stats = self.calculate_combat_stats(user)
+        self.user, self.combat_stats = user, combat_stats
 
         # Generate story details if needed
-        if story_info == [] or story_info is None:
-            story_info = [user.name + " the " + user.character_class + " is on a crazy adventure!"] 
-        
+        # (in place, the bootstrap pipeline already holds a reference to this list)
+        if self.story_details == []:
+            self.story_details.append(user.name + " the " + user.character_class + " is on a crazy adventure!")
+
         # Initial message
-        await ctx.send(f"Welcome {user.name}, Level {user.level} {user.character_class}!")
+        await self.ctx.send(f"Welcome {user.name}, Level {user.level} {user.character_class}!")
         # await ctx.send(user.show_stats())
-        
+
         # Reset probability at start of new adventure
         self.reset_end_probability()
-        round = 0
-        
-        while True:  # Infinite loop for continuing adventures
-            # await ctx.send(f"\nCurrent Stats: HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}, "
-            #              f"Attack: {combat_stats['attack']}, Defense: {combat_stats['defense']}, "
-            #              f"Coins: {combat_stats['coins']}")
-            round += 1
-            if self.force_end or (self.should_end_story() and round > 3):
-                end_message = await self.agent.generate_end_message(story_info)
-                await ctx.send(end_message)
-                #await ctx.send(f"\n{user.name}'s adventure is cut short by fate...")
-                await ctx.send(f"Final Level: {user.level}")
-                await ctx.send(f"Final Coins: {combat_stats['coins']}")
-                break
-
-            # # Check if story should end
-            # if self.should_end_story() or self.force_end:
-            #     end_message = self.agent.generate_end_message()
-            #     await ctx.send(end_message)
-            #     #await ctx.send(f"\nAfter many adventures, {user.name} decides to retire...")
-            #     await ctx.send(f"Final Level: {user.level}")
-            #     await ctx.send(f"Final Coins: {combat_stats['coins']}")
-            #     break
-            
-            # Generate and start battle
-            survived = await self.run_battle(ctx, user, combat_stats, story_info)
-            
-            if not survived:
-                await ctx.send(f"{user.name}'s journey comes to an end...")
-                break
-            
-            # After battle, 30% chance to visit village if survived
-            await self.visit_village(ctx, user, combat_stats)
-            
-            # Check for level up conditions
-            if random.random() < 0.3:  # 30% chance to level up
-                level_message = user.level_up()
-                # await ctx.send(level_message)
-                
-                # Recalculate combat stats after leveling up
-                new_stats = self.calculate_combat_stats(user)
-                # await ctx.send(level_message)
-                combat_stats['max_hp'] = new_stats['max_hp']
-                # await ctx.send(level_message)
-                combat_stats['attack'] = new_stats['attack']
-                combat_stats['defense'] = new_stats['defense']
-                # await ctx.send(level_message)
-                # Save updated user data
-                # users = load_users()
-                await ctx.send(level_message)
-                #users[str(user.user_id)]["level"] = user.level
-                # save_users(users)
-            
-            await ctx.send("\nYour adventure continues...")
+        self.round = 0
+        await self.next_round()
+
+    async def next_round(self):
+        """Start the next battle, or end the adventure"""
+        # await ctx.send(f"\nCurrent Stats: HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}, "
+        #              f"Attack: {combat_stats['attack']}, Defense: {combat_stats['defense']}, "
+        #              f"Coins: {combat_stats['coins']}")
+        self.round += 1
+        if await self.end_requested() or (self.should_end_story() and self.round > 3):
+            if self.arc is not None:
+                end_message = story_arc.ending(self.arc)
+            else:
+                end_message = await self.agent.generate_end_message(self.story_details)
+            await self.ctx.send(end_message)
+            #await ctx.send(f"\n{user.name}'s adventure is cut short by fate...")
+            await self.ctx.send(f"Final Level: {self.user.level}")
+            await self.ctx.send(f"Final Coins: {self.combat_stats['coins']}")
+            self.finish()
+            return
+
+        # # Check if story should end
+        # if self.should_end_story() or self.force_end:
+        #     end_message = self.agent.generate_end_message()
+        #     await ctx.send(end_message)
+        #     #await ctx.send(f"\nAfter many adventures, {user.name} decides to retire...")
+        #     await ctx.send(f"Final Level: {user.level}")
+        #     await ctx.send(f"Final Coins: {combat_stats['coins']}")
+        #     break
+
+        # Generate and start battle
+        await self.start_battle()
+
+    async def end_of_round(self):
+        """After a won battle and the village: maybe level up, then carry on"""
+        # Check for level up conditions
+        if self.rng.random() < 0.3:  # 30% chance to level up
+            level_message = self.user.level_up()
+            # await ctx.send(level_message)
+
+            # Recalculate combat stats after leveling up
+            new_stats = self.calculate_combat_stats(self.user)
+            # await ctx.send(level_message)
+            self.combat_stats['max_hp'] = new_stats['max_hp']
+            # await ctx.send(level_message)
+            self.combat_stats['attack'] = new_stats['attack']
+            self.combat_stats['defense'] = new_stats['defense']
+            # await ctx.send(level_message)
+            # Save updated user data
+            # users = load_users()
+            await self.ctx.send(level_message)
+            #users[str(user.user_id)]["level"] = user.level
+            # save_users(users)
+
+        if self.village_only:
+            self.finish()
+            return
+        await self.ctx.send("\nYour adventure continues...")
+        await self.next_round()
 
     async def test_village(self, ctx) -> None:
+        """Start a single village visit with a random character (!village)"""
         # Get or create user
         # user = get_user(ctx.author.id)
-        user = make_random_user()
+        self.attach(ctx)
+        self.ctx = self.start_tracing(ctx)
+        self.village_only = True
+        user = make_random_user(self.rng)
         combat_stats = self.calculate_combat_stats(user)
-        
+        self.user, self.combat_stats = user, combat_stats
+
         # Initial message
-        await ctx.send(f"Welcome {user.name}, Level {user.level} {user.character_class}!")
-        await ctx.send(user.show_stats())
-        await ctx.send(f"Combat Stats: HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}, "
+        await self.ctx.send(f"Welcome {user.name}, Level {user.level} {user.character_class}!")
+        await self.ctx.send(user.show_stats())
+        await self.ctx.send(f"Combat Stats: HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}, "
                       f"Attack: {combat_stats['attack']}, Defense: {combat_stats['defense']}, "
                       f"Coins: {combat_stats['coins']}")
-        survived = True
-        
+        self.last_input = time.time()
+
         # After battle, visit village if survived
-        if survived:
-            await self.visit_village(ctx, user, combat_stats)
-            
-            # Check for level up conditions (simplified)
-            if random.random() < 0.3:  # 30% chance to level up after successful adventure
-                level_message = user.level_up()
-                await ctx.send(level_message)
-                
-                # Save updated user data
-                # users = load_users()
-                # users[str(user.user_id)]["level"] = user.level
-                # save_users(users)
-    
-    async def run_battle(self, ctx, user: User, combat_stats: Dict, story_info = None) -> bool:
-        """Handle battle sequence, returns True if player survives"""
-        print("Generating Battle...")
-        battle = await self.battle_system.generate_battle(story_info=story_info)
-        print("Done Generating Battle")
-
-        await asyncio.sleep(1) # 1 Request per second delay
-        
-        # API CALL: Send battle data (ie. setting, monsters, current user) to Mistral, and generate a story line to print out
-        if self.agent != None:
-            print("Generating Story...")
-            mistral_story = await self.agent.generate_story(story_info, battle)
-            await ctx.send(f"\n{mistral_story}")
-        else:
-            await ctx.send(f"\n{battle['storyline']}")
-            await ctx.send(f"Location: {battle['setting']}")
-        
-        # Battle loop
-        count = 0
-        while any(monster.is_alive() for monster in battle['monsters']) and combat_stats['current_hp'] > 0:
-            # Display current monster status
-            count += 1
-            alive_monsters = [monster for monster in battle['monsters'] if monster.is_alive()]
-            
-            enemy_list = ""
-            for i, monster in enumerate(alive_monsters, 1):
-                enemy_list += f"{i}. {monster.name} (HP: {monster.current_hp})\n"
-            
-            await ctx.send(f"Current enemies:\n{enemy_list}")
-            await ctx.send(f"Your HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}")
-            
-            # Ask player which monster to attack
-            await ctx.send("Which monster do you want to attack? (Enter the number followed by a space and any attack details)")
-            
-            def check(message):
-                # Check if the message is from the user and starts with a number
-                return message.author == ctx.author and message.content.strip()[0].isdigit()
-            
+        await self.visit_village()
+
+    async def start_battle(self):
+        """Set up the round's battle (from the prefetched round, the first time) and ask for the first attack"""
+        # Setting up the round (battle generation and story beat) is traced as its own turn
+        self.next_turn()
+        with span("battle.setup"), turn_deadline(self.TURN_DEADLINE):
+            if self.prefetched_round is not None:
+                # The first round was already started by the bootstrap stage
+                pipeline, self.prefetched_round = self.prefetched_round, None
+            else:
+                logger.debug("Generating battle")
+                pipeline = Pipeline("round")
+                self.add_round_steps(pipeline, self.story_details, beat=self.round - 1)
+                self.start_pipeline(pipeline)
+            # A round prefetched earlier doesn't know this turn's deadline: stop waiting for it there
             try:
-                # Wait for player's response with a 60-second timeout
-                player_choice = await ctx.bot.wait_for('message', check=check, timeout=60.0)
-                
-                # Extract the monster number from the player's response
-                monster_number = int(player_choice.content.strip()[0]) - 1
-                
-                # Validate the choice
-                if monster_number < 0 or monster_number >= len(alive_monsters):
-                    await ctx.send(f"Invalid choice! Please pick a valid number.")
-                    await ctx.send("Format your answer as follows \"<Number> <Description>\" ie: \"1 Swing my Greatsword as hard as I can \"")
+                battle = await asyncio.wait_for(pipeline.result("battle"), remaining())
+            except asyncio.TimeoutError:
+                logger.warning("Battle not ready by the turn deadline, composing one from the current bestiary")
+                metrics.incr("adventure.deadline_fallbacks", step="battle")
+                battle = self.battle_system.compose_battle()
 
-                    continue # repeat
-                
-                # Player's turn
-                target_monster = alive_monsters[monster_number]
-                # damage = self.battle_system.calculate_damage(combat_stats['attack'], target_monster.defense)
-                damage = await self.agent.estimate_attack_damage(combat_stats['attack'], target_monster.defense, player_choice.content.strip()[1:]) 
-                if (count > 7):
-                     damage = target_monster.current_hp
-                     await ctx.send(f"With a dangerous final blow, {user.name} attacks {monster.name} for {round(damage)} damage!")
-                else: 
-                    await ctx.send(f"{user.name} attacks {target_monster.name} for {round(damage)} damage!")
-                target_monster.current_hp -= round(damage)
-                
+            mistral_story = None
+            if "story" in pipeline.steps:
+                try:
+                    mistral_story = await asyncio.wait_for(pipeline.result("story"), remaining())
+                except asyncio.TimeoutError:
+                    pipeline.tasks["story"].cancel()
+                    metrics.incr("adventure.deadline_fallbacks", step="story")
+            if mistral_story is not None:
+                await self.ctx.send(f"\n{mistral_story}")
+            else:
+                await self.ctx.send(f"\n{battle['storyline']}")
+                await self.ctx.send(f"Location: {battle['setting']}")
+
+        if self.adventure_started is not None:
+            # Time-to-first-battle, both end to end and as seen by the player after describing their character
+            now = time.monotonic()
+            self.time_to_first_battle = now - self.adventure_started
+            metrics.observe("adventure.time_to_first_battle", self.time_to_first_battle)
+            if self.character_reply_at is not None:
+                metrics.observe("adventure.first_battle_wait", now - self.character_reply_at)
+            logger.info("Time to first battle: %.2fs", self.time_to_first_battle)
+            self.adventure_started = None
+
+        self.battle = battle
+        self.battle_turn = 0
+        await self.next_battle_turn()
+
+    async def next_battle_turn(self):
+        """Show the monsters and ask which one to attack, or end the battle"""
+        battle, combat_stats = self.battle, self.combat_stats
+        if not (any(monster.is_alive() for monster in battle['monsters']) and combat_stats['current_hp'] > 0):
+            await self.end_battle()
+            return
+
+        # Display current monster status
+        self.battle_turn += 1
+        self.next_turn()
+        alive_monsters = [monster for monster in battle['monsters'] if monster.is_alive()]
+
+        enemy_list = ""
+        for i, monster in enumerate(alive_monsters, 1):
+            enemy_list += f"{i}. {monster.name} (HP: {monster.current_hp})\n"
+
+        if self.components:
+            await self.send_prompt(
+                f"Current enemies:\n{enemy_list}\nYour HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}\n"
+                "Which monster do you want to attack? (Pick one, or enter the number followed by a space and any attack details)",
+                button_view(self.player_id, self.turn_number, BATTLE_TARGET,
+                            [(str(i), f"{i}. {monster.name}") for i, monster in enumerate(alive_monsters, 1)],
+                            style=discord.ButtonStyle.danger))
+            self.prompt(BATTLE_TARGET)
+            return
+
+        await self.ctx.send(f"Current enemies:\n{enemy_list}")
+        await self.ctx.send(f"Your HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}")
+
+        # Ask player which monster to attack
+        await self.ctx.send("Which monster do you want to attack? (Enter the number followed by a space and any attack details)")
+        self.prompt(BATTLE_TARGET)
+
+    async def on_attack(self, choice):
+        """The player picked a monster to attack (choice None: they took too long), then the monsters strike back"""
+        with span("battle.turn", round=self.battle_turn), turn_deadline(self.TURN_DEADLINE):
+            attacked = await self.player_attacks(choice)
+            survived = not attacked or await self.monsters_attack()
+        if not survived:
+            await self.ctx.send(f"{self.user.name}'s journey comes to an end...")
+            self.finish()
+            return
+        # An invalid choice asks again, without the monsters getting a turn
+        await self.next_battle_turn()
+
+    async def player_attacks(self, choice) -> bool:
+        """Resolve the player's attack; False if choice named no monster"""
+        user, combat_stats = self.user, self.combat_stats
+        alive_monsters = [monster for monster in self.battle['monsters'] if monster.is_alive()]
+        if choice is None:
+            await self.ctx.send("You took too long to respond! Attacking the first monster by default.")
+            if alive_monsters:
+                target_monster = alive_monsters[0]
+                damage = self.battle_system.calculate_damage(combat_stats['attack'], target_monster.defense)
+                target_monster.current_hp -= damage
+                await self.ctx.send(f"{user.name} attacks {target_monster.name} for {damage} damage!")
                 if not target_monster.is_alive():
-                    await ctx.send(f"{target_monster.name} has been defeated!")
-                    
-                    # Add random loot
-                    loot = random.choice(["Health Potion", "Strength Elixir", "Defense Charm"])
-                    loot_message = user.add_item(loot)
-                    await ctx.send(loot_message)
-                    
-                    combat_stats['coins'] += random.randint(20, 50)
-            
-            except asyncio.TimeoutError:
-                await ctx.send("You took too long to respond! Attacking the first monster by default.")
-                if alive_monsters:
-                    target_monster = alive_monsters[0]
-                    damage = self.battle_system.calculate_damage(combat_stats['attack'], target_monster.defense)
-                    target_monster.current_hp -= damage
-                    await ctx.send(f"{user.name} attacks {target_monster.name} for {damage} damage!")
-                    
-                    if not target_monster.is_alive():
-                        await ctx.send(f"{target_monster.name} has been defeated!")
-                        
-                        # Add random loot
-                        loot = random.choice(["Health Potion", "Strength Elixir", "Defense Charm"])
-                        loot_message = user.add_item(loot)
-                        await ctx.send(loot_message)
-                        
-                        combat_stats['coins'] += random.randint(20, 50)
-            
-            # Monsters' turn
-            for monster in battle['monsters']:
-                if monster.is_alive():
-                    damage = self.battle_system.calculate_damage(monster.attack, combat_stats['defense'])
-                    combat_stats['current_hp'] -= damage
-                    await ctx.send(f"{monster.name} attacks {user.name} for {damage} damage!")
-                    
-                    if combat_stats['current_hp'] <= 0:
-                        await ctx.send(f"{user.name} has been defeated!")
-                        return False
-        
-        if combat_stats['current_hp'] > 0:
-            await ctx.send(f"Victory! You survived with {combat_stats['current_hp']} HP remaining!")
-            await ctx.send(f"You now have {combat_stats['coins']} coins!")
+                    await self.monster_defeated(target_monster)
             return True
-        return False
-    
+
+        # Extract the monster number from the player's response
+        monster_number = int(choice.strip()[0]) - 1
+
+        # Validate the choice
+        if monster_number < 0 or monster_number >= len(alive_monsters):
+            await self.ctx.send(f"Invalid choice! Please pick a valid number.")
+            await self.ctx.send("Format your answer as follows \"<Number> <Description>\" ie: \"1 Swing my Greatsword as hard as I can \"")
+            return False
+
+        # Player's turn
+        target_monster = alive_monsters[monster_number]
+        # damage = self.battle_system.calculate_damage(combat_stats['attack'], target_monster.defense)
+        damage = await self.agent.estimate_attack_damage(combat_stats['attack'], target_monster.defense, choice.strip()[1:],
+                                                     self.battle_system.rng)
+        if (self.battle_turn > 7):
+             damage = target_monster.current_hp
+             # (the message names the last monster listed, as it always has)
+             await self.ctx.send(f"With a dangerous final blow, {user.name} attacks {alive_monsters[-1].name} for {round(damage)} damage!")
+        else:
+            await self.ctx.send(f"{user.name} attacks {target_monster.name} for {round(damage)} damage!")
+        target_monster.current_hp -= round(damage)
+
+        if not target_monster.is_alive():
+            await self.monster_defeated(target_monster)
+        return True
+
+    async def monster_defeated(self, monster: Monster):
+        await self.ctx.send(f"{monster.name} has been defeated!")
+
+        # Add random loot
+        loot = self.rng.choice(["Health Potion", "Strength Elixir", "Defense Charm"])
+        loot_message = self.user.add_item(loot)
+        await self.ctx.send(loot_message)
+
+        self.combat_stats['coins'] += self.rng.randint(20, 50)
+
+    async def monsters_attack(self) -> bool:
+        """Every monster still standing attacks; False if that defeats the player"""
+        user, combat_stats = self.user, self.combat_stats
+        for monster in self.battle['monsters']:
+            if monster.is_alive():
+                damage = self.battle_system.calculate_damage(monster.attack, combat_stats['defense'])
+                combat_stats['current_hp'] -= damage
+                await self.ctx.send(f"{monster.name} attacks {user.name} for {damage} damage!")
+
+                if combat_stats['current_hp'] <= 0:
+                    await self.ctx.send(f"{user.name} has been defeated!")
+                    return False
+        return True
+
+    async def end_battle(self):
+        combat_stats = self.combat_stats
+        self.battle = None
+        if combat_stats['current_hp'] > 0:
+            await self.ctx.send(f"Victory! You survived with {combat_stats['current_hp']} HP remaining!")
+            await self.ctx.send(f"You now have {combat_stats['coins']} coins!")
+            await self.visit_village()
+        else:
+            await self.ctx.send(f"{self.user.name}'s journey comes to an end...")
+            self.finish()
+
     '''async def visit_village(self, ctx, user: User, combat_stats: Dict) -> None:
         """Handle village sequence with user interaction"""
         villageProb = 0.3
@@ -385,129 +887,166 @@ class StorySystem:
             except asyncio.TimeoutError:
                 await ctx.send("No response received. Please make a selection!")
                 continue'''
-    
-    async def visit_village(self, ctx, user: User, combat_stats: Dict) -> None:
-        """Handle village sequence with user interaction"""
+
+    async def visit_village(self) -> None:
+        """After a battle, 30% chance to skip the village; otherwise open its menu"""
         villageProb = 0.3
-        if random.random() < villageProb:
+        if self.rng.random() < villageProb:
+            await self.end_of_round()
             return
 
-        await ctx.send("\nYou arrive at the village to rest and recover...")
-    
+        await self.ctx.send("\nYou arrive at the village to rest and recover...")
+
         # Refresh shop items when entering the village
         #await self.village.refresh_shop_items(story_info=self.story_info)
-    
-        while True:  # Keep running until user chooses to leave
-            # Display current stats
-            await ctx.send(f"\n💰 Your Coins: {combat_stats['coins']}")
-            await ctx.send(f"❤️ HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}")
-        
-            options_message = """
-            What would you like to do?
-            1️⃣ Visit the healer (1 HP = 1 coin + 10 coin fee)
-            2️⃣ Visit shop
-            3️⃣ Leave village
-            """
-            await ctx.send(options_message)
-        
-            try:
-                def check(m):
-                    return m.author == ctx.author and m.channel == ctx.channel
-                
-                response = await ctx.bot.wait_for('message', timeout=30.0, check=check)
-                choice = response.content.lower()
-                
-                if choice in ['1', 'healer', 'visit healer']:
-                    healing_needed = combat_stats['max_hp'] - combat_stats['current_hp']
-                    healing_cost = healing_needed + 10  # Base cost + service fee
-                    
-                    if combat_stats['coins'] >= healing_cost:
-                        combat_stats['coins'] -= healing_cost
-                        combat_stats['current_hp'] = combat_stats['max_hp']
-                        await ctx.send(f"You've been healed to full health! Current HP: {combat_stats['current_hp']}")
-                        await ctx.send(f"Remaining coins: {combat_stats['coins']}")
-                    else:
-                        await ctx.send("Not enough coins for healing!")
-                
-                elif choice in ['2', 'shop', 'visit shop']:
-                    await self.village.refresh_shop_items(story_info=self.story_info)
-                    # Show detailed shop inventory
-                    shop_message = "📜 **Available Items in Shop:**\n"
-                    for i, (item_name, details) in enumerate(self.village.shop_items.items(), 1):
-                        type_emoji = {
-                            "Weapon": "⚔️",
-                            "Armor": "🛡️",
-                            "Potion": "🧪",
-                            "Tool": "🔧",
-                            "Magical": "✨"
-                        }.get(details.get("type", ""), "📦")
-                        
-                        stats_info = []
-                        if "attack" in details:
-                            stats_info.append(f"Attack +{details['attack']}")
-                        if "defense" in details:
-                            stats_info.append(f"Defense +{details['defense']}")
-                        if "heal" in details:
-                            stats_info.append(f"Heals {details['heal']} HP")
-                        if "stat_boost" in details:
-                            for stat, boost in details["stat_boost"].items():
-                                stats_info.append(f"{stat} +{boost}")
-                        
-                        stats_text = f" ({', '.join(stats_info)})" if stats_info else ""
-                        
-                        shop_message += f"\n{i}. {type_emoji} **{item_name}**"
-                        shop_message += f"\n   💰 Price: {details['price']} coins"
-                        shop_message += f"\n   📝 {details['description']}{stats_text}\n"
-                    
-                    await ctx.send(shop_message)
-                    await ctx.send("\nWhat would you like to buy? (Enter the number or 'back' to return)")
-                    
-                    try:
-                        shop_response = await ctx.bot.wait_for('message', timeout=30.0, check=check)
-                        if shop_response.content.lower() != 'back':
-                            try:
-                                item_index = int(shop_response.content) - 1
-                                item_name = list(self.village.shop_items.keys())[item_index]
-                                result = self.village.buy_item(user, combat_stats, item_name)
-                                await ctx.send(result['message'])
-                            except (ValueError, IndexError):
-                                await ctx.send("Invalid item number! Please try again.")
-                    except asyncio.TimeoutError:
-                        await ctx.send("Purchase cancelled - took too long to respond.")
-                
-                elif choice in ['3', 'leave', 'leave village']:
-                    await ctx.send("You leave the village and continue your journey...")
-                    break
-                
+        await self.village_menu()
+
+    async def village_menu(self):
+        self.next_turn()
+        combat_stats = self.combat_stats
+        if self.components:
+            await self.send_prompt(
+                f"💰 Your Coins: {combat_stats['coins']}\n❤️ HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}\n"
+                "What would you like to do?",
+                button_view(self.player_id, self.turn_number, VILLAGE_MENU,
+                            [("1", "Healer (1 HP = 1 coin + 10 coin fee)"), ("2", "Shop"), ("3", "Leave village")]))
+            self.prompt(VILLAGE_MENU)
+            return
+
+        # Display current stats
+        await self.ctx.send(f"\n💰 Your Coins: {combat_stats['coins']}")
+        await self.ctx.send(f"❤️ HP: {combat_stats['current_hp']}/{combat_stats['max_hp']}")
+
+        options_message = """
+                What would you like to do?
+                1️⃣ Visit the healer (1 HP = 1 coin + 10 coin fee)
+                2️⃣ Visit shop
+                3️⃣ Leave village
+                """
+        await self.ctx.send(options_message)
+        self.prompt(VILLAGE_MENU)
+
+    async def on_village_choice(self, response):
+        """The player picked a village option (response None: they took too long)"""
+        combat_stats = self.combat_stats
+        choice = response.lower() if response is not None else None
+        with span("village.turn"), turn_deadline(self.TURN_DEADLINE):
+            if choice is None:
+                await self.ctx.send("No response received. Please make a selection!")
+
+            elif choice in ['1', 'healer', 'visit healer']:
+                healing_needed = combat_stats['max_hp'] - combat_stats['current_hp']
+                healing_cost = healing_needed + 10  # Base cost + service fee
+
+                if combat_stats['coins'] >= healing_cost:
+                    combat_stats['coins'] -= healing_cost
+                    combat_stats['current_hp'] = combat_stats['max_hp']
+                    await self.ctx.send(f"You've been healed to full health! Current HP: {combat_stats['current_hp']}")
+                    await self.ctx.send(f"Remaining coins: {combat_stats['coins']}")
                 else:
-                    await ctx.send("Invalid choice! Please select 1, 2, or 3.")
-                
-            except asyncio.TimeoutError:
-                await ctx.send("No response received. Please make a selection!")
-                continue
+                    await self.ctx.send("Not enough coins for healing!")
+
+            elif choice in ['2', 'shop', 'visit shop']:
+                await self.open_shop()
+                return
+
+            elif choice in ['3', 'leave', 'leave village']:
+                await self.ctx.send("You leave the village and continue your journey...")
+
+            else:
+                await self.ctx.send("Invalid choice! Please select 1, 2, or 3.")
+
+        if choice in ['3', 'leave', 'leave village']:
+            await self.end_of_round()
+        else:
+            await self.village_menu()
+
+    async def open_shop(self):
+        await self.village.refresh_shop_items(story_info=self.story_info)
+        # Show detailed shop inventory
+        shop_message = "📜 **Available Items in Shop:**\n"
+        for i, (item_name, details) in enumerate(self.village.shop_items.items(), 1):
+            type_emoji = {
+                "Weapon": "⚔️",
+                "Armor": "🛡️",
+                "Potion": "🧪",
+                "Tool": "🔧",
+                "Magical": "✨"
+            }.get(details.get("type", ""), "📦")
+
+            stats_info = []
+            if "attack" in details:
+                stats_info.append(f"Attack +{details['attack']}")
+            if "defense" in details:
+                stats_info.append(f"Defense +{details['defense']}")
+            if "heal" in details:
+                stats_info.append(f"Heals {details['heal']} HP")
+            if "stat_boost" in details:
+                for stat, boost in details["stat_boost"].items():
+                    stats_info.append(f"{stat} +{boost}")
+
+            stats_text = f" ({', '.join(stats_info)})" if stats_info else ""
+
+            shop_message += f"\n{i}. {type_emoji} **{item_name}**"
+            shop_message += f"\n   💰 Price: {details['price']} coins"
+            shop_message += f"\n   📝 {details['description']}{stats_text}\n"
+
+        if self.components:
+            items = [(str(i), f"{item_name} ({details['price']} coins)")
+                     for i, (item_name, details) in enumerate(self.village.shop_items.items(), 1)]
+            await self.send_prompt(f"{shop_message}\nWhat would you like to buy?",
+                                   select_view(self.player_id, self.turn_number, SHOP,
+                                               [*items[:24], ("back", "Nothing, back to the village")],
+                                               placeholder="Choose an item"))
+            self.prompt(SHOP)
+            return
+
+        await self.ctx.send(shop_message)
+        await self.ctx.send("\nWhat would you like to buy? (Enter the number or 'back' to return)")
+        self.prompt(SHOP)
+
+    async def on_purchase(self, response):
+        """The player picked an item to buy (response None: they took too long)"""
+        with span("village.shop"):
+            if response is None:
+                await self.ctx.send("Purchase cancelled - took too long to respond.")
+            elif response.lower() != 'back':
+                try:
+                    item_index = int(response) - 1
+                    item_name = list(self.village.shop_items.keys())[item_index]
+                    result = self.village.buy_item(self.user, self.combat_stats, item_name)
+                    await self.ctx.send(result['message'])
+                except (ValueError, IndexError):
+                    await self.ctx.send("Invalid item number! Please try again.")
+        await self.village_menu()
 
 # Mock Discord context for terminal testing
 class MockContext:
     def __init__(self, user_id=12345, username="TestUser"):
         self.author = type('MockAuthor', (), {'id': user_id, 'name': username})
-        
+
     async def send(self, message):
         print(message)
-        
+
     async def reply(self, message):
         print(f"Reply: {message}")
 
 # Main execution for terminal testing
 if __name__ == "__main__":
     import asyncio
-    
+    from types import SimpleNamespace
+
     async def main():
         # Create mock context and story
         mock_ctx = MockContext(user_id=12345, username="TerminalUser")
         story = StorySystem()
-        
-        # Run the adventure
+
+        # Run the adventure, answering its prompts from the terminal
         await story.start_adventure(mock_ctx)
-    
+        while story.phase != FINISHED:
+            message = SimpleNamespace(content=await asyncio.to_thread(input), author=mock_ctx.author, channel=None)
+            if story.accepts(message):
+                await story.handle(message)
+
     # Run the async main function
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
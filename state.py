@@ -0,0 +1,298 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from collections import deque
+from typing import Any, List, Optional
+from urllib.parse import urlparse
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process in shared session records
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class StateBackend:
+    """Storage for state that several bot workers need to agree on: session records, the
+    pooled bestiary, shop caches and rate-limit tokens. Values are JSON-serialisable."""
+
+    shared = False  # True when other processes see the same state
+
+    async def get(self, key: str) -> Any:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def push(self, key: str, value: Any, max_len: Optional[int] = None):
+        """Append to a list, dropping the oldest entries beyond max_len"""
+        raise NotImplementedError
+
+    async def members(self, key: str) -> List[Any]:
+        raise NotImplementedError
+
+    async def keys(self, prefix: str) -> List[str]:
+        raise NotImplementedError
+
+    async def take_token(self, key: str, rate: float, capacity: float) -> float:
+        """Take one token from the bucket at key (refilled at rate per second, holding at most
+        capacity). Returns 0 if a token was taken, else the seconds until one is available."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def _refill(bucket, rate, capacity, now):
+    if bucket is None:
+        return capacity
+    return min(capacity, bucket["tokens"] + (now - bucket["at"]) * rate)
+
+
+class MemoryBackend(StateBackend):
+    """Process-local state; the default, and all a single worker needs"""
+
+    def __init__(self):
+        self.values = {}  # key -> (value, expires at or None)
+
+    def _live(self, key):
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self.values[key]
+            return None
+        return entry
+
+    async def get(self, key):
+        entry = self._live(key)
+        return None if entry is None else entry[0]
+
+    async def set(self, key, value, ttl=None):
+        self.values[key] = (value, None if ttl is None else time.monotonic() + ttl)
+
+    async def delete(self, key):
+        self.values.pop(key, None)
+
+    async def push(self, key, value, max_len=None):
+        entry = self._live(key)
+        items = entry[0] if entry else deque()
+        items.append(value)
+        while max_len is not None and len(items) > max_len:
+            items.popleft()
+        self.values[key] = (items, None)
+
+    async def members(self, key):
+        entry = self._live(key)
+        return list(entry[0]) if entry else []
+
+    async def keys(self, prefix):
+        return [key for key in list(self.values) if key.startswith(prefix) and self._live(key)]
+
+    async def take_token(self, key, rate, capacity):
+        now = time.monotonic()
+        tokens = _refill(await self.get(key), rate, capacity, now)
+        if tokens >= 1:
+            await self.set(key, {"tokens": tokens - 1, "at": now})
+            return 0.0
+        return (1 - tokens) / rate
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(StateBackend):
+    """State in a Redis server (or anything speaking RESP, like redis_standin.py), over one
+    connection. Token buckets use WATCH/MULTI/EXEC and the server's clock, so workers on
+    different hosts share one bucket without a Lua script."""
+
+    shared = True
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, prefix: str = "dnd:"):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.prefix = prefix
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBackend":
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(parsed.hostname or "localhost", parsed.port or 6379, db)
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.db:
+            await self._call("SELECT", self.db)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+            if count < 0:
+                return None
+            return [await self._read_reply() for _ in range(count)]
+        raise RedisError(f"Unexpected reply {line!r}")
+
+    async def _call(self, *args):
+        """Send one command and read its reply; callers hold the lock"""
+        if self._writer is None:
+            await self._connect()
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        try:
+            self._writer.write(b"".join(parts))
+            await self._writer.drain()
+            return await self._read_reply()
+        except RedisError:
+            raise  # the error reply was read in full: the connection is still in step
+        except BaseException:
+            # Lost, or cancelled (CancelledError included) with the reply possibly still on its
+            # way: the next caller would read it as its own, so start over on a new connection
+            self._reset()
+            raise
+
+    def _reset(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+    async def execute(self, *args):
+        async with self._lock:
+            start = time.perf_counter()
+            try:
+                return await self._call(*args)
+            finally:
+                metrics.observe("state.call", time.perf_counter() - start, command=str(args[0]))
+
+    async def get(self, key):
+        data = await self.execute("GET", self.prefix + key)
+        return None if data is None else json.loads(data)
+
+    async def set(self, key, value, ttl=None):
+        if ttl is None:
+            await self.execute("SET", self.prefix + key, json.dumps(value))
+        else:
+            await self.execute("SET", self.prefix + key, json.dumps(value), "PX", int(ttl * 1000))
+
+    async def delete(self, key):
+        await self.execute("DEL", self.prefix + key)
+
+    async def push(self, key, value, max_len=None):
+        await self.execute("RPUSH", self.prefix + key, json.dumps(value))
+        if max_len is not None:
+            await self.execute("LTRIM", self.prefix + key, -max_len, -1)
+
+    async def members(self, key):
+        return [json.loads(item) for item in await self.execute("LRANGE", self.prefix + key, 0, -1)]
+
+    async def keys(self, prefix):
+        found = await self.execute("KEYS", self.prefix + prefix + "*")
+        return [key.decode()[len(self.prefix):] for key in found]
+
+    async def take_token(self, key, rate, capacity):
+        full_key = self.prefix + key
+        async with self._lock:
+            try:
+                return await self._take_token(full_key, rate, capacity)
+            except BaseException:
+                # Don't leave the connection WATCHing or inside MULTI for the next caller
+                self._reset()
+                raise
+
+    async def _take_token(self, full_key, rate, capacity):
+        """take_token's WATCH/MULTI/EXEC loop; the caller holds the lock"""
+        for _ in range(10):
+            await self._call("WATCH", full_key)
+            data = await self._call("GET", full_key)
+            seconds, micros = await self._call("TIME")
+            now = int(seconds) + int(micros) / 1_000_000
+            tokens = _refill(None if data is None else json.loads(data), rate, capacity, now)
+            if tokens < 1:
+                await self._call("UNWATCH")
+                return (1 - tokens) / rate
+            await self._call("MULTI")
+            # Expire idle buckets once they would be full again anyway
+            await self._call("SET", full_key, json.dumps({"tokens": tokens - 1, "at": now}),
+                             "PX", int(max(1.0, capacity / rate) * 1000))
+            if await self._call("EXEC") is not None:
+                return 0.0
+            metrics.incr("state.token_conflicts")
+        # Heavy contention: back off briefly rather than spin
+        return 1 / rate
+
+    async def close(self):
+        self._reset()
+
+
+class DistributedTokenBucket:
+    """A token bucket shared by every worker using the same backend, so that together they
+    stay within one API quota (rate requests per second, bursts of up to capacity)"""
+
+    def __init__(self, backend: StateBackend, key: str, rate: float, capacity: float = 1.0):
+        self.backend = backend
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+
+    async def acquire(self):
+        start = time.monotonic()
+        while True:
+            try:
+                wait = await self.backend.take_token(self.key, self.rate, self.capacity)
+            except (OSError, RedisError) as e:
+                # Shared state unavailable: fall back to this worker's share of the quota
+                logger.warning("Token bucket %s unavailable (%s), pacing locally", self.key, e)
+                wait = 1 / self.rate
+                await asyncio.sleep(wait)
+                break
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        metrics.observe("ratelimit.wait", time.monotonic() - start, bucket=self.key)
+
+
+_backend = None
+
+
+def get_backend() -> StateBackend:
+    """The process-wide backend, chosen by STATE_BACKEND: "memory" (default) or redis://host:port/db"""
+    global _backend
+    if _backend is None:
+        url = os.getenv("STATE_BACKEND", "memory")
+        if url.startswith("redis://"):
+            _backend = RedisBackend.from_url(url)
+            logger.info("Using shared state at %s as worker %s", url, WORKER_ID)
+        else:
+            _backend = MemoryBackend()
+    return _backend
@@ -0,0 +1,71 @@
+from typing import Dict, List
+
+from schemas import STORY_ARC
+
+# Story arc mode of an adventure (STORY_ARC): OFF narrates every round with generate_story
+# or generate_encounter, sending the whole story so far, and ends with a full-context
+# generate_end_message. In the other modes one outline (MistralAgent.generate_story_arc) is
+# requested at !start and each round narrates its next beat: LLM with small prompts holding
+# just the outline's gist and the beat (context(); expand_story_beat, or the encounter
+# prompt), LOCAL from the templates below without any tokens. Either way the ending is the
+# outline's own.
+OFF = "off"
+LLM = "llm"
+LOCAL = "local"
+MODES = (OFF, LLM, LOCAL)
+
+# Beat narration without the LLM; filled in with a beat's setting and milestone
+TEMPLATES = [
+    "Your path leads to {setting}. {milestone}",
+    "Ahead lies {setting}, quiet only for a moment. {milestone}",
+    "Word of the road brings you to {setting}. {milestone}",
+    "At {setting} the trail grows dangerous. {milestone}",
+]
+
+# The milestone of rounds past the outline's last beat
+ONWARD = "{antagonist} still has servants to send against you."
+
+
+def mode(value: str) -> str:
+    """A STORY_ARC value as one of MODES (unknown values turn arcs off)"""
+    value = (value or OFF).strip().lower()
+    return value if value in MODES else OFF
+
+
+def default_arc(rng) -> Dict:
+    """The schema's fallback outline, for when no outline could be generated"""
+    return STORY_ARC.fallback(rng)
+
+
+def beat(arc: Dict, index: int) -> Dict:
+    """The beat of round index + 1; rounds past the outline carry on from its last setting"""
+    beats = arc["beats"]
+    if index < len(beats):
+        return beats[index]
+    antagonist = arc["antagonist"]
+    return {"setting": beats[-1]["setting"],
+            "milestone": ONWARD.format(antagonist=antagonist[:1].upper() + antagonist[1:])}
+
+
+def gist(arc: Dict) -> str:
+    """The outline in one line, in place of the story so far in other prompts"""
+    return f"Adventure: {arc['title']}. Antagonist: {arc['antagonist']}."
+
+
+def context(arc: Dict, index: int) -> List[str]:
+    """What a round's prompts get in place of the story so far: the gist, the previous milestone and the beat"""
+    lines = [gist(arc)]
+    if index:
+        lines.append("Previously: " + beat(arc, index - 1)["milestone"])
+    current = beat(arc, index)
+    lines.append(f"Now, at {current['setting']}: {current['milestone']}")
+    return lines
+
+
+def narrate(arc: Dict, index: int) -> str:
+    """A round's beat told from a template"""
+    return TEMPLATES[index % len(TEMPLATES)].format(**beat(arc, index))
+
+
+def ending(arc: Dict) -> str:
+    return arc["ending"]
@@ -0,0 +1,129 @@
+"""Run bot.py as several sharded worker processes, so throughput scales with cores.
+
+Usage: python supervisor.py [--workers N] [--shards M] [--report-interval SECONDS]
+
+Shard i of M is owned by worker i % N (M defaults to N); each worker is a separate bot.py
+process with its own event loop, started with SHARD_IDS, SHARD_COUNT and WORKER_ID set.
+Discord routes all of a guild's events to one shard, so every session stays on the worker
+that started it. Workers share state (session records, bestiary pool, shop stock, the
+Mistral token bucket) through STATE_BACKEND; if it isn't a redis:// URL, the supervisor
+starts redis_standin.py for them. Crashed workers are restarted with exponential backoff,
+and fleet health (as reported by each worker) is printed every --report-interval seconds."""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+from fleet import fleet_health, format_fleet
+from log_setup import setup_logging
+from state import RedisBackend
+
+logger = logging.getLogger("supervisor")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class Worker:
+    def __init__(self, index: int, shard_ids, shard_count: int, env: dict):
+        self.index = index
+        self.name = f"worker-{index}"
+        self.shard_ids = shard_ids
+        self.env = {**env, "WORKER_ID": self.name, "SHARD_IDS": ",".join(map(str, shard_ids)),
+                    "SHARD_COUNT": str(shard_count)}
+        self.process = None
+        self.restarts = 0
+        self.backoff = 1.0
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(sys.executable, os.path.join(HERE, "bot.py"),
+                                                            env=self.env, cwd=HERE)
+        logger.info("Started %s (pid %s) with shards %s", self.name, self.process.pid, self.shard_ids)
+
+    async def supervise(self, stopping: asyncio.Event):
+        """Keep the worker running until the supervisor stops, restarting it when it exits"""
+        while not stopping.is_set():
+            await self.start()
+            started = asyncio.get_running_loop().time()
+            code = await self.process.wait()
+            if stopping.is_set():
+                return
+            # A worker that stayed up for a while gets a fresh backoff
+            if asyncio.get_running_loop().time() - started > 60:
+                self.backoff = 1.0
+            self.restarts += 1
+            logger.warning("%s exited with code %s; restarting in %.0fs", self.name, code, self.backoff)
+            try:
+                await asyncio.wait_for(stopping.wait(), self.backoff)
+            except asyncio.TimeoutError:
+                pass
+            self.backoff = min(60.0, self.backoff * 2)
+
+    def stop(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+
+
+def assign_shards(workers: int, shards: int):
+    return [[shard for shard in range(shards) if shard % workers == index] for index in range(workers)]
+
+
+async def run(workers: int, shards: int, report_interval: float, standin_port: int):
+    env = dict(os.environ)
+    standin = None
+    if not env.get("STATE_BACKEND", "").startswith("redis://"):
+        standin = await asyncio.create_subprocess_exec(sys.executable, os.path.join(HERE, "redis_standin.py"),
+                                                       "--port", str(standin_port), cwd=HERE)
+        env["STATE_BACKEND"] = f"redis://127.0.0.1:{standin_port}"
+        await asyncio.sleep(0.5)
+    backend = RedisBackend.from_url(env["STATE_BACKEND"])
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    fleet = [Worker(index, shard_ids, shards, env) for index, shard_ids in enumerate(assign_shards(workers, shards))]
+    tasks = [asyncio.ensure_future(worker.supervise(stopping)) for worker in fleet]
+    while not stopping.is_set():
+        try:
+            await asyncio.wait_for(stopping.wait(), report_interval)
+        except asyncio.TimeoutError:
+            pass
+        if stopping.is_set():
+            break
+        try:
+            snapshots = await fleet_health(backend)
+            restarts = sum(worker.restarts for worker in fleet)
+            logger.info("Fleet health (%d restarts so far):\n%s", restarts, format_fleet(snapshots, expected=workers))
+        except (OSError, ConnectionError) as e:
+            logger.warning("Could not read fleet health: %s", e)
+
+    logger.info("Stopping %d workers", len(fleet))
+    for worker in fleet:
+        worker.stop()
+    await asyncio.gather(*tasks)
+    if standin is not None:
+        standin.terminate()
+        await standin.wait()
+    await backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shards", type=int, help="total shard count (default: one per worker)")
+    parser.add_argument("--report-interval", type=float, default=30.0)
+    parser.add_argument("--standin-port", type=int, default=6379,
+                        help="port for the Redis stand-in started when STATE_BACKEND isn't redis://")
+    args = parser.parse_args()
+    setup_logging()
+    shards = args.shards or args.workers
+    if shards < args.workers:
+        parser.error("need at least one shard per worker")
+    asyncio.run(run(args.workers, shards, args.report_interval, args.standin_port))
+
+
+if __name__ == "__main__":
+    main()
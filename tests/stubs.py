@@ -0,0 +1,71 @@
+"""Stand-ins for the Mistral API and a Discord context, for tests that play whole adventures"""
+import asyncio
+import json
+import random
+from types import SimpleNamespace
+
+import schemas
+from agent import MistralAgent
+from start_story import PHASE_TIMEOUTS, SHOP, VILLAGE_MENU
+
+SCHEMAS = {value.name: value for value in vars(schemas).values() if isinstance(value, schemas.Object)}
+
+
+class StubChat:
+    """Answers like the API would: the schema's defaults for structured requests, a line of
+    story otherwise, unless answers maps the schema name (or "text") to a function of the
+    messages giving the content. requests lists what was asked for."""
+
+    def __init__(self, latency: float = 0.001):
+        self.latency = latency
+        self.rng = random.Random(1)
+        self.requests = []
+        self.answers = {}
+
+    async def complete_async(self, model, messages, response_format=None, **options):
+        structured = response_format is not None and response_format["type"] == "json_schema"
+        kind = response_format["json_schema"]["name"] if structured else "text"
+        self.requests.append(kind)
+        await asyncio.sleep(self.latency)
+        if kind in self.answers:
+            content = self.answers[kind](messages)
+        elif structured:
+            content = json.dumps(SCHEMAS[response_format["json_schema"]["name"]].fallback(self.rng))
+        else:
+            content = f"The story goes on ({self.rng.random():.4f})."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                               usage=SimpleNamespace(prompt_tokens=100, completion_tokens=20))
+
+
+def stub_agent(latency: float = 0.001) -> MistralAgent:
+    """A MistralAgent whose endpoints all answer from one StubChat (agent.chat)"""
+    agent = MistralAgent()
+    agent.chat = StubChat(latency)
+    for endpoint in agent.keys.endpoints:
+        endpoint._client = SimpleNamespace(chat=agent.chat)
+    return agent
+
+
+class Context:
+    def __init__(self, player: int = 5):
+        self.author = SimpleNamespace(id=player, name="player", bot=False)
+        self.channel = SimpleNamespace(id=9)
+        self.guild = SimpleNamespace(id=3)
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+
+def message(ctx, content):
+    return SimpleNamespace(content=content, author=ctx.author, channel=ctx.channel, created_at=None)
+
+
+async def play(story, ctx, character="a wandering knight", attack="1 swing my sword"):
+    """Answer every prompt of a started adventure until it is over: leave the village, attack the first monster"""
+    answers = iter([character] + [attack] * 100)
+    while story.phase in PHASE_TIMEOUTS:
+        await asyncio.sleep(0.01)
+        answer = {VILLAGE_MENU: "3", SHOP: "back"}.get(story.phase) or next(answers)
+        if story.accepts(message(ctx, answer)):
+            await story.handle(message(ctx, answer))
@@ -0,0 +1,70 @@
+import asyncio
+
+from admission import AdmissionControl
+
+
+async def _admitted_order(control, waiting):
+    """Players in the order they get the one slot, queued in the order of waiting
+    ((player, resuming) pairs) behind an adventure that then ends"""
+    first = await control.admit("first")
+    order = []
+
+    async def wait(player, resuming):
+        admission = await control.admit(player, resuming=resuming)
+        order.append(player)
+        admission.release()
+
+    tasks = []
+    for player, resuming in waiting:
+        tasks.append(asyncio.ensure_future(wait(player, resuming)))
+        await asyncio.sleep(0)  # queue them one after the other
+    assert control.queue_length() == len(waiting)
+    first.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_new_players_are_admitted_first_come_first_served():
+    control = AdmissionControl(max_sessions=1, max_bootstraps=0)
+    order = asyncio.run(_admitted_order(control, [("a", False), ("b", False), ("c", False)]))
+    assert order == ["a", "b", "c"]
+    assert control.active == 0
+
+
+def test_resuming_players_go_ahead_of_new_ones_in_their_own_order():
+    control = AdmissionControl(max_sessions=1, max_bootstraps=0)
+    order = asyncio.run(_admitted_order(control, [("new1", False), ("back1", True), ("new2", False),
+                                                  ("back2", True)]))
+    assert order == ["back1", "back2", "new1", "new2"]
+
+
+def test_bootstrap_slot_is_freed_before_the_session_slot():
+    async def main():
+        control = AdmissionControl(max_sessions=5, max_bootstraps=1)
+        first = await control.admit("a")
+        waiting = asyncio.ensure_future(control.admit("b"))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        first.bootstrapped()
+        second = await waiting
+        assert control.active == 2 and control.bootstrapping == 1
+        first.release()
+        second.release()
+        assert control.active == 0 and control.bootstrapping == 0
+
+    asyncio.run(main())
+
+
+def test_player_who_gives_up_leaves_the_queue():
+    async def main():
+        control = AdmissionControl(max_sessions=1, max_bootstraps=0)
+        first = await control.admit("a")
+        waiting = asyncio.ensure_future(control.admit("b"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert control.queue_length() == 0
+        first.release()
+        assert control.active == 0
+
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+import asyncio
+import contextvars
+import json
+import re
+
+import pytest
+
+from batching import MicroBatcher
+from recording import current_recorder
+from stubs import stub_agent
+
+marker = contextvars.ContextVar("marker", default=None)
+
+
+def _batcher(handler, **options):
+    calls = []
+
+    async def recording_handler(items):
+        calls.append(list(items))
+        return await handler(items)
+
+    return MicroBatcher(recording_handler, **options), calls
+
+
+async def _double(items):
+    return [item * 2 for item in items]
+
+
+def test_concurrent_submissions_share_one_call():
+    async def main():
+        batcher, calls = _batcher(_double, max_wait=0.05)
+        results = await asyncio.gather(*(batcher.submit(n) for n in range(5)))
+        return results, calls
+
+    results, calls = asyncio.run(main())
+    assert results == [0, 2, 4, 6, 8]
+    assert calls == [[0, 1, 2, 3, 4]]
+
+
+def test_full_batch_is_sent_without_waiting():
+    async def main():
+        batcher, calls = _batcher(_double, max_batch=2, max_wait=10)
+        results = await asyncio.wait_for(asyncio.gather(*(batcher.submit(n) for n in range(4))), 1)
+        return results, calls
+
+    results, calls = asyncio.run(main())
+    assert results == [0, 2, 4, 6]
+    assert calls == [[0, 1], [2, 3]]
+
+
+@pytest.mark.parametrize("result", [ValueError("unparseable"), [1]])
+def test_unusable_batch_falls_back_to_single_calls(result):
+    async def handler(items):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def fallback(item):
+        return -item
+
+    async def main():
+        batcher, _ = _batcher(handler, max_wait=0.01, fallback=fallback)
+        return await asyncio.gather(*(batcher.submit(n) for n in (1, 2, 3)))
+
+    assert asyncio.run(main()) == [-1, -2, -3]
+
+
+def test_other_errors_reach_every_caller():
+    async def handler(items):
+        raise RuntimeError("API down")
+
+    async def main():
+        batcher, _ = _batcher(handler, max_wait=0.01, fallback=_double)
+        return await asyncio.gather(*(batcher.submit(n) for n in (1, 2)), return_exceptions=True)
+
+    assert [type(result) for result in asyncio.run(main())] == [RuntimeError, RuntimeError]
+
+
+def test_batch_runs_outside_the_flushing_callers_context():
+    seen = []
+
+    async def handler(items):
+        seen.append(marker.get())
+        return items
+
+    async def caller(batcher, name, item):
+        marker.set(name)
+        return await batcher.submit(item)
+
+    async def main():
+        batcher, _ = _batcher(handler, max_batch=2)
+        return await asyncio.gather(caller(batcher, "first", 1), caller(batcher, "second", 2))
+
+    assert asyncio.run(main()) == [1, 2]
+    assert seen == [None]
+
+
+class Recorder:
+    def __init__(self):
+        self.llm = []
+
+    def record_llm(self, method, model, messages, content, latency, usage=None, error=None):
+        self.llm.append((method, content))
+
+    def record_cache_lookup(self, cache, key, value):
+        pass
+
+
+def test_attacks_from_several_sessions_are_scored_in_one_request():
+    def scores(messages):
+        count = len(re.findall(r'^\d+\. "', messages[-1]["content"], re.MULTILINE))
+        return json.dumps({"scores": [4 + number for number in range(count)]})
+
+    async def session(agent, attack):
+        recorder = Recorder()
+        current_recorder.set(recorder)
+        damage = await agent.estimate_attack_damage(20, 4, attack)
+        return damage, recorder
+
+    async def main():
+        agent = stub_agent()
+        agent.chat.answers["attack_scores"] = scores
+        try:
+            results = await asyncio.gather(*(session(agent, attack) for attack in
+                                             ("slash the ogre", "cast a fireball", "throw a dagger")))
+        finally:
+            await agent.close()
+        return agent.chat.requests, results
+
+    requests, results = asyncio.run(main())
+    assert requests == ["attack_scores"]
+    assert [damage for damage, _ in results] == [16.0, 20.0, 24.0]
+    # Each session recorded its own score, as replays ask for them one by one
+    assert [recorder.llm for _, recorder in results] == [
+        [("estimate_attack_damage", json.dumps({"damage_score": score}))] for score in (4, 5, 6)]
@@ -0,0 +1,53 @@
+import asyncio
+
+from metrics import Metrics, percentile
+from start_story import BATTLE_TARGET, CHARACTER, StorySystem
+from stubs import Context, message, stub_agent
+
+
+def test_first_round_is_prepared_while_the_player_describes_their_character():
+    async def main():
+        agent = stub_agent(latency=0.05)
+        story = StorySystem(agent, seed=3)
+        ctx = Context()
+        try:
+            await story.start_adventure(ctx, [], theme="a sunken city")
+            assert story.phase == CHARACTER  # the prompt doesn't wait for the bootstrap calls
+            await asyncio.sleep(0.5)  # the player is typing
+            assert story.prefetched_round.done()
+            assert "monster" in agent.chat.requests
+            before_reply = len(agent.chat.requests)
+
+            await story.handle(message(ctx, "a sea witch"))
+            while story.phase != BATTLE_TARGET:
+                await asyncio.sleep(0.01)
+            # Only the character itself was left to generate
+            assert agent.chat.requests[before_reply:] == ["character"]
+            assert story.prefetched_round is None
+            assert story.time_to_first_battle is not None
+        finally:
+            await story.close()
+            await agent.close()
+
+    asyncio.run(main())
+
+
+def test_metrics_summaries():
+    registry = Metrics(max_samples=3)
+    registry.incr("calls", method="story")
+    registry.incr("calls", 2, method="story")
+    registry.gauge("queue", 4)
+    for value in (5.0, 1.0, 3.0, 2.0):
+        registry.observe("wait", value)
+    assert registry.counter("calls", method="story") == 3
+    assert registry.summary("wait") == {"count": 3, "mean": 2.0, "p50": 2.0, "p95": 3.0, "max": 3.0}
+    assert registry.summary("missing") is None
+    report = registry.report()
+    assert "calls{method=story} = 3" in report and "queue = 4" in report and "wait: n=3" in report
+    assert Metrics().report() == "No metrics recorded yet."
+
+
+def test_percentile_is_nearest_rank():
+    assert percentile([], 50) == 0.0
+    assert percentile([4, 1, 3, 2], 50) == 2
+    assert percentile(list(range(1, 101)), 95) == 95
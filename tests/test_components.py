@@ -0,0 +1,118 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from components import SELECT, button_view, custom_id, parse_custom_id, select_view
+from metrics import metrics
+from sessions import SessionManager
+from start_story import BATTLE_TARGET, CHARACTER, FINISHED
+from stubs import Context, message, stub_agent
+
+
+def test_custom_id_round_trip():
+    value = custom_id(42, 7, "village_menu", "2")
+    assert value == "adv:42:7:village_menu:2"
+    assert parse_custom_id(value) == (42, 7, "village_menu", "2")
+    assert parse_custom_id(custom_id(42, 7, "shop", "a:b")) == (42, 7, "shop", "a:b")
+
+
+def test_foreign_custom_ids_are_not_parsed():
+    for value in ("", "adv:42:7:shop", "poll:42:7:shop:1", "adv:someone:7:shop:1", "adv:42:x:shop:1"):
+        assert parse_custom_id(value) is None
+
+
+def test_button_view():
+    view = button_view(5, 3, BATTLE_TARGET, [(str(i), f"{i}. goblin" + "!" * 100) for i in range(1, 31)],
+                       style=discord.ButtonStyle.danger)
+    buttons = view.children
+    assert len(buttons) == 25
+    assert [parse_custom_id(button.custom_id) for button in buttons[:2]] == [(5, 3, BATTLE_TARGET, "1"),
+                                                                             (5, 3, BATTLE_TARGET, "2")]
+    assert len(buttons[0].label) == 80 and buttons[0].style is discord.ButtonStyle.danger
+
+
+def test_select_view():
+    view = select_view(5, 4, "shop", [("1", "Sword (10 coins)"), ("back", "Nothing")], placeholder="Choose")
+    [select] = view.children
+    assert parse_custom_id(select.custom_id) == (5, 4, "shop", SELECT)
+    assert [(option.value, option.label) for option in select.options] == [("1", "Sword (10 coins)"),
+                                                                          ("back", "Nothing")]
+
+
+class ViewContext(Context):
+    """Keeps the views sent with prompts"""
+
+    def __init__(self, player: int = 5):
+        super().__init__(player)
+        self.views = []
+
+    async def send(self, content=None, view=None, **kwargs):
+        await super().send(content, **kwargs)
+        if view is not None:
+            self.views.append(view)
+
+
+class Response:
+    def __init__(self):
+        self.edits = []
+        self.messages = []
+
+    async def edit_message(self, **kwargs):
+        self.edits.append(kwargs)
+
+    async def send_message(self, content, ephemeral=False):
+        self.messages.append((content, ephemeral))
+
+
+def press(ctx, custom_id_, user=None, values=None):
+    return SimpleNamespace(data={"custom_id": custom_id_, "values": values or []},
+                           user=user or ctx.author, channel=ctx.channel, created_at=None, response=Response())
+
+
+async def _wait_until(condition, timeout=5.0):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_button_presses_reach_the_adventure_that_sent_them():
+    async def main():
+        agent = stub_agent()
+        manager = SessionManager(lambda: agent, page_out_after=0, components=True, encounters=False)
+        ctx = ViewContext()
+        try:
+            story = await manager.start(ctx, theme="a sunken city")
+            await _wait_until(lambda: story.phase == CHARACTER)
+            await manager.deliver(message(ctx, "a sea witch"))
+            await _wait_until(lambda: story.phase == BATTLE_TARGET)
+            turn = story.turn_number
+            first_target = ctx.views[-1].children[0].custom_id
+
+            assert not await manager.deliver_interaction(press(ctx, "poll:1"))
+
+            stranger = press(ctx, first_target, user=SimpleNamespace(id=99, name="someone", bot=False))
+            assert await manager.deliver_interaction(stranger)
+            assert stranger.response.messages == [("Those choices belong to another player's adventure.", True)]
+            assert story.turn_number == turn and not story.busy
+
+            stale = metrics.counter("discord.stale_interactions")
+            old = press(ctx, custom_id(ctx.author.id, turn - 1, BATTLE_TARGET, "1"))
+            assert await manager.deliver_interaction(old)
+            assert metrics.counter("discord.stale_interactions") == stale + 1
+            assert old.response.edits == [{"view": None}]
+            assert story.turn_number == turn
+
+            attack = press(ctx, first_target)
+            assert await manager.deliver_interaction(attack)
+            assert attack.response.edits == [{"view": None}]
+            await _wait_until(lambda: story.turn_number > turn or story.phase == FINISHED)
+            return metrics.counter("discord.stale_interactions") - stale
+        finally:
+            manager.sweeper.cancel()
+            await manager.end(ctx.author.id)
+            await agent.close()
+
+    assert asyncio.run(main()) == 1  # the attack itself was taken
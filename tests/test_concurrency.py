@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from concurrency import AdaptiveConcurrency, parse_seconds, retry_after
+
+
+def test_success_raises_limit_by_one_per_limits_worth():
+    limiter = AdaptiveConcurrency(initial=2.0, maximum=4.0)
+    for _ in range(2):
+        limiter.release(limiter.start(), "ok")
+    assert limiter.limit == pytest.approx(2.0 + 1 / 2.0 + 1 / 2.5)
+    for _ in range(50):
+        limiter.release(limiter.start(), "ok")
+    assert limiter.limit == 4.0
+    assert limiter.in_flight == 0
+
+
+def test_throttle_halves_limit_and_pauses():
+    limiter = AdaptiveConcurrency(initial=8.0, default_pause=0.5)
+    limiter.release(limiter.start(), "throttled")
+    assert limiter.limit == 4.0
+    assert not limiter.has_room()
+    assert 0 < limiter.wake_in() <= 0.5
+
+
+def test_retry_after_sets_the_pause():
+    limiter = AdaptiveConcurrency(initial=8.0, default_pause=5.0)
+    limiter.release(limiter.start(), "throttled", retry_after=0.0)
+    assert limiter.limit == 4.0
+    assert limiter.has_room()
+
+
+def test_burst_of_throttles_from_one_overshoot_decreases_once():
+    limiter = AdaptiveConcurrency(initial=8.0, default_pause=0.0)
+    granted = [limiter.start() for _ in range(4)]
+    time.sleep(0.001)
+    for grant in granted:
+        limiter.release(grant, "throttled")
+    assert limiter.limit == 4.0
+
+
+def test_limit_never_drops_below_minimum():
+    limiter = AdaptiveConcurrency(initial=2.0, minimum=1.0, default_pause=0.0)
+    for _ in range(3):
+        limiter.release(limiter.start(), "throttled")
+    assert limiter.limit == 1.0
+
+
+def test_errors_leave_the_limit_alone():
+    limiter = AdaptiveConcurrency(initial=3.0)
+    limiter.release(limiter.start(), "error")
+    limiter.release(limiter.start(), "cancelled")
+    assert limiter.limit == 3.0
+    assert limiter.in_flight == 0
+
+
+def test_retry_after_of_zero_is_not_missing():
+    assert retry_after({"retry-after": "0", "x-ratelimit-reset-requests": "30s"}) == 0.0
+    assert retry_after({"x-ratelimit-reset-requests": "1m30s"}) == 90.0
+    assert retry_after({}) is None
+
+
+def test_delay_formats():
+    assert parse_seconds("250ms") == 0.25
+    assert parse_seconds("2") == 2.0
+    assert parse_seconds("soon") is None
@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import pytest
+
+import battle as battle_module
+from battle import Battle
+from budget import CACHED
+from start_story import StorySystem
+from state import MemoryBackend
+from stubs import Context, play, stub_agent
+
+ENCOUNTER = {
+    "setting": "Flooded Crypt",
+    "narrative": "Water pours through the cracked vault as two drowned knights rise.",
+    "monsters": [{"name": "Drowned Knight", "hp": 60, "attack": 12, "defense": 6},
+                 {"name": "Goblin", "hp": 20, "attack": 5, "defense": 2}],
+}
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    backend = MemoryBackend()
+    monkeypatch.setattr(battle_module, "get_backend", lambda: backend)
+    return backend
+
+
+def _run(coro_fn):
+    async def main():
+        agent = stub_agent()
+        try:
+            return await coro_fn(agent), agent
+        finally:
+            await agent.close()
+
+    return asyncio.run(main())
+
+
+def test_battle_comes_from_one_encounter_call(pool):
+    story_info = ["a sunken city"]
+
+    async def generate(agent):
+        agent.chat.answers["encounter"] = lambda messages: json.dumps(ENCOUNTER)
+        battle = Battle(agent=agent)
+        return battle, await battle.generate_battle(story_info)
+
+    (battle, generated), agent = _run(generate)
+    assert agent.chat.requests == ["encounter"]
+    assert (generated["setting"], generated["storyline"]) == (ENCOUNTER["setting"], ENCOUNTER["narrative"])
+    assert [(monster.name, monster.current_hp) for monster in generated["monsters"]] == [("Drowned Knight", 60),
+                                                                                          ("Goblin", 20)]
+    # Only the new monster joins the bestiary and the shared pool
+    assert [template["name"] for template in battle.monster_templates].count("Goblin") == 1
+    assert ENCOUNTER["monsters"][0] in battle.monster_templates
+    assert asyncio.run(pool.members(Battle.POOL_KEY)) == [ENCOUNTER["monsters"][0]]
+    assert story_info[-1] == ENCOUNTER["narrative"]
+
+
+def test_failed_encounter_falls_back_to_the_bestiary(pool):
+    def fail(messages):
+        raise ConnectionError("no route")
+
+    async def generate(agent):
+        agent.chat.answers["encounter"] = fail
+        battle = Battle(agent=agent)
+        return battle, await battle.generate_battle([])
+
+    (battle, generated), agent = _run(generate)
+    assert agent.chat.requests == ["encounter"]
+    assert generated["storyline"] in battle.storylines
+    assert all(monster.name in {"Goblin", "Orc", "Dragon"} for monster in generated["monsters"])
+
+
+class CachedAgent:
+    """An agent over budget: any call is a test failure"""
+
+    def degradation_level(self):
+        return CACHED
+
+    async def generate_encounter(self, story_info, existing_templates):
+        raise AssertionError("no encounter once the budget is low")
+
+    async def generate_monster_template(self, templates, story_info):
+        raise AssertionError("no templates once the budget is low")
+
+
+def test_low_budget_composes_from_pooled_templates(pool):
+    pooled = [{"name": f"Pooled {index}", "hp": 30, "attack": 6, "defense": 3} for index in range(10)]
+
+    async def main():
+        for template in pooled:
+            await pool.push(Battle.POOL_KEY, template)
+        battle = Battle(agent=CachedAgent())
+        return battle, await battle.generate_battle([])
+
+    battle, generated = asyncio.run(main())
+    assert len(battle.monster_templates) == Battle.MIN_TEMPLATES
+    assert all(template in pooled for template in battle.monster_templates[3:])
+    assert 1 <= len(generated["monsters"]) <= 3
+
+
+def test_encounter_adventure_skips_template_and_story_calls(pool):
+    async def main():
+        agent = stub_agent()
+        agent.chat.answers["encounter"] = lambda messages: json.dumps(ENCOUNTER)
+        story = StorySystem(agent, seed=4)
+        story.encounters = True
+        ctx = Context()
+        try:
+            await story.start_adventure(ctx, [], theme="a sunken city")
+            await play(story, ctx)
+        finally:
+            await story.close()
+            await agent.close()
+        return ctx, agent.chat.requests
+
+    ctx, requests = asyncio.run(main())
+    assert "monster" not in requests
+    assert requests.count("encounter") >= 1
+    # Besides the theme header, the only free text is the ending
+    assert requests.count("text") <= 2
+    assert "\n" + ENCOUNTER["narrative"] in ctx.sent
+    assert "Location: Flooded Crypt" in ctx.sent
@@ -0,0 +1,120 @@
+import asyncio
+import sys
+from types import SimpleNamespace
+
+import discord
+import pytest
+from discord.ext import commands
+
+import fleet
+import supervisor
+from fleet import HEALTH_PREFIX, HealthReporter, fleet_health, format_fleet, shard_settings
+from state import MemoryBackend, WORKER_ID
+
+
+@pytest.fixture
+def shard_env(monkeypatch):
+    for name in ("SHARD_COUNT", "SHARD_IDS", "SHARDS"):
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+def test_shard_settings(shard_env):
+    assert shard_settings() is None
+    shard_env.setenv("SHARDS", "auto")
+    assert shard_settings() == (None, None)
+    shard_env.setenv("SHARD_COUNT", "4")
+    assert shard_settings() == (None, 4)
+    shard_env.setenv("SHARD_IDS", "1,3")
+    assert shard_settings() == ([1, 3], 4)
+
+
+def test_create_bot_shards_only_when_configured(shard_env):
+    intents = discord.Intents.default()
+    bot = fleet.create_bot("!", intents)
+    assert not isinstance(bot, commands.AutoShardedBot)
+    shard_env.setenv("SHARD_COUNT", "4")
+    shard_env.setenv("SHARD_IDS", "0,2")
+    bot = fleet.create_bot("!", intents)
+    assert isinstance(bot, commands.AutoShardedBot)
+    assert (bot.shard_ids, bot.shard_count) == ([0, 2], 4)
+
+
+def test_assign_shards_spreads_every_shard_once():
+    assert supervisor.assign_shards(2, 5) == [[0, 2, 4], [1, 3]]
+    assert supervisor.assign_shards(3, 3) == [[0], [1], [2]]
+    worker = supervisor.Worker(1, [1, 3], 4, {"STATE_BACKEND": "redis://x"})
+    assert worker.env == {"STATE_BACKEND": "redis://x", "WORKER_ID": "worker-1",
+                          "SHARD_IDS": "1,3", "SHARD_COUNT": "4"}
+
+
+def test_worker_is_restarted_until_stopping():
+    class ExitingWorker(supervisor.Worker):
+        async def start(self):
+            self.process = await asyncio.create_subprocess_exec(sys.executable, "-c", "raise SystemExit(3)")
+
+    async def main():
+        worker = ExitingWorker(0, [0], 1, {})
+        worker.backoff = 0.01
+        stopping = asyncio.Event()
+        task = asyncio.ensure_future(worker.supervise(stopping))
+        while worker.restarts < 2:
+            await asyncio.sleep(0.01)
+        stopping.set()
+        await asyncio.wait_for(task, 5)
+        return worker
+
+    worker = asyncio.run(main())
+    assert worker.restarts >= 2
+    assert worker.backoff == pytest.approx(0.01 * 2 ** worker.restarts)
+
+
+def _bot(latencies=None, latency=0.05, guilds=()):
+    return SimpleNamespace(latencies=latencies, latency=latency,
+                           guilds=[SimpleNamespace(shard_id=shard) for shard in guilds])
+
+
+def test_snapshot_counts_guilds_per_shard():
+    reporter = HealthReporter(_bot(latencies=[(0, 0.0421), (2, float("nan"))], guilds=[0, 2, 2, 2]),
+                              MemoryBackend(), sessions=lambda: 7)
+    snapshot = reporter.snapshot()
+    assert snapshot["worker"] == WORKER_ID
+    assert snapshot["sessions"] == 7
+    assert snapshot["shards"] == {"0": {"latency_ms": 42.1, "guilds": 1},
+                                  "2": {"latency_ms": None, "guilds": 3}}
+
+
+def test_snapshot_of_an_unsharded_bot():
+    snapshot = HealthReporter(_bot(latency=0.1, guilds=[None, None]), MemoryBackend(), lambda: 0).snapshot()
+    assert snapshot["shards"] == {"0": {"latency_ms": 100.0, "guilds": 2}}
+
+
+def test_published_health_is_read_back_and_expires():
+    async def main():
+        backend = MemoryBackend()
+        reporter = HealthReporter(_bot(), backend, lambda: 3, interval=0.02)
+        reporter.start()
+        await asyncio.sleep(0.01)
+        await backend.set(HEALTH_PREFIX + "aaa", {**reporter.snapshot(), "worker": "aaa"}, ttl=0.01)
+        reported = await fleet_health(backend)
+        await asyncio.sleep(0.02)
+        later = await fleet_health(backend)
+        reporter._task.cancel()
+        return reported, later
+
+    reported, later = asyncio.run(main())
+    assert [snapshot["worker"] for snapshot in reported] == sorted(["aaa", WORKER_ID])
+    assert [snapshot["worker"] for snapshot in later] == [WORKER_ID]
+    assert later[0]["sessions"] == 3
+
+
+def test_format_fleet():
+    assert format_fleet([]) == "No workers are reporting health."
+    snapshot = HealthReporter(_bot(latencies=[(0, 0.05), (1, 0.2)], guilds=[0, 1]),
+                              MemoryBackend(), lambda: 4).snapshot()
+    table = format_fleet([snapshot], expected=2).splitlines()
+    assert table[0].split() == ["worker", "shards", "guilds", "sessions", "latency", "loop", "p95", "rss", "MB", "age", "s"]
+    row = table[1].split()
+    assert row[1:5] == ["0,1", "2", "4", "200ms"]
+    assert table[2] == "1 of 2 workers are not reporting"
+    assert len(format_fleet([snapshot], expected=1).splitlines()) == 2
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+import bot as bot_module
+from gateway_sim import SimulatedGateway, SimulatedPlayer, install_canned_llm
+
+
+@pytest.fixture
+def fresh_bot(monkeypatch):
+    """bot.py's globals as before main(), so each test builds its own bot and agent on its own loop"""
+    monkeypatch.setenv("MISTRAL_API_KEY", "simulated")
+    for name in ("bot", "health", "admission", "sessions", "agent"):
+        monkeypatch.setattr(bot_module, name, None)
+    return bot_module
+
+
+def simulate(bot, users: int, buttons: bool = False):
+    """Play users adventures to the end through the bot's command handlers; returns the gateway and players"""
+    async def main():
+        agent = bot.get_agent()
+        install_canned_llm(agent, 0.005)
+        gateway = SimulatedGateway(bot.build_bot())
+        gateway.install()
+        guild = gateway.add_guild("guild")
+        players = [SimulatedPlayer(gateway, guild, number, think=0.0, seed=number, buttons=buttons)
+                   for number in range(users)]
+        try:
+            await asyncio.wait_for(asyncio.gather(*(player.play("a misty forest") for player in players)), 60)
+        finally:
+            gateway.close()
+            await agent.close()
+        return gateway, players
+
+    return asyncio.run(main())
+
+
+def test_simulated_players_finish_their_adventures(fresh_bot):
+    gateway, players = simulate(fresh_bot, users=4)
+    assert all(player.finished for player in players)
+    assert gateway.received >= 4 * 3  # !start, a character and at least one attack each
+    assert gateway.sent > gateway.received
+    assert gateway.interactions == 0
+
+
+def test_simulated_players_can_answer_with_buttons(fresh_bot):
+    gateway, players = simulate(fresh_bot, users=3, buttons=True)
+    assert all(player.finished for player in players)
+    assert gateway.interactions > 0
+    assert gateway.interaction_responses == gateway.interactions
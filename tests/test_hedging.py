@@ -0,0 +1,120 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from hedging import HedgePolicy
+from scheduler import INTERACTIVE
+from stubs import stub_agent
+
+IDLE = SimpleNamespace(queue_length=lambda: 0, concurrency=None)
+
+
+def test_delay_follows_the_observed_tail_once_known():
+    policy = HedgePolicy(percentile=90, min_delay=0.2, max_delay=5.0, initial_delay=2.0, min_samples=10, window=200)
+    for seconds in [0.5] * 8 + [1.0]:
+        policy.observe("story", seconds)
+    assert policy.delay("story") == 2.0
+    policy.observe("story", 1.0)
+    assert policy.delay("story") == 1.0
+    for seconds in [0.01] * 200:
+        policy.observe("story", seconds)
+    assert policy.delay("story") == 0.2
+    for seconds in [30] * 200:
+        policy.observe("story", seconds)
+    assert policy.delay("story") == 5.0
+    assert policy.delay("attack") == 2.0  # every method has its own history
+
+
+def test_hedges_are_rate_limited():
+    policy = HedgePolicy(max_rate=0.5, burst=1.0)
+    assert policy.allow(IDLE, "story")
+    assert not policy.allow(IDLE, "story")
+    policy.request()
+    assert not policy.allow(IDLE, "story")
+    policy.request()
+    assert policy.allow(IDLE, "story")
+
+
+@pytest.mark.parametrize("scheduler", [
+    SimpleNamespace(queue_length=lambda: 1, concurrency=None),
+    SimpleNamespace(queue_length=lambda: 0, concurrency=SimpleNamespace(has_room=lambda: False)),
+])
+def test_no_hedge_while_the_scheduler_is_busy(scheduler):
+    policy = HedgePolicy(burst=1.0)
+    assert not policy.allow(scheduler, "story")
+    assert policy.credit == 1.0
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv("HEDGE_REQUESTS", raising=False)
+    assert HedgePolicy.from_env() is None
+    monkeypatch.setenv("HEDGE_REQUESTS", "1")
+    monkeypatch.setenv("HEDGE_MIN_DELAY", "0.5")
+    monkeypatch.setenv("HEDGE_MODEL", "mistral-small-latest")
+    policy = HedgePolicy.from_env()
+    assert (policy.percentile, policy.min_delay, policy.max_rate, policy.model) == (95.0, 0.5, 0.1, "mistral-small-latest")
+
+
+class SlowFirstChat:
+    """The first request takes first_latency seconds, later ones latency; records models and cancellations"""
+
+    def __init__(self, first_latency, latency=0.01):
+        self.latencies = [first_latency]
+        self.latency = latency
+        self.models = []
+        self.cancelled = []
+
+    async def complete_async(self, model, messages, **options):
+        index = len(self.models)
+        self.models.append(model)
+        try:
+            await asyncio.sleep(self.latencies[index] if index < len(self.latencies) else self.latency)
+        except asyncio.CancelledError:
+            self.cancelled.append(index)
+            raise
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"answer {index}"))], usage=None)
+
+
+def _hedging_agent(chat, **policy):
+    agent = stub_agent()
+    agent.hedging = HedgePolicy(initial_delay=0.05, **policy)
+    for endpoint in agent.keys.endpoints:
+        endpoint._client = SimpleNamespace(chat=chat)
+    return agent
+
+
+def _complete(agent):
+    async def main():
+        try:
+            response = await agent._complete([{"role": "user", "content": "hit"}], priority=INTERACTIVE, method="test")
+            await asyncio.sleep(0.05)  # let the cancelled copy unwind
+            return response.choices[0].message.content
+        finally:
+            await agent.close()
+
+    return asyncio.run(main())
+
+
+def test_slow_request_is_raced_and_the_loser_cancelled():
+    chat = SlowFirstChat(first_latency=2.0)
+    agent = _hedging_agent(chat, model="mistral-small-latest")
+    assert _complete(agent) == "answer 1"
+    assert chat.models == ["mistral-large-latest", "mistral-small-latest"]
+    assert chat.cancelled == [0]
+    assert agent.keys.endpoints[0].concurrency.in_flight == 0
+    assert len(agent.hedging.latencies["test"]) == 2  # the winner's and the abandoned original's
+
+
+def test_fast_request_is_not_hedged():
+    chat = SlowFirstChat(first_latency=0.01)
+    agent = _hedging_agent(chat)
+    assert _complete(agent) == "answer 0"
+    assert chat.models == ["mistral-large-latest"]
+
+
+def test_slow_request_waits_without_credit():
+    chat = SlowFirstChat(first_latency=0.2)
+    agent = _hedging_agent(chat, burst=0.0)
+    assert _complete(agent) == "answer 0"
+    assert len(chat.models) == 1 and chat.cancelled == []
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from key_pool import Endpoint, KeyPool, failure_status
+from transport import TransportSettings
+
+
+def _endpoint(name="a", **kwargs):
+    return Endpoint(name, "key", "http://127.0.0.1:1", transport=TransportSettings(), **kwargs)
+
+
+def test_endpoint_is_ejected_after_consecutive_errors_for_doubling_times():
+    endpoint = _endpoint(eject_after=2, eject_time=10, max_eject_time=25)
+    endpoint.finished("error")
+    assert endpoint.healthy()
+    endpoint.finished("error")
+    assert not endpoint.healthy()
+    assert endpoint.ejected_until - time.monotonic() == pytest.approx(10, abs=1)
+
+    endpoint.ejected_until = 0.0  # the ejection has run out; the next error ejects again, for longer
+    endpoint.finished("error")
+    assert endpoint.ejected_until - time.monotonic() == pytest.approx(20, abs=1)
+    endpoint.ejected_until = 0.0
+    endpoint.finished("error")
+    assert endpoint.ejected_until - time.monotonic() == pytest.approx(25, abs=1)
+    assert endpoint.usage["ejections"] == 3
+
+
+def test_success_restores_the_endpoint_and_its_backoff():
+    endpoint = _endpoint(eject_after=2, eject_time=10)
+    for _ in range(2):
+        endpoint.finished("error")
+    endpoint.ejected_until = 0.0
+    endpoint.finished("ok")
+    assert (endpoint.failures, endpoint.ejections) == (0, 0)
+    endpoint.finished("error")
+    assert endpoint.healthy()  # the count of consecutive errors starts over
+
+
+def test_throttling_and_rejections_never_eject():
+    endpoint = _endpoint(eject_after=1)
+    for status in ("throttled", "rejected", "throttled"):
+        endpoint.finished(status)
+    assert endpoint.healthy()
+    assert endpoint.failures == 0
+
+
+@pytest.mark.parametrize("status_code, expected", [
+    (429, "throttled"), (400, "rejected"), (422, "rejected"), (401, "error"), (403, "error"),
+    (500, "error"), (None, "error"),
+])
+def test_failure_status(status_code, expected):
+    assert failure_status(SimpleNamespace(status_code=status_code)) == expected
+
+
+def test_pool_prefers_the_endpoint_with_most_quota_left():
+    first, second = _endpoint("first"), _endpoint("second")
+    pool = KeyPool([first, second])
+    first.concurrency.quota, first.concurrency.window_remaining = 100, 10
+    first.concurrency.window_reset = second.concurrency.window_reset = time.monotonic() + 60
+    second.concurrency.quota, second.concurrency.window_remaining = 100, 50
+    lease = pool.start()
+    assert lease.endpoint is second
+    pool.release(lease)
+    assert second.usage["ok"] == 1
+
+    second.ejected_until = time.monotonic() + 60
+    assert pool.start().endpoint is first
+
+
+def test_pool_has_room_while_any_endpoint_does():
+    first, second = _endpoint("first", initial_concurrency=1), _endpoint("second", initial_concurrency=1)
+    pool = KeyPool([first, second])
+    leases = [pool.start(), pool.start()]
+    assert {lease.endpoint.name for lease in leases} == {"first", "second"}
+    assert not pool.has_room()
+    pool.release(leases[0], "error")
+    assert pool.has_room()
+
+
+def test_waiting_pool_wakes_when_an_ejection_ends():
+    async def main():
+        endpoint = _endpoint()
+        pool = KeyPool([endpoint])
+        endpoint.ejected_until = time.monotonic() + 0.05
+        start = time.monotonic()
+        await asyncio.wait_for(pool.wait_for_slot(), 2)
+        return time.monotonic() - start
+
+    assert 0.04 <= asyncio.run(main()) < 1
+
+
+def test_pool_needs_an_endpoint():
+    with pytest.raises(ValueError):
+        KeyPool([])
+
+
+def test_completion_headers_feed_the_limiter():
+    async def main():
+        changes = []
+        endpoint = _endpoint(on_change=lambda: changes.append(1))
+        headers = {"x-ratelimit-remaining-requests": "7", "x-ratelimit-limit-requests": "60"}
+        for path in ("/v1/models", "/v1/chat/completions"):
+            request = httpx.Request("POST", "http://127.0.0.1:1" + path)
+            await endpoint._observe_response(httpx.Response(200, headers=headers, request=request))
+        return endpoint.concurrency, changes
+
+    limiter, changes = asyncio.run(main())
+    assert (limiter.window_remaining, limiter.quota) == (7, 60)
+    assert changes == [1]  # the warm-up ping's headers were ignored
+
+
+@pytest.fixture
+def mistral_env(monkeypatch):
+    for name in ("MISTRAL_ENDPOINTS", "MISTRAL_API_KEYS", "MISTRAL_SERVER_URL"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("MISTRAL_API_KEY", "default-key1")
+    return monkeypatch
+
+
+def test_from_env_uses_the_single_key(mistral_env):
+    pool = KeyPool.from_env()
+    assert [endpoint.name for endpoint in pool.endpoints] == ["key…key1"]
+    assert pool.endpoints[0].http.base_url == "https://api.mistral.ai"
+
+
+def test_from_env_spreads_over_keys(mistral_env):
+    mistral_env.setenv("MISTRAL_API_KEYS", "aaaa1111, bbbb2222,")
+    mistral_env.setenv("MISTRAL_SERVER_URL", "http://localhost:8000")
+    pool = KeyPool.from_env()
+    assert [endpoint.name for endpoint in pool.endpoints] == ["localhost:8000/key…1111", "localhost:8000/key…2222"]
+    assert [endpoint.http.api_key for endpoint in pool.endpoints] == ["aaaa1111", "bbbb2222"]
+
+
+def test_from_env_endpoints_with_and_without_keys(mistral_env):
+    mistral_env.setenv("MISTRAL_API_KEYS", "ignored")
+    mistral_env.setenv("MISTRAL_ENDPOINTS", "http://one:8001, own-key9@http://two:8002")
+    pool = KeyPool.from_env()
+    assert [(endpoint.http.api_key, endpoint.server_url) for endpoint in pool.endpoints] == [
+        ("default-key1", "http://one:8001"), ("own-key9", "http://two:8002")]
+    assert pool.endpoints[1].name == "two:8002/key…key9"
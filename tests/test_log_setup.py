@@ -0,0 +1,80 @@
+import atexit
+import json
+import logging
+import sys
+
+import pytest
+
+import log_setup
+from log_setup import SamplingFilter, StructuredFormatter, _parse_pairs
+
+
+def _record(message="Scored %s", args=("slash",), **extra):
+    record = logging.LogRecord("agent", logging.INFO, __file__, 1, message, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_text_lines_keep_extra_fields():
+    line = StructuredFormatter().format(_record(event="attack.scored", guild=3))
+    assert line.endswith("INFO    agent: Scored slash event=attack.scored guild=3")
+
+
+def test_json_lines_keep_extra_fields_and_exceptions():
+    try:
+        raise ValueError("bad score")
+    except ValueError:
+        record = logging.LogRecord("agent", logging.ERROR, __file__, 1, "failed", (), sys.exc_info())
+    record.method = "estimate_attack_damage"
+    entry = json.loads(StructuredFormatter(json_lines=True).format(record))
+    assert entry["level"] == "ERROR" and entry["message"] == "failed"
+    assert entry["method"] == "estimate_attack_damage"
+    assert "ValueError: bad score" in entry["exception"]
+
+
+def test_sampling_keeps_one_in_n_of_an_event():
+    sampler = SamplingFilter({"attack.response": 0.25, "noisy": 0})
+    kept = [record for record in (_record(event="attack.response") for _ in range(8)) if sampler.filter(record)]
+    assert len(kept) == 2 and all(record.sampled == 4 for record in kept)
+    assert not sampler.filter(_record(event="noisy"))
+    assert sampler.filter(_record(event="other")) and sampler.filter(_record())
+
+
+def test_pairs():
+    assert _parse_pairs("agent=DEBUG, discord.gateway = WARNING,junk") == {"agent": "DEBUG",
+                                                                          "discord.gateway": "WARNING"}
+    assert _parse_pairs(None) == {}
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    if log_setup._listener is not None:
+        atexit.unregister(log_setup._listener.stop)
+        log_setup._listener.stop()
+        log_setup._listener = None
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    logging.getLogger("test.quiet").setLevel(logging.NOTSET)
+
+
+def test_records_are_written_by_the_listener_thread(tmp_path, restore_logging):
+    path = tmp_path / "bot.log"
+    listener = log_setup.setup_logging(level="INFO", module_levels={"test.quiet": "WARNING"}, json_lines=True,
+                                       sample_rates={}, log_file=str(path))
+    assert log_setup.setup_logging() is listener
+    inventory = ["sword"]
+    logging.getLogger("test.loud").info("Inventory: %s", inventory, extra={"event": "inventory"})
+    inventory.append("shield")  # arguments are merged when logging, not when written
+    logging.getLogger("test.quiet").info("not shown")
+    atexit.unregister(listener.stop)
+    listener.stop()
+    log_setup._listener = None
+
+    entries = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(entry["message"], entry["event"]) for entry in entries] == [("Inventory: ['sword']", "inventory")]
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import pytest
+
+from battle import Battle
+from budget import NORMAL
+from pipeline import Pipeline
+
+
+async def _after(seconds, value):
+    await asyncio.sleep(seconds)
+    return value
+
+
+def test_independent_steps_overlap_and_dependents_get_results():
+    pipeline = Pipeline("test")
+    pipeline.add("header", lambda: _after(0.1, "header"))
+    pipeline.add("monsters", lambda: _after(0.1, ["goblin"]))
+    pipeline.add("battle", lambda header, monsters: f"{header}: {monsters[0]}", deps=["header", "monsters"])
+
+    start = time.perf_counter()
+    results = asyncio.run(pipeline.run())
+    assert time.perf_counter() - start < 0.18
+    assert results == {"header": "header", "monsters": ["goblin"], "battle": "header: goblin"}
+    assert pipeline.critical_path()[-1] == "battle"
+    assert "critical path" in pipeline.timing_report()
+
+
+def test_steps_can_be_awaited_before_the_run_finishes():
+    async def main():
+        pipeline = Pipeline("test")
+        pipeline.add("fast", lambda: _after(0.01, 1))
+        pipeline.add("slow", lambda: _after(0.2, 2))
+        run = pipeline.start()
+        assert await pipeline.result("fast") == 1
+        assert not run.done()
+        assert await run == {"fast": 1, "slow": 2}
+
+    asyncio.run(main())
+
+
+def test_a_failing_step_cancels_the_rest():
+    async def fail():
+        raise RuntimeError("boom")
+
+    async def main():
+        pipeline = Pipeline("test")
+        pipeline.add("slow", lambda: _after(5, None))
+        pipeline.add("broken", fail)
+        with pytest.raises(RuntimeError):
+            await pipeline.run()
+        await asyncio.sleep(0)
+        assert pipeline.tasks["slow"].cancelled()
+
+    asyncio.run(main())
+
+
+def test_steps_must_be_added_after_their_dependencies():
+    pipeline = Pipeline("test")
+    with pytest.raises(ValueError):
+        pipeline.add("battle", lambda header: None, deps=["header"])
+    pipeline.add("header", lambda: None)
+    with pytest.raises(ValueError):
+        pipeline.add("header", lambda: None)
+
+
+class SlowBestiaryAgent:
+    def __init__(self):
+        self.calls = 0
+
+    def degradation_level(self, guild=None):
+        return NORMAL
+
+    async def generate_monster_template(self, existing, story_info):
+        self.calls += 1
+        number = self.calls
+        await asyncio.sleep(0.05)
+        return {"name": f"Monster {number}", "hp": 30, "attack": 6, "defense": 3}
+
+
+def test_bestiary_is_filled_with_concurrent_calls():
+    agent = SlowBestiaryAgent()
+    battle = Battle(agent)
+    start = time.perf_counter()
+    asyncio.run(battle.fill_bestiary(["a forest"]))
+    assert len(battle.monster_templates) == Battle.MIN_TEMPLATES
+    assert agent.calls == Battle.MIN_TEMPLATES - 3
+    assert time.perf_counter() - start < 0.05 * agent.calls
@@ -0,0 +1,41 @@
+import asyncio
+import os
+import tracemalloc
+
+import profiling
+
+
+def test_memory_tracing_reports_and_stops(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+
+    async def main():
+        assert "Started tracemalloc" in await profiling.snapshot_memory()
+        assert tracemalloc.is_tracing()
+        blocks = [bytearray(1024) for _ in range(100)]
+        assert "Top allocation sites" in await profiling.snapshot_memory()
+        assert "Growth since last snapshot" in await profiling.snapshot_memory()
+        assert profiling.stop_memory_tracing() == "Stopped tracemalloc."
+        assert not tracemalloc.is_tracing() and profiling._last_snapshot is None
+        return blocks
+
+    asyncio.run(main())
+    assert any(name.endswith(".snapshot") for name in os.listdir(tmp_path))
+
+
+def test_memory_tracing_stops_after_its_window():
+    async def main():
+        await profiling.snapshot_memory(window=0.05)
+        assert tracemalloc.is_tracing()
+        await asyncio.sleep(0.1)
+        assert not tracemalloc.is_tracing()
+
+    asyncio.run(main())
+
+
+def test_cpu_profile_writes_its_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    for mode in ("sample", "cprofile"):
+        summary = asyncio.run(profiling.profile_cpu(0.1, mode=mode))
+        assert summary.startswith("Wrote ")
+    extensions = sorted(name.rsplit(".", 1)[1] for name in os.listdir(tmp_path))
+    assert "collapsed" in extensions and "pstats" in extensions and "txt" in extensions
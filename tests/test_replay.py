@@ -0,0 +1,78 @@
+import asyncio
+import time
+from collections import Counter
+
+import pytest
+
+import replay
+from admission import AdmissionControl
+from recording import SessionRecorder
+from start_story import StorySystem
+from stubs import Context, play, stub_agent
+
+
+async def _record(path, components=False, admission=None, ctx=None):
+    agent = stub_agent()
+    story = StorySystem(agent, seed=7, recorder=SessionRecorder(path))
+    story.components = components
+    ctx = ctx or Context()
+    try:
+        await story.start_adventure(ctx, [], theme="a haunted forest", admission=admission)
+        await play(story, ctx)
+    finally:
+        await story.close()
+        await agent.close()
+
+
+@pytest.mark.parametrize("components", [False, True])
+def test_recorded_session_replays_the_same_way(tmp_path, monkeypatch, components):
+    monkeypatch.setenv("MISTRAL_API_KEY", "test")
+    path = str(tmp_path / "session.jsonl")
+    asyncio.run(_record(path, components))
+    recorded = replay.load_session(path)
+    assert recorded["components"] is components
+
+    result = asyncio.run(replay.replay_session(path, speed=100))
+    assert result["llm_misses"] == {}
+    assert result["diverged_at"] is None
+    assert result["messages"] == result["recorded_messages"] > 0
+    assert result["llm_calls"] == dict(Counter(entry["method"] for entry in recorded["llm"]))
+
+
+def test_misses_do_not_eject_the_endpoint(monkeypatch):
+    monkeypatch.setenv("MISTRAL_API_KEY", "test")
+    session = {"llm": [], "cache": []}
+
+    async def main():
+        agent = replay.ReplayAgent(session, speed=100)
+        try:
+            start = time.monotonic()
+            for _ in range(5):
+                with pytest.raises(replay.ReplayMiss):
+                    await agent._complete([{"role": "user", "content": "hello"}], method="chat")
+            assert time.monotonic() - start < 2
+            assert all(endpoint.healthy() for endpoint in agent.keys.endpoints)
+        finally:
+            await agent.close()
+        assert agent.scheduler._dispatcher is None
+        assert agent.misses["chat"] == 5
+
+    asyncio.run(main())
+
+
+def test_queue_notices_stay_out_of_the_recording(tmp_path, monkeypatch):
+    monkeypatch.setenv("MISTRAL_API_KEY", "test")
+    path = str(tmp_path / "session.jsonl")
+    ctx = Context()
+
+    async def main():
+        control = AdmissionControl(max_sessions=1, max_bootstraps=0)
+        running = await control.admit("someone else")
+        asyncio.get_running_loop().call_later(0.05, running.release)
+        await _record(path, admission=control, ctx=ctx)
+
+    asyncio.run(main())
+    assert "in line" in ctx.sent[0]
+    assert not any("in line" in str(content) for content in replay.load_session(path)["outputs"])
+    result = asyncio.run(replay.replay_session(path, speed=100))
+    assert result["diverged_at"] is None
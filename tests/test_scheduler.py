@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+
+from scheduler import BACKGROUND, INTERACTIVE, STORY, DeadlineExceeded, LLMScheduler
+
+
+async def _grant_order(scheduler, requests):
+    """Names of requests (name, priority, guild) in the order the scheduler grants them,
+    all queued before the first grant"""
+    order = []
+
+    async def request(name, priority, guild):
+        await scheduler.acquire(priority, guild=guild)
+        order.append(name)
+
+    await asyncio.gather(*(request(*r) for r in requests))
+    return order
+
+
+def test_guilds_share_a_priority_class_fairly():
+    scheduler = LLMScheduler(min_interval=0.01)
+    order = asyncio.run(_grant_order(scheduler, [
+        ("a1", STORY, "busy"), ("a2", STORY, "busy"), ("a3", STORY, "busy"), ("b1", STORY, "quiet"),
+    ]))
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_guild_weights_scale_the_share():
+    scheduler = LLMScheduler(min_interval=0.01, guild_weights={"big": 2.0})
+    order = asyncio.run(_grant_order(scheduler, [
+        ("s1", STORY, "small"), ("s2", STORY, "small"),
+        ("b1", STORY, "big"), ("b2", STORY, "big"), ("b3", STORY, "big"),
+    ]))
+    assert order == ["b1", "s1", "b2", "b3", "s2"]
+
+
+def test_guilds_are_forgotten_once_served():
+    scheduler = LLMScheduler(min_interval=0.0)
+    asyncio.run(_grant_order(scheduler, [(f"r{guild}", STORY, guild) for guild in range(50)]))
+    assert scheduler.last_finish[STORY] == {}
+
+
+def test_more_urgent_class_goes_first():
+    scheduler = LLMScheduler(min_interval=0.01)
+    order = asyncio.run(_grant_order(scheduler, [
+        ("prefetch", BACKGROUND, "g"), ("story", STORY, "g"), ("attack", INTERACTIVE, "g"),
+    ]))
+    assert order == ["attack", "story", "prefetch"]
+
+
+def test_expired_deadline_is_dropped_before_queueing():
+    scheduler = LLMScheduler(min_interval=0.01)
+
+    async def main():
+        await scheduler.acquire(STORY, guild="g", deadline=time.monotonic() - 1)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(main())
+    assert scheduler.queue_length() == 0
+
+
+def test_deadline_passing_in_the_queue_drops_the_request():
+    scheduler = LLMScheduler(min_interval=0.01)
+
+    async def main():
+        scheduler.next_slot = time.monotonic() + 0.3  # nothing is granted for a while
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.acquire(STORY, guild="g", deadline=time.monotonic() + 0.05)
+        assert scheduler.queue_length() == 0
+        await scheduler.acquire(STORY, guild="g")  # the dispatcher carries on
+
+    asyncio.run(main())
+
+
+def test_rate_limit_token_is_kept_when_no_request_is_left():
+    class Bucket:
+        taken = 0
+
+        async def acquire(self):
+            self.taken += 1
+            await asyncio.sleep(0.2)
+
+    bucket = Bucket()
+    scheduler = LLMScheduler(min_interval=0.01, rate_limiter=bucket)
+
+    async def main():
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.acquire(STORY, guild="g", deadline=time.monotonic() + 0.05)
+        await asyncio.sleep(0.3)
+        await scheduler.acquire(STORY, guild="g")
+
+    asyncio.run(main())
+    assert bucket.taken == 1
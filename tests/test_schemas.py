@@ -0,0 +1,59 @@
+import json
+import random
+
+from schemas import ATTACK_SCORE, ATTACK_SCORES, MONSTER, load_json, parse
+
+
+def test_valid_response_is_kept():
+    result = parse(json.dumps({"name": "Goblin", "hp": 30, "attack": 5, "defense": 3}), MONSTER, "test")
+    assert result.outcome == "ok"
+    assert result.data == {"name": "Goblin", "hp": 30, "attack": 5, "defense": 3}
+
+
+def test_out_of_range_and_missing_fields_are_repaired():
+    result = parse(json.dumps({"name": "Giant", "hp": 10_000, "attack": 5}), MONSTER, "test", random.Random(1))
+    assert result.parsed and result.outcome == "repaired"
+    assert result.data["name"] == "Giant"
+    assert result.data["hp"] == 150
+    assert set(result.repaired) == {"hp", "defense"}
+    assert isinstance(result.data["defense"], int)
+
+
+def test_json_is_found_inside_fences_and_prose():
+    content = 'Here you go:\n```json\n{"name": "Ogre", "hp": 80, "attack": 9, "defense": 4}\n```'
+    assert load_json(content)["name"] == "Ogre"
+    assert parse(content, MONSTER, "test").outcome == "ok"
+
+
+def test_scalars_are_salvaged_from_broken_json():
+    result = parse('{"name": "Wraith", "hp": 60, "attack": ', MONSTER, "test", random.Random(1))
+    assert result.parsed
+    assert result.data["name"] == "Wraith" and result.data["hp"] == 60
+    assert "attack" in result.repaired
+
+
+def test_unusable_response_falls_back_to_defaults():
+    first = parse("I cannot help with that.", MONSTER, "test", random.Random(3))
+    second = parse("I cannot help with that.", MONSTER, "test", random.Random(3))
+    assert not first.parsed and first.outcome == "failed"
+    assert first.data == second.data  # the fallback draws from the rng it is given
+    assert 20 <= first.data["hp"] <= 150
+
+
+def test_repaired_list_items_are_reported_by_index():
+    result = parse(json.dumps({"scores": [4, "lots", 7]}), ATTACK_SCORES, "test")
+    assert "scores[1]" in result.repaired
+    assert "scores[0]" not in result.repaired and "scores[2]" not in result.repaired
+
+
+def test_non_finite_numbers_are_repaired():
+    for content in ('{"damage_score": 1e999}', '{"damage_score": -1e999}', '{"damage_score": Infinity}',
+                    '{"damage_score": NaN}', '{"damage_score": "1e999"}', '{"damage_score": "nan"}'):
+        result = parse(content, ATTACK_SCORE, "test", random.Random(1))
+        assert result.parsed and result.repaired == ["damage_score"], content
+        assert 3 <= result.data["damage_score"] <= 10
+
+
+def test_huge_integers_are_clamped():
+    result = parse('{"damage_score": 1%s}' % ("0" * 400), ATTACK_SCORE, "test")
+    assert result.data["damage_score"] == 10
@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+import pytest
+
+from pipeline import Pipeline
+from scheduler import DeadlineExceeded, INTERACTIVE
+from session_scope import SessionScope, current_deadline, current_scope, remaining, turn_deadline
+from sessions import SessionManager
+from start_story import CHARACTER, FINISHED
+from stubs import Context, message, stub_agent
+
+
+def test_nested_deadlines_only_shorten():
+    assert remaining() is None and remaining(5.0) == 5.0
+    with turn_deadline(1.0):
+        assert 0.9 < remaining() <= 1.0
+        assert remaining(0.5) == 0.5
+        with turn_deadline(10.0):
+            assert remaining() <= 1.0
+        with turn_deadline(0.1):
+            assert remaining() <= 0.1
+        assert remaining() > 0.5
+    assert current_deadline.get() is None
+
+
+def test_remaining_is_never_negative():
+    with turn_deadline(-1.0):
+        assert remaining() == 0.0
+
+
+def test_cancel_stops_every_task_once():
+    async def main():
+        scope = SessionScope("test")
+        seen = []
+
+        async def work():
+            seen.append(current_scope.get())
+            await asyncio.sleep(10)
+
+        tasks = [scope.spawn(work()) for _ in range(3)]
+        finished = scope.spawn(asyncio.sleep(0))
+        await asyncio.sleep(0.01)
+        assert finished not in scope.tasks  # done tasks are forgotten
+        assert scope.cancel("ended")
+        assert not scope.cancel("expired")
+        await asyncio.gather(*tasks, return_exceptions=True)
+        late = scope.spawn(asyncio.sleep(10))
+        await asyncio.sleep(0)
+        return scope, seen, [task.cancelled() for task in tasks], late.cancelled()
+
+    scope, seen, cancelled, late = asyncio.run(main())
+    assert seen == [scope] * 3
+    assert cancelled == [True] * 3
+    assert late
+    assert scope.reason == "ended"
+
+
+def test_close_spares_the_calling_task():
+    async def main():
+        scope = SessionScope()
+        other = scope.spawn(asyncio.sleep(10))
+
+        async def finish():
+            return scope.close()
+
+        closing = scope.spawn(finish())
+        cancelled = await closing
+        await asyncio.sleep(0)
+        return cancelled, other.cancelled(), scope
+
+    cancelled, other, scope = asyncio.run(main())
+    assert cancelled == 1 and other
+    assert not scope.cancelled  # close() only tidies up; the session wasn't stopped
+
+
+def test_pipeline_steps_are_cancelled_with_their_session():
+    async def main():
+        scope = SessionScope()
+        pipeline = Pipeline("round").add("slow", lambda: asyncio.sleep(10)).add("after", lambda slow: slow, ["slow"])
+
+        async def prefetch():
+            pipeline.start()
+
+        await scope.spawn(prefetch())
+        scope.cancel()
+        await asyncio.sleep(0.01)
+        return [task.cancelled() for task in pipeline.tasks.values()], pipeline.done()
+
+    cancelled, done = asyncio.run(main())
+    assert cancelled == [True, True]
+    assert done
+
+
+def test_agent_call_stops_at_the_turn_deadline():
+    async def main():
+        agent = stub_agent(latency=5.0)
+        start = time.monotonic()
+        try:
+            with turn_deadline(0.1), pytest.raises(DeadlineExceeded):
+                await agent._complete([{"role": "user", "content": "hi"}], priority=INTERACTIVE, method="test")
+            # Nothing is sent once the deadline has passed
+            with turn_deadline(0.0), pytest.raises(DeadlineExceeded):
+                await agent._complete([{"role": "user", "content": "hi"}], priority=INTERACTIVE, method="test")
+            return time.monotonic() - start, agent.keys.endpoints[0].concurrency.in_flight, len(agent.chat.requests)
+        finally:
+            await agent.close()
+
+    elapsed, in_flight, requests = asyncio.run(main())
+    assert elapsed < 1
+    assert in_flight == 0
+    assert requests == 1
+
+
+def test_end_cancels_the_work_in_flight():
+    async def main():
+        agent = stub_agent(latency=5.0)
+        manager = SessionManager(lambda: agent, page_out_after=0, components=False)
+        ctx = Context()
+        try:
+            story = await manager.start(ctx, theme="a sunken city")
+            while story.phase != CHARACTER:
+                await asyncio.sleep(0.01)
+            await manager.deliver(message(ctx, "a sea witch"))
+            await asyncio.sleep(0.05)  # the character and the first round are being generated
+            busy = agent.keys.endpoints[0].concurrency.in_flight
+            start = time.monotonic()
+            assert await manager.end(ctx.author.id)
+            await asyncio.sleep(0.05)
+            return story, ctx, busy, time.monotonic() - start, agent.keys.endpoints[0].concurrency.in_flight
+        finally:
+            manager.sweeper.cancel()
+            await agent.close()
+
+    story, ctx, busy, elapsed, in_flight = asyncio.run(main())
+    assert busy > 0
+    assert in_flight == 0 and elapsed < 1
+    assert story.phase == FINISHED and story.scope.reason == "ended"
+    assert all(task.done() for task in story.scope.tasks)
+    assert ctx.sent[-1].startswith("Your adventure concludes")
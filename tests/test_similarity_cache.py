@@ -0,0 +1,44 @@
+from similarity_cache import SimilarityCache, jaccard, normalize, shingles
+
+
+def test_rephrasing_with_filler_words_is_an_exact_hit():
+    cache = SimilarityCache("test-exact")
+    cache.put("Swing my sword at the goblin!", 7)
+    assert cache.get("swing sword goblin") == 7
+
+
+def test_fuzzy_hit_depends_on_threshold():
+    stored, asked = "fireball the dragon", "fireballs dragon"
+    similarity = jaccard(shingles(normalize(stored)), shingles(normalize(asked)))
+    assert 0 < similarity < 1
+
+    lenient = SimilarityCache("test-lenient", threshold=similarity - 0.01)
+    lenient.put(stored, 9)
+    assert lenient.get(asked) == 9
+
+    strict = SimilarityCache("test-strict", threshold=similarity + 0.01)
+    strict.put(stored, 9)
+    assert strict.get(asked) is None
+
+
+def test_unrelated_text_misses():
+    cache = SimilarityCache("test-miss")
+    cache.put("cast a healing spell", 3)
+    assert cache.get("kick the door down") is None
+
+
+def test_expired_entries_miss():
+    cache = SimilarityCache("test-ttl", ttl=0.0)
+    cache.put("stab", 5)
+    assert cache.get("stab") is None
+    assert not cache.entries
+
+
+def test_least_recently_used_is_evicted():
+    cache = SimilarityCache("test-lru", max_entries=2)
+    cache.put("first attack", 1)
+    cache.put("second attack", 2)
+    cache.get("first attack")
+    cache.put("third attack", 3)
+    assert cache.get("first attack") == 1
+    assert cache.get("second attack") is None
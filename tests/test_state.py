@@ -0,0 +1,83 @@
+import asyncio
+
+from state import RedisBackend
+
+
+def _backend(port, prefix):
+    return RedisBackend("127.0.0.1", port, prefix=prefix)
+
+
+def test_round_trip(redis_port):
+    async def main():
+        backend = _backend(redis_port, "test-round-trip:")
+        try:
+            await backend.set("game:1", {"phase": "battle", "round": 2})
+            assert await backend.get("game:1") == {"phase": "battle", "round": 2}
+            assert await backend.get("missing") is None
+            await backend.push("log", "a")
+            await backend.push("log", "b")
+            await backend.push("log", "c", max_len=2)
+            assert await backend.members("log") == ["b", "c"]
+            assert sorted(await backend.keys("game:")) == ["game:1"]
+            await backend.delete("game:1")
+            assert await backend.get("game:1") is None
+            await backend.set("short", 1, ttl=0.05)
+            await asyncio.sleep(0.1)
+            assert await backend.get("short") is None
+        finally:
+            await backend.close()
+
+    asyncio.run(main())
+
+
+def test_token_bucket(redis_port):
+    async def main():
+        backend = _backend(redis_port, "test-bucket:")
+        try:
+            assert await backend.take_token("bucket", 1.0, 2) == 0.0
+            assert await backend.take_token("bucket", 1.0, 2) == 0.0
+            assert await backend.take_token("bucket", 1.0, 2) > 0
+        finally:
+            await backend.close()
+
+    asyncio.run(main())
+
+
+async def _cancel_mid_call(coroutine, steps):
+    task = asyncio.ensure_future(coroutine)
+    for _ in range(steps):
+        await asyncio.sleep(0)  # let the command go out without its reply being read
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def test_cancelled_call_does_not_leave_its_reply_for_the_next(redis_port):
+    async def main():
+        backend = _backend(redis_port, "test-cancel:")
+        try:
+            await backend.set("a", "A")
+            await backend.set("b", "B")
+            await _cancel_mid_call(backend.get("a"), 2)
+            assert await backend.get("b") == "B"
+            assert await backend.get("a") == "A"
+        finally:
+            await backend.close()
+
+    asyncio.run(main())
+
+
+def test_cancelled_token_take_does_not_leave_the_connection_in_a_transaction(redis_port):
+    async def main():
+        backend = _backend(redis_port, "test-cancel-bucket:")
+        try:
+            await backend.set("b", "B")
+            await _cancel_mid_call(backend.take_token("bucket", 1000.0, 10), 6)
+            assert await backend.get("b") == "B"
+            assert await backend.take_token("bucket", 1000.0, 10) == 0.0
+        finally:
+            await backend.close()
+
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+import story_arc
+from start_story import StorySystem
+from stubs import Context, play, stub_agent
+
+ARC = {
+    "title": "The Drowned Crown",
+    "antagonist": "the tide witch",
+    "beats": [{"setting": "the harbour", "milestone": "Smugglers speak of the witch."},
+              {"setting": "the reef", "milestone": "You find her shrine."},
+              {"setting": "the sunken palace", "milestone": "The crown is within reach."}],
+    "ending": "The sea grows calm.",
+}
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("llm", story_arc.LLM), (" Local ", story_arc.LOCAL), ("off", story_arc.OFF), ("", story_arc.OFF),
+    (None, story_arc.OFF), ("sometimes", story_arc.OFF),
+])
+def test_mode(value, expected):
+    assert story_arc.mode(value) == expected
+
+
+def test_rounds_past_the_outline_carry_on():
+    assert story_arc.beat(ARC, 1) == ARC["beats"][1]
+    assert story_arc.beat(ARC, 5) == {"setting": "the sunken palace",
+                                      "milestone": "The tide witch still has servants to send against you."}
+
+
+def test_context_holds_the_gist_and_the_beats():
+    assert story_arc.context(ARC, 0) == ["Adventure: The Drowned Crown. Antagonist: the tide witch.",
+                                         "Now, at the harbour: Smugglers speak of the witch."]
+    assert story_arc.context(ARC, 2)[1:] == ["Previously: You find her shrine.",
+                                             "Now, at the sunken palace: The crown is within reach."]
+
+
+def test_narrate_cycles_through_the_templates():
+    narrations = [story_arc.narrate(ARC, index) for index in range(len(story_arc.TEMPLATES) + 1)]
+    assert narrations[0] == "Your path leads to the harbour. Smugglers speak of the witch."
+    assert len(set(narrations[:len(story_arc.TEMPLATES)])) == len(story_arc.TEMPLATES)
+    assert narrations[-1].startswith("Your path leads to the sunken palace.")
+
+
+def test_default_arc_is_a_whole_outline():
+    arc = story_arc.default_arc(random.Random(1))
+    assert arc["title"] and arc["antagonist"] and arc["ending"]
+    assert len(arc["beats"]) >= 3 and all(beat["setting"] and beat["milestone"] for beat in arc["beats"])
+
+
+def _adventure(mode, encounters=False, answers=None):
+    async def main():
+        agent = stub_agent()
+        agent.chat.answers.update(answers or {})
+        agent.chat.answers["story_arc"] = lambda messages: json.dumps(ARC)
+        story = StorySystem(agent, seed=4)
+        story.arc_mode = mode
+        story.encounters = encounters
+        ctx = Context()
+        try:
+            await story.start_adventure(ctx, [], theme="a sunken city")
+            await play(story, ctx, character="a sea witch hunter", attack="1 strike with the trident")
+        finally:
+            await story.close()
+            await agent.close()
+        return story, ctx, agent.chat.requests
+
+    return asyncio.run(main())
+
+
+def test_local_arc_narrates_without_story_calls():
+    story, ctx, requests = _adventure(story_arc.LOCAL, encounters=True)
+    assert story.arc == ARC
+    assert requests.count("story_arc") == 1
+    assert requests.count("text") == 1  # the theme header; every beat came from a template
+    assert "encounter" not in requests
+    assert "\n" + story_arc.narrate(ARC, 0) in ctx.sent
+
+
+def test_llm_arc_expands_each_beat_from_the_outline_alone():
+    prompts = []
+
+    def story_text(messages):
+        prompts.append(messages[-1]["content"])
+        return "A beat unfolds."
+
+    story, ctx, requests = _adventure(story_arc.LLM, answers={"text": story_text})
+    beats = prompts[1:]  # after the theme header
+    assert beats and story.round > 1
+    assert all("The Drowned Crown" in prompt and "a sunken city" not in prompt for prompt in beats)
+    assert "the harbour" in beats[0]
+    assert ARC["ending"] in ctx.sent
@@ -0,0 +1,49 @@
+import json
+
+import story_arc
+from battle import Monster
+from start_story import StorySystem
+from user import make_random_user
+
+
+def _mid_battle_story() -> StorySystem:
+    story = StorySystem(None, seed=42)
+    story.player_id, story.channel_id, story.guild = 7, 70, 700
+    story.session_id, story.session_key = "s-1", "session:7"
+    story.phase = "battle_target"
+    story.round, story.battle_turn, story.turn_number = 2, 3, 9
+    story.user = make_random_user(story.rng)
+    story.battle = {"setting": "a ruined keep", "storyline": "Bones rattle in the dark.",
+                    "monsters": [Monster("Skeleton", 30, 6, 3), Monster("Wight", 55, 9, 5)]}
+    story.battle["monsters"][0].current_hp = 12
+    story.story_details = ["You entered the keep."]
+    story.story_info = ["keep"]
+    story.arc_mode = story_arc.LOCAL
+    story.arc = story_arc.default_arc(story.rng)
+    story.battle_system.rng.random()
+    return story
+
+
+def test_record_survives_json_and_restores_the_same_state():
+    story = _mid_battle_story()
+    record = story.to_record()
+    restored = StorySystem.from_record(json.loads(json.dumps(record)))
+    assert restored.to_record() == record
+    assert restored.battle["monsters"][0].current_hp == 12
+    assert restored.user.to_dict() == story.user.to_dict()
+
+
+def test_restored_adventure_draws_the_same_randomness():
+    story = _mid_battle_story()
+    restored = StorySystem.from_record(json.loads(json.dumps(story.to_record())))
+    for original, copy in ((story.rng, restored.rng), (story.battle_system.rng, restored.battle_system.rng),
+                           (story.village.rng, restored.village.rng)):
+        assert [original.random() for _ in range(5)] == [copy.random() for _ in range(5)]
+
+
+def test_records_from_before_story_arcs_still_load():
+    record = _mid_battle_story().to_record()
+    for key in ("arc_mode", "arc", "encounters"):
+        del record[key]
+    restored = StorySystem.from_record(json.loads(json.dumps(record)))
+    assert restored.arc_mode == story_arc.OFF and restored.arc is None and not restored.encounters
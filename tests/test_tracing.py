@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import pytest
+
+import trace_report
+import tracing
+from start_story import StorySystem
+from stubs import Context, play, stub_agent
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracing.configure(str(path))
+    yield path
+    tracing.configure(None)
+
+
+def _spans(path):
+    tracing._exporter.flush()
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_spans_carry_session_turn_and_parent(trace_file):
+    async def main():
+        session = tracing.start_session()
+        tracing.start_turn(1)
+        with tracing.span("battle.turn", round=1) as outer:
+            with tracing.span("llm.call", method="story"):
+                await asyncio.sleep(0.01)
+            outer.set(monsters=2)
+        with pytest.raises(ValueError):
+            with tracing.span("broken"):
+                raise ValueError("boom")
+        tracing.record("player.wait", 1500.0)
+        return session
+
+    session = asyncio.run(main())
+    spans = {entry["span"]: entry for entry in _spans(trace_file)}
+    assert {entry["session"] for entry in spans.values()} == {session}
+    assert spans["llm.call"]["turn"] == f"{session}:1"
+    assert spans["llm.call"]["parent"] == spans["battle.turn"]["id"]
+    assert spans["llm.call"]["duration_ms"] >= 10
+    assert spans["battle.turn"]["attrs"] == {"round": 1, "monsters": 2}
+    assert spans["broken"]["error"] == "ValueError"
+    assert spans["player.wait"]["duration_ms"] == 1500.0
+
+
+def test_spans_are_free_when_tracing_is_off():
+    tracing.configure(None)
+    with tracing.span("anything") as current:
+        current.set(ignored=True)
+    assert not tracing.enabled()
+
+
+def test_report_on_a_traced_adventure(trace_file):
+    async def main():
+        agent = stub_agent()
+        story = StorySystem(agent, seed=11)
+        ctx = Context()
+        try:
+            await story.start_adventure(ctx, [], theme="a desert")
+            await play(story, ctx)
+        finally:
+            await story.close()
+            await agent.close()
+        return story.session_id
+
+    session = asyncio.run(main())
+    spans = trace_report.load_spans(str(trace_file), session)
+    assert spans and all(entry["session"] == session for entry in spans)
+    assert "llm.call" in trace_report.phase_table(spans)
+    slowest = trace_report.slowest_turns(spans, 3).splitlines()
+    assert 0 < len(slowest) <= 3
+    assert all("excluding player wait" in line and "player.wait" not in line for line in slowest)
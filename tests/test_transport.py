@@ -0,0 +1,115 @@
+import asyncio
+
+import transport
+from metrics import metrics
+from mistral_standin import MistralStandIn
+from transport import TransportSettings, WarmClient
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv("HTTP_MAX_CONNECTIONS", "8")
+    monkeypatch.setenv("HTTP_KEEPALIVE_EXPIRY", "30")
+    monkeypatch.setenv("HTTP_PREWARM", "0")
+    monkeypatch.setenv("HTTP_PING_INTERVAL", "0")
+    settings = TransportSettings.from_env()
+    assert (settings.max_connections, settings.keepalive_expiry, settings.prewarm, settings.ping_interval) == (8, 30.0, 0, 0.0)
+    assert (settings.max_keepalive, settings.timeout, settings.http2) == (16, 120.0, False)
+
+
+def test_http2_needs_the_h2_package(monkeypatch):
+    monkeypatch.setenv("HTTP2", "1")
+    monkeypatch.setattr(transport.importlib.util, "find_spec", lambda name: None)
+    assert TransportSettings.from_env().http2 is False
+
+
+async def _standin():
+    runner = await MistralStandIn(latency=0.01).start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def test_warm_connections_are_reused():
+    async def main():
+        runner, url = await _standin()
+        client = WarmClient("warm-test", url, "key", settings=TransportSettings(prewarm=2, ping_interval=0))
+        try:
+            await client.warm()
+            warmed = metrics.counter("http.requests", endpoint="warm-test", connection="new")
+            responses = await asyncio.gather(*(client.client.post(url + "/v1/chat/completions", json={"messages": []})
+                                               for _ in range(2)))
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return warmed, responses
+
+    warmed, responses = asyncio.run(main())
+    assert warmed == 2
+    assert [response.status_code for response in responses] == [200, 200]
+    assert metrics.counter("http.requests", endpoint="warm-test", connection="new") == 2
+    assert metrics.counter("http.requests", endpoint="warm-test", connection="reused") == 2
+    assert metrics.summary("http.server_time", endpoint="warm-test")["count"] == 4
+    assert metrics.summary("http.warm_time", endpoint="warm-test")["count"] == 1
+
+
+def test_warming_an_unreachable_server_only_logs():
+    async def main():
+        client = WarmClient("warm-down", "http://127.0.0.1:1", None, settings=TransportSettings(prewarm=1))
+        try:
+            await client.warm()
+            await client.warm(0)
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+    assert metrics.counter("http.failures", endpoint="warm-down") == 1
+    assert metrics.summary("http.warm_time", endpoint="warm-down")["count"] == 1
+
+
+def test_idle_client_is_pinged_until_closed():
+    async def main():
+        runner, url = await _standin()
+        client = WarmClient("ping-test", url, "key", settings=TransportSettings(ping_interval=0.05))
+        try:
+            client.start_pings()
+            await asyncio.sleep(0.3)
+            await client.close()
+            assert client._pinger is None
+            pings = metrics.counter("http.idle_pings", endpoint="ping-test")
+            await asyncio.sleep(0.1)
+        finally:
+            await runner.cleanup()
+        return pings
+
+    pings = asyncio.run(main())
+    assert pings >= 2
+    assert metrics.counter("http.idle_pings", endpoint="ping-test") == pings
+
+
+def test_no_pings_when_turned_off():
+    async def main():
+        client = WarmClient("ping-off", None, None, settings=TransportSettings(ping_interval=0))
+        client.start_pings()
+        assert client._pinger is None
+        assert client.base_url == transport.MISTRAL_API_URL
+        await client.close()
+
+    asyncio.run(main())
+
+
+def test_caller_hooks_see_the_request_timer():
+    async def main():
+        runner, url = await _standin()
+        seen = []
+
+        async def hook(request):
+            seen.append("trace" in request.extensions)
+
+        client = WarmClient("hooks", url, None, event_hooks={"request": [hook]}, settings=TransportSettings())
+        try:
+            await client.warm(1)
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return seen
+
+    assert asyncio.run(main()) == [True]
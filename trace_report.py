@@ -0,0 +1,83 @@
+"""Summarise a span file written with TRACE_FILE set.
+
+Usage: python trace_report.py traces.jsonl [--slowest N] [--session ID]
+
+Prints latency percentiles per phase, then the slowest turns with a per-phase breakdown.
+Turn times exclude the time spent waiting for the player to type."""
+import argparse
+import json
+from collections import defaultdict
+
+from metrics import percentile
+
+# Spans that measure the player rather than the bot
+WAIT_SPANS = {"player.wait"}
+TURN_SPANS = {"battle.setup", "battle.turn", "village.turn"}
+
+
+def load_spans(path, session=None):
+    spans = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if session is None or entry.get("session") == session:
+                spans.append(entry)
+    return spans
+
+
+def phase_table(spans):
+    durations = defaultdict(list)
+    for entry in spans:
+        durations[entry["span"]].append(entry["duration_ms"])
+    lines = [f"{'phase':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'total s':>10}"]
+    for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        lines.append(f"{name:<28}{len(values):>7}{percentile(values, 50):>10.1f}{percentile(values, 95):>10.1f}"
+                     f"{percentile(values, 99):>10.1f}{max(values):>10.1f}{sum(values) / 1000:>10.2f}")
+    return "\n".join(lines)
+
+
+def slowest_turns(spans, limit):
+    by_turn = defaultdict(list)
+    for entry in spans:
+        if entry.get("turn"):
+            by_turn[entry["turn"]].append(entry)
+
+    turns = []
+    for turn_id, entries in by_turn.items():
+        turn_spans = [entry for entry in entries if entry["span"] in TURN_SPANS]
+        if not turn_spans:
+            continue
+        total = sum(entry["duration_ms"] for entry in turn_spans)
+        waiting = sum(entry["duration_ms"] for entry in entries if entry["span"] in WAIT_SPANS)
+        phases = defaultdict(float)
+        for entry in entries:
+            if entry["span"] not in TURN_SPANS and entry["span"] not in WAIT_SPANS:
+                phases[entry["span"]] += entry["duration_ms"]
+        turns.append((total - waiting, turn_id, turn_spans[0]["span"], phases))
+
+    lines = []
+    for active, turn_id, kind, phases in sorted(turns, key=lambda turn: turn[0], reverse=True)[:limit]:
+        breakdown = ", ".join(f"{name} {ms:.0f}ms" for name, ms in sorted(phases.items(), key=lambda item: -item[1]))
+        lines.append(f"{turn_id} ({kind}): {active:.0f}ms excluding player wait -- {breakdown}")
+    return "\n".join(lines) if lines else "No turns recorded."
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="JSONL file written by tracing.py")
+    parser.add_argument("--slowest", type=int, default=10, help="how many of the slowest turns to show")
+    parser.add_argument("--session", help="only include spans from this session id")
+    args = parser.parse_args()
+
+    spans = load_spans(args.path, args.session)
+    print(f"{len(spans)} spans from {len({entry.get('session') for entry in spans})} sessions\n")
+    print(phase_table(spans))
+    print(f"\nSlowest {args.slowest} turns:")
+    print(slowest_turns(spans, args.slowest))
+
+
+if __name__ == "__main__":
+    main()
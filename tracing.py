@@ -0,0 +1,172 @@
+import atexit
+import contextvars
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+# Correlation ids, set once per adventure and once per turn; every span records them
+current_session = contextvars.ContextVar("trace_session", default=None)
+current_turn = contextvars.ContextVar("trace_turn", default=None)
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+
+class SpanExporter:
+    """Appends finished spans to a JSONL file, buffering writes so the event loop
+    only touches the disk every flush_every spans or flush_interval seconds"""
+
+    def __init__(self, path: str, flush_every: int = 100, flush_interval: float = 5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def export(self, record: dict):
+        self.buffer.append(json.dumps(record, default=str))
+        if len(self.buffer) >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            with open(self.path, "a") as f:
+                f.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+
+_exporter = None
+_configured = False
+
+
+def configure(path: Optional[str]):
+    """Export spans to path; None or "" turns tracing off. Defaults to the TRACE_FILE env var."""
+    global _exporter, _configured
+    if _exporter is not None:
+        _exporter.flush()
+    _exporter = SpanExporter(path) if path else None
+    _configured = True
+
+
+def enabled() -> bool:
+    if not _configured:
+        configure(os.getenv("TRACE_FILE"))
+    return _exporter is not None
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def start_session(session_id: Optional[str] = None) -> str:
+    """Start correlating spans under a new session id (one per adventure)"""
+    session_id = session_id or new_id()
+    current_session.set(session_id)
+    current_turn.set(None)
+    return session_id
+
+
+def start_turn(number) -> str:
+    """Mark the start of a new turn of the current session"""
+    turn_id = f"{current_session.get()}:{number}"
+    current_turn.set(turn_id)
+    return turn_id
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "attrs", "start", "start_time")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.span_id = new_id()
+        self.parent_id = _current_span.get()
+        self.attrs = attrs
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block of sync or async code as one phase of the current turn"""
+    if not enabled():
+        yield _NOOP
+        return
+    current = Span(name, attrs)
+    token = _current_span.set(current.span_id)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        entry = {
+            "session": current_session.get(),
+            "turn": current_turn.get(),
+            "span": name,
+            "id": current.span_id,
+            "parent": current.parent_id,
+            "start": current.start_time,
+            "duration_ms": round((time.perf_counter() - current.start) * 1000, 3),
+        }
+        if error:
+            entry["error"] = error
+        if current.attrs:
+            entry["attrs"] = current.attrs
+        _exporter.export(entry)
+
+
+def record(name: str, duration_ms: float, **attrs):
+    """Export a span whose duration was measured elsewhere (e.g. gateway lag from a message timestamp)"""
+    if not enabled():
+        return
+    entry = {
+        "session": current_session.get(),
+        "turn": current_turn.get(),
+        "span": name,
+        "id": new_id(),
+        "parent": _current_span.get(),
+        "start": time.time() - duration_ms / 1000,
+        "duration_ms": round(duration_ms, 3),
+    }
+    if attrs:
+        entry["attrs"] = attrs
+    _exporter.export(entry)
+
+
+def message_lag_ms(message) -> Optional[float]:
+    """Milliseconds since Discord created this message, or None for messages without a timestamp"""
+    created_at = getattr(message, "created_at", None)
+    if created_at is None:
+        return None
+    return (datetime.now(timezone.utc) - created_at).total_seconds() * 1000
+
+
+class TracedContext:
+    """Wraps a discord command context so that every send is recorded as a span"""
+
+    def __init__(self, ctx):
+        self._ctx = ctx
+
+    def __getattr__(self, name):
+        return getattr(self._ctx, name)
+
+    async def send(self, *args, **kwargs):
+        with span("discord.send"):
+            return await self._ctx.send(*args, **kwargs)
@@ -0,0 +1,174 @@
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MISTRAL_API_URL = "https://api.mistral.ai"
+
+
+class TransportSettings:
+    """Connection pool and keep-alive settings for the LLM clients, from the environment:
+    HTTP_MAX_CONNECTIONS (40; at least the largest concurrency limit), HTTP_MAX_KEEPALIVE (16
+    idle connections kept), HTTP_KEEPALIVE_EXPIRY (120s), HTTP2 (1 to multiplex requests over
+    one connection; needs the h2 package), HTTP_CONNECT_TIMEOUT (10s), HTTP_TIMEOUT (120s),
+    HTTP_PREWARM (2 connections opened on startup) and HTTP_PING_INTERVAL (45s; 0 turns the
+    idle pings off)"""
+
+    def __init__(self, max_connections: int = 40, max_keepalive: int = 16, keepalive_expiry: float = 120.0,
+                 http2: bool = False, connect_timeout: float = 10.0, timeout: float = 120.0, prewarm: int = 2,
+                 ping_interval: float = 45.0):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.prewarm = prewarm
+        self.ping_interval = ping_interval
+
+    @classmethod
+    def from_env(cls) -> "TransportSettings":
+        http2 = os.getenv("HTTP2", "0") == "1"
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP2=1 but the h2 package isn't installed; using HTTP/1.1")
+            http2 = False
+        return cls(max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "40")),
+                   max_keepalive=int(os.getenv("HTTP_MAX_KEEPALIVE", "16")),
+                   keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "120")),
+                   http2=http2,
+                   connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")),
+                   timeout=float(os.getenv("HTTP_TIMEOUT", "120")),
+                   prewarm=int(os.getenv("HTTP_PREWARM", "2")),
+                   ping_interval=float(os.getenv("HTTP_PING_INTERVAL", "45")))
+
+
+class _RequestTimer:
+    """Collects httpcore trace events for one request and splits its time into connection
+    setup, waiting for a pooled connection, server time and the rest"""
+
+    __slots__ = ("endpoint", "started", "marks", "done")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.marks = {}
+        self.done = False
+
+    def _span(self, name) -> float:
+        started, complete = self.marks.get(name + ".started"), self.marks.get(name + ".complete")
+        return complete - started if started is not None and complete is not None else 0.0
+
+    def _mark(self, suffix) -> Optional[float]:
+        # http11.* or http2.*, depending on the connection
+        for name, at in self.marks.items():
+            if name.endswith(suffix):
+                return at
+        return None
+
+    async def trace(self, name: str, info: Dict):
+        self.marks[name] = time.perf_counter()
+        if not self.done and (name.endswith("response_closed.complete") or name.endswith(".failed")):
+            self.done = True
+            self.record(failed=name.endswith(".failed"))
+
+    def record(self, failed: bool = False):
+        total = time.perf_counter() - self.started
+        new_connection = "connection.connect_tcp.started" in self.marks
+        connect = self._span("connection.connect_tcp") + self._span("connection.start_tls")
+        metrics.incr("http.requests", endpoint=self.endpoint, connection="new" if new_connection else "reused")
+        if failed:
+            metrics.incr("http.failures", endpoint=self.endpoint)
+            return
+        metrics.observe("http.connect_time", connect, endpoint=self.endpoint)
+        sending = self._mark("send_request_headers.started")
+        sent, first_byte = self._mark("send_request_body.complete"), self._mark("receive_response_headers.complete")
+        if sending is not None:
+            # Time before the request could go out that wasn't spent connecting: pool contention
+            metrics.observe("http.pool_wait", max(0.0, sending - self.started - connect), endpoint=self.endpoint)
+        if sent is not None and first_byte is not None:
+            server = first_byte - sent
+            metrics.observe("http.server_time", server, endpoint=self.endpoint)
+            metrics.observe("http.transport_time", total - server, endpoint=self.endpoint)
+
+
+class WarmClient:
+    """The HTTP side of one LLM endpoint: an httpx.AsyncClient with explicit pool limits and
+    keep-alive, per-request timing (http.connect_time, http.pool_wait, http.server_time and
+    http.transport_time, labelled by endpoint), and warm-up requests. warm() opens connections
+    before players need them; start_pings() then keeps one from idling out whenever nothing
+    else has used the client for ping_interval seconds. Warm-ups and pings list the models,
+    which costs no tokens."""
+
+    def __init__(self, name: str, base_url: Optional[str], api_key: Optional[str],
+                 event_hooks: Optional[Dict[str, List]] = None, settings: Optional[TransportSettings] = None):
+        self.name = name
+        self.base_url = (base_url or MISTRAL_API_URL).rstrip("/")
+        self.api_key = api_key
+        self.settings = settings or TransportSettings.from_env()
+        hooks = {"request": [self._on_request], "response": []}
+        for event, callbacks in (event_hooks or {}).items():
+            hooks[event] = hooks.get(event, []) + list(callbacks)
+        self.client = httpx.AsyncClient(
+            follow_redirects=True,
+            http2=self.settings.http2,
+            limits=httpx.Limits(max_connections=self.settings.max_connections,
+                                max_keepalive_connections=self.settings.max_keepalive,
+                                keepalive_expiry=self.settings.keepalive_expiry),
+            timeout=httpx.Timeout(self.settings.timeout, connect=self.settings.connect_timeout),
+            event_hooks=hooks,
+        )
+        self.last_used = 0.0
+        self._pinger = None
+
+    async def _on_request(self, request: httpx.Request):
+        self.last_used = time.monotonic()
+        request.extensions["trace"] = _RequestTimer(self.name).trace
+
+    async def _ping(self) -> bool:
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        try:
+            response = await self.client.get(f"{self.base_url}/v1/models", headers=headers)
+            await response.aclose()
+            return True
+        except httpx.HTTPError as e:
+            logger.debug("Warm-up request to %s failed: %s", self.name, e)
+            return False
+
+    async def warm(self, connections: Optional[int] = None):
+        """Open connections (TCP and TLS) now, so the first calls don't pay for them"""
+        connections = self.settings.prewarm if connections is None else connections
+        if connections <= 0:
+            return
+        start = time.perf_counter()
+        results = await asyncio.gather(*(self._ping() for _ in range(connections)))
+        metrics.observe("http.warm_time", time.perf_counter() - start, endpoint=self.name)
+        logger.info("Warmed %d/%d connections to %s in %.2fs", sum(results), connections, self.name,
+                    time.perf_counter() - start)
+
+    def start_pings(self):
+        if self._pinger is None and self.settings.ping_interval > 0:
+            self._pinger = asyncio.ensure_future(self._ping_idle())
+
+    async def _ping_idle(self):
+        interval = self.settings.ping_interval
+        while True:
+            idle = time.monotonic() - self.last_used
+            if idle < interval:
+                await asyncio.sleep(interval - idle)
+                continue
+            if await self._ping():
+                metrics.incr("http.idle_pings", endpoint=self.name)
+
+    async def close(self):
+        if self._pinger is not None:
+            self._pinger.cancel()
+            self._pinger = None
+        await self.client.aclose()
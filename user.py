@@ -1,9 +1,14 @@
 import json
+import logging
 import os
 import random
 
+from schemas import parse, CHARACTER
+
 USER_DATA_FILE = "users.json"
 
+logger = logging.getLogger(__name__)
+
 class User:
     def __init__(self, user_id: int, name: str, character_class: str, level: int = 1):
         self.user_id = user_id
@@ -37,6 +42,25 @@ class User:
         """Display user stats."""
         return f"Name: {self.name}\nClass: {self.character_class}\nLevel: {self.level}\nStats: {self.stats}\nInventory: {self.inventory}"
 
+    def to_dict(self) -> dict:
+        """JSON-serialisable copy of the character, for saving a paused adventure"""
+        data = {"user_id": self.user_id, "name": self.name, "character_class": self.character_class,
+                "level": self.level, "stats": dict(self.stats), "inventory": list(self.inventory),
+                "abilities": list(self.abilities)}
+        if hasattr(self, "background"):
+            data["background"] = self.background
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "User":
+        user = cls(data["user_id"], data["name"], data["character_class"], data["level"])
+        user.stats = dict(data["stats"])
+        user.inventory = list(data["inventory"])
+        user.abilities = list(data["abilities"])
+        if "background" in data:
+            user.background = data["background"]
+        return user
+
 
 # def load_users():
 #     """Load users from a JSON file."""
@@ -51,8 +75,8 @@ class User:
 #     with open(USER_DATA_FILE, "w") as f:
 #         json.dump(users, f, indent=4)
 
-def make_random_user():
-    """Generate a random user for testing purposes."""
+def make_random_user(rng=random):
+    """Generate a random user for testing purposes. rng defaults to the global random module."""
     
     # Random name generation
     first_names = ["Alex", "Jordan", "Morgan", "Sam", "Taylor", "Casey", "Quinn", "Riley", "Sage", "Avery"]
@@ -62,10 +86,10 @@ def make_random_user():
     character_classes = ["Warrior", "Mage", "Rogue", "Cleric"]
     
     # Generate random components
-    user_id = random.randint(10000, 99999)
-    name = f"{random.choice(first_names)} {random.choice(last_names)}"
-    character_class = random.choice(character_classes)
-    level = random.randint(1, 5)  # Random starting level between 1-5
+    user_id = rng.randint(10000, 99999)
+    name = f"{rng.choice(first_names)} {rng.choice(last_names)}"
+    character_class = rng.choice(character_classes)
+    level = rng.randint(1, 5)  # Random starting level between 1-5
     
     # Create the user
     user = User(user_id, name, character_class, level)
@@ -81,9 +105,9 @@ def make_random_user():
     # Adjust stats based on class preference
     preferred_stats = class_stat_preferences[character_class]
     for stat in user.stats:
-        base_value = random.randint(8, 12)  # Base random stat
+        base_value = rng.randint(8, 12)  # Base random stat
         if stat in preferred_stats:
-            base_value += random.randint(2, 4)  # Bonus for class-preferred stats
+            base_value += rng.randint(2, 4)  # Bonus for class-preferred stats
         user.stats[stat] = min(20, base_value)  # Cap at 20
     
     # Add some random starting items
@@ -99,9 +123,9 @@ def make_random_user():
     ]
     
     # Add 2-4 random items
-    num_items = random.randint(2, 4)
+    num_items = rng.randint(2, 4)
     for _ in range(num_items):
-        user.add_item(random.choice(possible_items))
+        user.add_item(rng.choice(possible_items))
     
     # Add some basic abilities based on class
     class_abilities = {
@@ -111,7 +135,7 @@ def make_random_user():
         "Cleric": ["Heal", "Smite", "Bless"]
     }
     
-    user.abilities = random.sample(class_abilities[character_class], 2)
+    user.abilities = rng.sample(class_abilities[character_class], 2)
     
     return user
 
@@ -132,52 +156,35 @@ def make_random_user():
 #     # save_users(users)
 #     return new_user
 
-def parse_character_json(json_string):
+def parse_character_json(json_string, rng=random):
     """
     Parses a JSON string containing character data and returns a User object.
     
     Args:
-        json_string (str): JSON string containing character data
+        json_string (str or dict): JSON string containing character data, or the parsed data
+        rng: Random number generator used for the user ID and fallbacks
         
     Returns:
         User: A fully initialized User object based on the JSON data
     """
     try:
-        import json
-        import random
-        
-        # Debug prints
-        print("Received JSON string type:", type(json_string))
-        print("JSON string length:", len(str(json_string)) if json_string else 0)
+        logger.debug("Parsing character JSON", extra={"event": "character.parse", "input_type": type(json_string).__name__,
+                                                      "length": len(str(json_string)) if json_string else 0})
         
         # Check if the string is empty or None
         if not json_string:
-            print("Empty JSON string received, creating random user")
-            return make_random_user()
+            logger.warning("Empty character JSON received, creating random user")
+            return make_random_user(rng)
             
-        # If the string looks like it already has the JSON parsed (might be a dict)
+        # Character data from the agent has already been validated
         if isinstance(json_string, dict):
             char_data = json_string
-            print("Input was already a dictionary")
         else:
-            # Handle different formats - try to extract JSON if wrapped in other text
-            json_string = str(json_string).strip()
-            
-            # Look for JSON brackets if there might be extra text
-            start_idx = json_string.find('{')
-            end_idx = json_string.rfind('}')
-            
-            if start_idx >= 0 and end_idx > start_idx:
-                json_string = json_string[start_idx:end_idx+1]
-                print("Extracted JSON from string")
-            
-            print("Parsing JSON string:", json_string[:100] + "..." if len(json_string) > 100 else json_string)
-            
-            # Parse the JSON string
-            char_data = json.loads(json_string)
+            # Read the JSON with the shared parser, repairing invalid fields
+            char_data = parse(str(json_string), CHARACTER, "parse_character_json", rng).data
         
         # Generate a random user ID
-        user_id = random.randint(10000, 99999)
+        user_id = rng.randint(10000, 99999)
         
         # Create a new User object with basic info
         user = User(
@@ -207,12 +214,10 @@ def parse_character_json(json_string):
         if "background" in char_data:
             user.background = char_data["background"]
         
-        print(f"Successfully created character: {user.name}, {user.character_class}")
+        logger.info("Created character %s, %s", user.name, user.character_class)
         return user
     except Exception as e:
-        import traceback
-        print(f"Error parsing character JSON: {e}")
-        print(f"JSON string (first 200 chars): {str(json_string)[:200]}")
-        print(traceback.format_exc())
+        # The traceback is formatted by the logging thread, not here
+        logger.exception("Error parsing character JSON: %s", e, extra={"json_start": str(json_string)[:200]})
         # Return a default user if parsing fails
-        return make_random_user()
+        return make_random_user(rng)
@@ -1,23 +1,21 @@
 from typing import Dict, List
 import random
 from user import User
-import os
 import asyncio
+import logging
 import time
 
+from budget import CACHED, LOCAL
+from tracing import span
+from scheduler import current_guild
+from state import get_backend
+
+logger = logging.getLogger(__name__)
+
 class Village:
-    def __init__(self, agent=None):
-         # Load API configuration
-        self.api_key = os.getenv('MISTRAL_API_KEY')
-        if not self.api_key:
-            raise ValueError("MISTRAL_API_KEY not found in environment variables")
-            
-        self.api_url = "https://api.mistral.ai/v1/chat/completions"
+    def __init__(self, agent=None, rng=None):
         self.agent = agent
-        
-        # Rate limiting parameters
-        self.last_request_time = 0
-        self.min_request_interval = 1.0  # Minimum 1 second between requests
+        self.rng = rng or random.Random()  # Per-session RNG so a recorded seed replays the same shop
 
         self.shop_items = {}  # Will be populated by API call
         self.special_items = {}  # Keep special items for now
@@ -51,12 +49,22 @@ class Village:
     
     async def refresh_shop_items(self, story_info=None):
         """Refresh shop inventory using the Mistral API"""
+        level = self.agent.degradation_level() if self.agent else LOCAL
+        if level >= CACHED and self.shop_items:
+            # Token budget is running low: keep selling the current stock
+            return True
+        if level >= CACHED and await self.load_shared_stock():
+            # ...or the stock another session in this guild generated recently
+            return True
         self.shop_items = {}
         try:
-            items_data = await self.agent.generate_village_items(
-                existing_items=self.shop_items,
-                story_info=story_info
-            )
+            if level >= LOCAL:
+                raise RuntimeError("token budget used up, using the basic stock")
+            with span("village.refresh_shop"):
+                items_data = await self.agent.generate_village_items(
+                    existing_items=self.shop_items,
+                    story_info=story_info
+                )
             # Convert API response format to our shop format
             new_shop_items = {}
             for item in items_data["items"]:
@@ -68,22 +76,23 @@ class Village:
                 
                 # Add stats based on item type
                 if item["type"] == "Weapon":
-                    item_stats["attack"] = random.randint(5, 15)
+                    item_stats["attack"] = self.rng.randint(5, 15)
                 elif item["type"] == "Armor":
-                    item_stats["defense"] = random.randint(3, 10)
+                    item_stats["defense"] = self.rng.randint(3, 10)
                 elif item["type"] == "Potion":
-                    item_stats["heal"] = random.randint(20, 50)
+                    item_stats["heal"] = self.rng.randint(20, 50)
                 elif item["type"] == "Magical":
                     # Random stat boost
-                    stat = random.choice(["Strength", "Wisdom", "Intelligence", "Charisma"])
-                    item_stats["stat_boost"] = {stat: random.randint(1, 3)}
+                    stat = self.rng.choice(["Strength", "Wisdom", "Intelligence", "Charisma"])
+                    item_stats["stat_boost"] = {stat: self.rng.randint(1, 3)}
                 
                 new_shop_items[item["name"]] = item_stats
             
             self.shop_items = new_shop_items
+            await self.save_shared_stock()
             return True
         except Exception as e:
-            print(f"Error refreshing shop items: {e}")
+            logger.error("Error refreshing shop items: %s", e)
             # Fallback to some basic items if API fails
             self.shop_items = {
                 "Health Potion": {"price": 50, "heal": 30, "description": "Restores 30 HP"},
@@ -91,6 +100,29 @@ class Village:
             }
             return False
 
+    # Shop stock is cached per guild in the shared state backend for this many seconds
+    SHARED_STOCK_TTL = 1800
+
+    def shared_stock_key(self) -> str:
+        return f"shop:{current_guild.get()}"
+
+    async def save_shared_stock(self):
+        try:
+            await get_backend().set(self.shared_stock_key(), self.shop_items, ttl=self.SHARED_STOCK_TTL)
+        except Exception as e:
+            logger.warning("Could not cache shop stock: %s", e)
+
+    async def load_shared_stock(self) -> bool:
+        try:
+            stock = await get_backend().get(self.shared_stock_key())
+        except Exception as e:
+            logger.warning("Could not read cached shop stock: %s", e)
+            return False
+        if not stock:
+            return False
+        self.shop_items = stock
+        return True
+
     def calculate_price_modifier(self, user: User) -> float:
         """Calculate price modifier based on Charisma"""
         # Base discount is 1% per point of Charisma above 10